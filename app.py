@@ -1,4 +1,5 @@
 import os
+import atexit
 import jwt
 import json
 from datetime import datetime, timedelta, timezone
@@ -9,13 +10,22 @@ from flask_bcrypt import Bcrypt
 
 from werkzeug.utils import secure_filename
 
-from main_agent import get_agent_and_checkpointer
+from main_agent import get_agent_and_checkpointer, get_checkpointer
+from state import Context, SHORT_MEMORY_WINDOW
 picture_dir_name = 'talk_picture'
 if not os.path.exists(picture_dir_name):
     os.makedirs(picture_dir_name)
 from langchain_core.messages import HumanMessage, AIMessage
-from get_character_full_data import get_db, SimpleDatabase
+from get_character_full_data import get_db, SimpleDatabase, close_writers, init_schema
+from picture_jobs import submit_talk_picture, is_talk_picture_pending, awaiting_talk_picture
+from image_store import IMAGE_EXTENSIONS
+from embedding_cache import embedding_cache
+from media_urls import MediaSigner, MEDIA_CACHE_CONTROL, MEDIA_REVALIDATE_CACHE_CONTROL, content_etag
+from job_queue import job_queue
+from image_intent import image_intent_filter
+from memory import warm_up, is_warm
 import re
+import threading
 
 # --- 应用和数据库配置 ---
 app = Flask(__name__, static_folder='static', static_url_path='')
@@ -25,6 +35,11 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = 'a_very_secret_key_that_should_be_changed' ##需要修改
 app.config['UPLOAD_FOLDER'] = os.path.join(basedir, 'uploads')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+# 图片与头像的签名地址，同一时间窗口内地址不变，浏览器可以缓存
+media_signer = MediaSigner(app.config['SECRET_KEY'])
+# 聊天记录分页的默认/最大每页条数
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
 
 if not os.path.exists(app.config['UPLOAD_FOLDER']):
     os.makedirs(app.config['UPLOAD_FOLDER'])
@@ -63,11 +78,23 @@ def get_true_filename(image_path,user_id):
     # 检查image_path是否为None
     if image_path is None:
         return ""
-    temp_token = generate_temp_access_token(user_id, image_path)
-    return "/picture/{a}?token={temp_token}".format(a=image_path.replace('\\', '/'), temp_token=temp_token)
+    return media_signer.url('/picture', image_path, user_id)
+
+
+def avatar_url(avatar_path, user_id):
+    """头像的签名地址；头像文件名带上传时间戳，内容不会变化。"""
+    if not avatar_path:
+        return None
+    return media_signer.url('/uploads', avatar_path, user_id)
 
 
 # --- 认证与辅助函数 ---
+def load_user_from_token(token):
+    """解码会话令牌并返回对应用户；令牌无效时抛出 jwt 异常，用户不存在时返回 None。"""
+    data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
+    return User.query.get(data['user_id'])
+
+
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -81,8 +108,7 @@ def token_required(f):
 
         if not token: return jsonify({'message': '令牌缺失!'}), 401
         try:
-            data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
-            current_user = User.query.get(data['user_id'])
+            current_user = load_user_from_token(token)
             if not current_user: return jsonify({'message': '用户未找到!'}), 401
             g.current_user = current_user
         except (jwt.ExpiredSignatureError, jwt.InvalidTokenError) as e:
@@ -92,14 +118,6 @@ def token_required(f):
     return decorated
 
 
-def generate_temp_access_token(user_id, filename):
-    # 确保文件名使用网络友好的正斜杠
-    normalized_filename = filename.replace('\\', '/')
-    payload = {'user_id': user_id, 'filename': normalized_filename,
-               'exp': datetime.now(timezone.utc) + timedelta(minutes=10)}
-    return jwt.encode(payload, app.config['SECRET_KEY'], algorithm="HS256")
-
-
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -110,41 +128,40 @@ def serve_index():
     return send_from_directory(app.static_folder, 'index.html')
 
 
-@app.route('/uploads/<path:filename>')
-@token_required  # 现在这个装饰器可以处理查询参数中的令牌
-def serve_secure_file(filename):
-    # token_required 装饰器现在处理认证。
-    # 我们只需要确保用户有权访问此头像，但为简单起见，
-    # 只要他们已登录，我们就提供服务。
-    # 更严格的检查会验证此头像是否属于当前用户的角色。
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+def send_media(directory, filename):
+    """
+    发送媒体文件，由 Werkzeug 处理 If-None-Match（304）与 Range（206）请求。
+    只有按内容哈希命名的文件带 Cache-Control: immutable；旧的按时间命名的配图和头像可能被覆盖，
+    使用 Werkzeug 计算的 ETag 并要求浏览器每次重新验证。
+    """
+    etag = content_etag(filename)
+    response = send_from_directory(directory, filename, etag=etag)
+    response.headers['Cache-Control'] = MEDIA_CACHE_CONTROL if etag is not True else MEDIA_REVALIDATE_CACHE_CONTROL
+    return response
 
 
-@app.route('/picture/<path:filename>')
-def serve_picture_file(filename):
-    token = request.args.get('token')
-    if not token:
-        return "访问令牌缺失", 403
-    try:
-        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
-
-        # *** 核心修复：解决403错误 ***
-        # 规范化两个路径，使用正斜杠以便进行一致的比较
-        token_filename = payload.get('filename', '').replace('\\', '/')
-        requested_filename = filename.replace('\\', '/')
+def verify_media_request(filename):
+    """校验签名地址中的访问范围、过期时间与签名。"""
+    args = request.args
+    return media_signer.verify(filename, args.get('s'), args.get('e'), args.get('sig'))
 
-        if token_filename != requested_filename:
-            print(f"访问被拒绝：令牌文件名 '{token_filename}' 与请求的文件名 '{requested_filename}' 不匹配")
-            return "令牌与文件不匹配", 403
 
-        # 假设代理将图片保存到基础目录中
-        return send_from_directory(basedir, filename)
-    except (jwt.ExpiredSignatureError, jwt.InvalidTokenError) as e:
-        print(f"令牌错误，文件名 {filename}: {e}")
+@app.route('/uploads/<path:filename>')
+def serve_secure_file(filename):
+    # 头像地址由 avatar_url 按用户ID签名，只需一次 HMAC 校验，无需解码会话令牌
+    if not verify_media_request(filename):
         return "访问令牌无效或已过期", 403
+    return send_media(app.config['UPLOAD_FOLDER'], filename)
 
 
-
+@app.route('/picture/<path:filename>')
+def serve_picture_file(filename):
+    # 签名与会话ID和文件路径绑定，地址被改到其他文件上时校验失败
+    if not verify_media_request(filename):
+        print(f"访问被拒绝：文件 '{filename}' 的签名无效或已过期")
+        return "访问令牌无效或已过期", 403
+    # 假设代理将图片保存到基础目录中
+    return send_media(basedir, filename)
 
 
 # --- API 路由 ---
@@ -180,18 +197,13 @@ def login():
 @app.route('/api/characters', methods=['GET'])
 @token_required
 def get_characters():
-    # 令牌现在位于 g.current_user 中，如果需要可以从那里获取，
-    # 但最好还是传递原始请求中的会话令牌。
-    auth_header = request.headers.get('Authorization')
-    token = auth_header.split(" ")[1] if auth_header else request.args.get('token')
-
     characters = Character.query.filter_by(user_id=g.current_user.id).all()
     char_list = [{
         'id': char.id,
         'name': char.name,
         'description': char.description,
         'first_talk': char.first_talk,
-        'avatar_url': f"/uploads/{char.avatar_path}?token={token}" if char.avatar_path else None
+        'avatar_url': avatar_url(char.avatar_path, g.current_user.id)
     } for char in characters]
     return jsonify(char_list)
 
@@ -225,9 +237,6 @@ def create_character():
     conversation_id = f"char_{new_char.id}_chat"
     app_db.add_chat_message(conversation_id, 'ai', new_char.first_talk)
 
-    auth_header = request.headers.get('Authorization')
-    token = auth_header.split(" ")[1] if auth_header else request.args.get('token')
-
     return jsonify({
         'message': '角色创建成功',
         'character': {
@@ -235,7 +244,7 @@ def create_character():
             'name': new_char.name,
             'description': new_char.description,
             'first_talk': new_char.first_talk,
-            'avatar_url': f"/uploads/{new_char.avatar_path}?token={token}" if new_char.avatar_path else None
+            'avatar_url': avatar_url(new_char.avatar_path, g.current_user.id)
         }
     }), 201
 
@@ -246,6 +255,121 @@ def sse_format(data: dict) -> str:
     return f"data: {json.dumps(data)}\n\n"
 
 
+def history_to_messages(rows):
+    """把 chat_history 中的记录转换为 LangChain 消息。"""
+    return [HumanMessage(content=row['content'] or '') if row['message_type'] == 'human'
+            else AIMessage(content=row['content'] or '') for row in rows]
+
+
+def build_talk_input(app_db, state, character, conversation_id, text):
+    """
+    根据检查点中的状态或数据库中的聊天记录，为代理准备本轮输入。
+    同步（Flask）与异步（ASGI）两条聊天链路共用此函数。
+    有检查点时只传入本轮新增的用户消息，由 short_memory 的窗口 reducer 合并；
+    没有检查点时只从 chat_history 读取最近 SHORT_MEMORY_WINDOW 条消息作为初始窗口。
+    """
+    # 为代理准备输入
+    if not state:
+        # 本轮的用户消息已经写入 chat_history
+        total = app_db.count_chat_messages(conversation_id)
+        if total <= 1:
+            print('新建聊天')
+            # 这是用户在此对话中的第一条消息
+            input_data = {
+                'short_memory': [AIMessage(content=character.first_talk), HumanMessage(content=text)],
+            }
+        else:
+            print(f'未找到检查点，从聊天记录中读取最近 {SHORT_MEMORY_WINDOW} 条')
+            recent = app_db.get_recent_chat_history(conversation_id, SHORT_MEMORY_WINDOW)
+            input_data = {
+                'short_memory': history_to_messages(recent),
+                'talk_number': int(total / 2) - 4 if total <= 400 else int(total / 2) % 80,
+            }
+    else:
+        print("找到历史记录，追加新消息。")
+        input_data = {'short_memory': [HumanMessage(content=text)]}
+
+    input_data['character_name'] = character.name
+    input_data['character_profile'] = character.description
+    return input_data
+
+
+def talk_context(conversation_id, page='optimize_memory'):
+    """构建本次运行的上下文：user_id 用于区分长期记忆集合，page 决定工作流走向。"""
+    return Context(user_id=conversation_id, page=page)
+
+
+def save_moment_posts(app_db, conversation_id, moment_message, picture_paths):
+    """按 dynamic_condition_1..3 的顺序把朋友圈文案与对应图片路径写入数据库。"""
+    # 几条动态一起提交给写线程（通常在同一个事务中提交），任务结束前等待它们全部落盘
+    futures = [app_db.add_social_post(conversation_id, moment_message[k]['scheme'],
+                                      moment_message[k]['label'], moment_message[k]['time'], v_path)
+               for k, v_path in zip(moment_message.keys(), picture_paths)]
+    for future in futures:
+        future.result()
+
+
+# --- 后台任务：朋友圈与日记 ---
+def run_moment_job(payload):
+    """在 char_{id}_text 线程上运行朋友圈生成，并写入数据库。"""
+    agent, checkpointer = get_agent_and_checkpointer()
+    final_state = payload['state']
+    moment_thread_config = {"configurable": {"thread_id": payload['generate_id']}}
+    context = talk_context(payload['conversation_id'], 'generate_dynamic_condition')
+    moment_message = {}
+    saved = 0
+    app_db = SimpleDatabase()
+    try:
+        for chunk in agent.stream(final_state, moment_thread_config, stream_mode="updates", context=context):
+            if 'generate_dynamic_condition' in chunk:
+                moment_message = chunk['generate_dynamic_condition']['dynamic_condition']
+            if 'generate_dynamic_condition_picture' in chunk:
+                picture_paths = chunk['generate_dynamic_condition_picture']['dynamic_condition_picture_path']
+                save_moment_posts(app_db, payload['conversation_id'], moment_message, picture_paths)
+                saved = len(moment_message)
+    finally:
+        app_db.close()
+    return {'posts': saved}
+
+
+def run_diary_job(payload):
+    """在 char_{id}_text 线程上运行日记生成，并写入数据库。"""
+    agent, checkpointer = get_agent_and_checkpointer()
+    final_state = payload['state']
+    diary_thread_config = {"configurable": {"thread_id": payload['generate_id']}}
+    context = talk_context(payload['conversation_id'], 'generate_diary')
+    app_db = SimpleDatabase()
+    try:
+        for chunk in agent.stream(final_state, diary_thread_config, stream_mode="updates", context=context):
+            if 'generate_diary' in chunk:
+                app_db.add_diary_entry(payload['conversation_id'], chunk['generate_diary']['diary'], wait=True)
+    finally:
+        app_db.close()
+    return {'diary': 1}
+
+
+job_queue.register('moment', run_moment_job)
+job_queue.register('diary', run_diary_job)
+
+
+def enqueue_post_talk_jobs(final_state, talk_number, conversation_id, generate_id):
+    """
+    根据对话次数决定是否入队朋友圈/日记任务，返回需要推送给客户端的事件列表。
+    请求本身只负责入队，生成过程由任务队列的工作线程完成。
+    """
+    events = []
+    payload = {'state': final_state, 'conversation_id': conversation_id, 'generate_id': generate_id}
+    # 检查是否生成朋友圈动态
+    if talk_number > 0 and talk_number < 80 and talk_number % 30 == 0:
+        job_id = job_queue.enqueue('moment', generate_id, payload)
+        events.append({'type': 'event', 'event_name': 'moment_job_queued', 'job_id': job_id})
+    # 检查是否生成日记
+    if talk_number == 60:
+        job_id = job_queue.enqueue('diary', generate_id, payload)
+        events.append({'type': 'event', 'event_name': 'diary_job_queued', 'job_id': job_id})
+    return events
+
+
 @app.route('/api/start_talk', methods=['POST'])
 @token_required
 def start_talk():
@@ -285,78 +409,35 @@ def start_talk():
             state = agent.get_state(thread_config).values
             print(f"开始对话，角色ID: {character_id}, 姓名: {character.name}")
             print("当前状态:", state)
-            # 为代理准备输入
-            if not state:
-                all_message = app_db.get_chat_history(conversation_id)
-                if len(all_message) == 0:
-                    print('新建聊天')
-                    # 这是用户在此对话中的第一条消息
-                    input_data = {
-                        'short_messages': [AIMessage(content=character.first_talk), HumanMessage(content=text)],
-                        'page': 'get_long_message',
-                        'character_name': character.name,
-                        'character_profile': character.description,
-                        'user_id': conversation_id
-                    }
-                elif len(all_message) <= 400:
-                    print('聊天内容过短,全部读取')
-                    input_data = {
-                        'short_messages': all_message,
-                        'page': 'get_long_message',
-                        'character_name': character.name,
-                        'character_profile': character.description,
-                        'user_id': conversation_id,
-                        'talk_number': int(len(all_message) / 2)-4,
-                    }
-                    print(input_data)
-                else:
-                    num =int( len(all_message) / 2)
-                    num = num % 80
-                    print('聊天内容过长,只读取最后400条')
-                    input_data = {
-                        'short_messages': all_message[-400:],
-                        'page': 'get_long_message',
-                        'character_name': character.name,
-                        'character_profile': character.description,
-                        'user_id': conversation_id,
-                        'talk_number': num
-                    }
-            else:
-                print("找到历史记录，追加新消息。")
-                input_data = state
-                input_data['short_messages'].append(HumanMessage(content=text))
-                input_data['page'] = 'get_long_message'
-                input_data['character_name'] = character.name
-                input_data['character_profile'] = character.description
-
+            input_data = build_talk_input(app_db, state, character, conversation_id, text)
             print("给代理的输入:", input_data)
 
 
             ai_full_message = ''
-            # 使用同步的 agent.stream 方法
-            for chunk in agent.stream(input_data, thread_config, stream_mode="updates"):
+            image_prompt = None
+            # 使用同步的 agent.stream 方法，同时订阅节点更新和 generate_talk 推送的逐token片段
+            for mode, chunk in agent.stream(input_data, thread_config, stream_mode=["updates", "custom"],
+                                            context=talk_context(conversation_id)):
+                if mode == 'custom':
+                    if chunk.get('type') == 'delta':
+                        yield sse_format({'type': 'delta', 'content': chunk['content']})
+                    continue
                 if 'generate_talk' in chunk:
-                    messages = chunk['generate_talk'].get('short_messages', [])
+                    messages = chunk['generate_talk'].get('short_memory', [])
+                    # 配图附言模式下回复会附带配图提示词（空字符串表示不配图），否则为 None
+                    image_prompt = chunk['generate_talk'].get('image_prompt')
                     if messages:
                         # 最后一条消息是AI的回复
                         ai_full_message = messages[-1].content
                         yield sse_format({'type': 'text', 'content': ai_full_message})
 
-                if 'generate_talk_picture' in chunk:
-                    image_path = chunk['generate_talk_picture']['picture_path']
-
-                    if image_path:
-                        image_url=get_true_filename(image_path,conversation_id)
-                        # 在数据库中用图片URL更新AI消息
-                        app_db.add_chat_message(conversation_id=conversation_id, message_type='ai',
-                                                content=ai_full_message, image_url=image_path)
-                        yield sse_format({'type': 'image', 'url': image_url})
-                    else:
-                        # 如果没有图片，只保存文本消息
-                        app_db.add_chat_message(conversation_id=conversation_id, message_type='ai',
-                                                content=ai_full_message, image_url='')
-                        yield sse_format({'type': 'image', 'url': ''})
-
+            # 文字回复一就绪就先入库并结束本轮回复，配图在后台生成后写回该行（生成期间 image_url 为 NULL）
+            with_picture = image_prompt != ''
+            message_id = app_db.add_chat_message(conversation_id=conversation_id, message_type='ai',
+                                                 content=ai_full_message, image_url=None if with_picture else '')
+            if with_picture:
+                submit_talk_picture(message_id, ai_full_message, image_prompt)
+                yield sse_format({'type': 'image_pending', 'message_id': message_id})
             yield sse_format({'type': 'done'})
             # --- 对话后事件生成 (朋友圈、日记) ---
             # 再次使用同步的 get_state 获取最终状态
@@ -365,36 +446,8 @@ def start_talk():
             talk_number = final_state.get('talk_number', 0)
             print(f"对话结束，当前对话次数: {talk_number}")
 
-            # 检查是否生成朋友圈动态
-            if talk_number > 0 and talk_number < 80 and talk_number % 30 == 0:
-                moment_thread_config = {"configurable": {"thread_id": generate_id}}
-                final_state['page'] = 'generate_dynamic_condition'
-                moment_message = {}
-                # 使用同步流
-                for chunk in agent.stream(final_state, moment_thread_config, stream_mode="updates"):
-                    if 'generate_dynamic_condition' in chunk:
-                        moment_message = chunk['generate_dynamic_condition']['dynamic_condition']
-                    if 'generate_dynamic_condition_picture' in chunk:
-                        picture_paths = chunk['generate_dynamic_condition_picture']['dynamic_condition_picture_path']
-                        for k, v_path in zip(moment_message.keys(), picture_paths):
-                            # 在应用上下文中执行数据库操作
-                            with app.app_context():
-                                app_db.add_social_post(conversation_id, moment_message[k]['scheme'],
-                                                       moment_message[k]['label'], moment_message[k]['time'], v_path)
-                yield sse_format({'type': 'event', 'event_name': 'new_moment_available'})
-
-            # 检查是否生成日记
-            if talk_number == 60:
-                diary_thread_config = {"configurable": {"thread_id": generate_id}}
-                final_state['page'] = 'generate_diary'
-                # 使用同步流
-                for chunk in agent.stream(final_state, diary_thread_config, stream_mode="updates"):
-                    if 'generate_diary' in chunk:
-                        diary_content = chunk['generate_diary']['diary']
-                        # 在应用上下文中执行数据库操作
-                        with app.app_context():
-                            app_db.add_diary_entry(conversation_id, diary_content)
-                yield sse_format({'type': 'event', 'event_name': 'new_diary_available'})
+            for event in enqueue_post_talk_jobs(final_state, talk_number, conversation_id, generate_id):
+                yield sse_format(event)
 
         except Exception as e:
             print(f"事件流中发生错误: {e}")
@@ -410,7 +463,8 @@ def start_talk():
 def extract_path(text):
     # 正则表达式模式
     # 注意在Python字符串中，'\'本身也需要转义，所以'\\'变成了'\\\\'
-    pattern = re.compile(r"(talk_picture[/\\]+.*?\.png)")
+    # 兼容旧的按时间命名的 PNG 与按内容哈希命名的 talk_picture/ab/<哈希>.webp 等
+    pattern = re.compile(r"(talk_picture[/\\]+[^\s'\"]*?\.(?:%s))" % '|'.join(IMAGE_EXTENSIONS))
     match = pattern.search(text)
     if match:
         # 提取捕获组1的内容，并统一替换反斜杠为正斜杠
@@ -424,17 +478,103 @@ def get_chat_history(character_id):
     if not character:
         return jsonify({'message': '角色未找到或无权访问'}), 404
 
+    # 游标分页：?before=<消息ID> 向前翻页，?after=<消息ID> 读取更新的消息，都不传时返回最新一页。
+    # 格式错误的游标直接返回 400，而不是退回最新一页（否则客户端会在第一页上反复翻页）
+    try:
+        before_id = int(request.args['before']) if 'before' in request.args else None
+        after_id = int(request.args['after']) if 'after' in request.args else None
+        limit = max(1, min(int(request.args.get('limit', HISTORY_PAGE_SIZE)), HISTORY_MAX_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'message': '分页参数无效'}), 400
+
     app_db = get_db()
     conversation_id = f"char_{character.id}_chat"
-    history = app_db.get_chat_history(conversation_id)
-    full_history=[]
+    history, has_more = app_db.get_chat_history_page(conversation_id, before_id=before_id, after_id=after_id,
+                                                     limit=limit)
+    # 只为本页中的图片生成签名地址
     for h in history:
         if h['image_url']:
             path = extract_path(h['image_url'])
-            img_url=get_true_filename( path,conversation_id)
-            h['image_url'] = img_url
-        full_history.append(h)
-    return jsonify(full_history)
+            h['image_url'] = get_true_filename(path, conversation_id)
+    return jsonify({
+        'messages': history,
+        'has_more': has_more,
+        # 下一次向前翻页时传入的 before
+        'next_before': history[0]['id'] if history else None,
+    })
+
+
+@app.route('/api/characters/<int:character_id>/messages/<int:message_id>/image', methods=['GET'])
+@token_required
+def get_message_image(character_id, message_id):
+    """轮询某条AI消息的后台配图结果。"""
+    character = Character.query.filter_by(id=character_id, user_id=g.current_user.id).first()
+    if not character:
+        return jsonify({'message': '角色未找到或无权访问'}), 404
+
+    # 先查进程内的任务状态再读消息行：任务结束时先写回图片、后移除标记
+    pending = is_talk_picture_pending(message_id)
+    app_db = get_db()
+    conversation_id = f"char_{character.id}_chat"
+    message = app_db.get_chat_message(conversation_id, message_id)
+    if not message:
+        return jsonify({'message': '消息不存在'}), 404
+    if pending or awaiting_talk_picture(message):
+        return jsonify({'status': 'pending', 'url': ''})
+    path = extract_path(message['image_url']) if message['image_url'] else None
+    return jsonify({'status': 'done', 'url': get_true_filename(path, conversation_id)})
+
+
+@app.route('/api/characters/<int:character_id>/jobs/<int:job_id>', methods=['GET'])
+@token_required
+def get_job_status(character_id, job_id):
+    """查询朋友圈/日记后台任务的状态。"""
+    character = Character.query.filter_by(id=character_id, user_id=g.current_user.id).first()
+    if not character:
+        return jsonify({'message': '角色未找到或无权访问'}), 404
+    job = job_queue.get_job(job_id)
+    if not job or job['thread_id'] != f"char_{character.id}_text":
+        return jsonify({'message': '任务不存在'}), 404
+    return jsonify(job)
+
+
+@app.route('/api/characters/<int:character_id>/jobs', methods=['GET'])
+@token_required
+def list_jobs(character_id):
+    """列出角色最近的后台任务。"""
+    character = Character.query.filter_by(id=character_id, user_id=g.current_user.id).first()
+    if not character:
+        return jsonify({'message': '角色未找到或无权访问'}), 404
+    return jsonify(job_queue.get_jobs_for_thread(f"char_{character.id}_text"))
+
+
+@app.route('/api/warmup', methods=['GET', 'POST'])
+@token_required
+def warmup():
+    """GET 查询记忆模型是否已加载；POST 立即加载（已加载时直接返回），可供部署脚本或健康检查调用。"""
+    if request.method == 'GET':
+        return jsonify({'warm': is_warm()})
+    try:
+        timings = warm_up()
+    except Exception:
+        import traceback
+        traceback.print_exc()
+        return jsonify({'warm': False, 'message': '预热失败'}), 500
+    return jsonify({'warm': True, 'timings': timings})
+
+
+@app.route('/api/metrics/image_intent', methods=['GET'])
+@token_required
+def image_intent_metrics():
+    """聊天配图本地预筛的阈值、命中率与模型判断统计。"""
+    return jsonify(image_intent_filter.metrics())
+
+
+@app.route('/api/metrics/embedding_cache', methods=['GET'])
+@token_required
+def embedding_cache_metrics():
+    """嵌入向量缓存的命中率、条数与淘汰统计。"""
+    return jsonify(embedding_cache.stats())
 
 
 @app.route('/api/get_dynamic_text', methods=['GET'])
@@ -485,17 +625,64 @@ def close_connection(exception):
 
 
 # --- 主程序入口 ---
-if __name__ == '__main__':
+def init_databases():
+    """创建用户/角色表并初始化记忆数据库。Flask 与 ASGI 两种启动方式共用。"""
     with app.app_context():
         db.create_all()
-        # 初始化DatabaseManager数据库，确保chat_memories表存在
-        from get_memory import DatabaseManager
+        # 初始化共享的记忆数据库，按迁移创建记忆表（旧的 chat_memories 会被拆分为消息表与标签关联表）
+        from get_memory import memory_db
+        memory_db.initialize()
+    job_queue.initialize()
+    # chat_data.db 的建表与迁移只在启动时执行一次
+    init_schema()
 
 
-        def init_db_manager():
-            db_manager = DatabaseManager()
-            db_manager.initialize()
+def start_background_workers():
+    """
+    启动朋友圈/日记任务队列的工作线程与检查点压缩线程，进程退出时等待当前任务结束。
+    设置环境变量 MEMORY_WARMUP=1 时，同时在后台线程中预加载记忆模型，不阻塞启动。
+    """
+    # atexit 按注册的逆序执行：最先注册，保证其他工作线程停止后再写完排队中的数据库写入
+    atexit.register(close_writers)
+    job_queue.start()
+    atexit.register(job_queue.stop)
+    # 定期删除对话检查点中超出保留数量的旧检查点
+    checkpointer = get_checkpointer()
+    checkpointer.start_compaction()
+    atexit.register(checkpointer.stop_compaction)
+    if os.environ.get('MEMORY_WARMUP') == '1':
+        threading.Thread(target=warm_up, name='memory_warmup', daemon=True).start()
+
 
+_startup_lock = threading.Lock()
+_started = False
 
-        init_db_manager()
+
+def ensure_started():
+    """
+    初始化数据库并启动后台工作线程，每个进程只执行一次。
+    由 before_request 在第一个请求前调用，因此 gunicorn / waitress / flask run 等任何 WSGI 服务器下都会启动；
+    多进程部署时每个工作进程各自启动，任务由 SQLite 队列原子领取，不会重复执行。
+    """
+    global _started
+    if _started:
+        return
+    with _startup_lock:
+        if _started:
+            return
+        init_databases()
+        start_background_workers()
+        _started = True
+
+
+@app.before_request
+def start_on_first_request():
+    ensure_started()
+
+
+if __name__ == '__main__':
+    # debug 模式下重载器的父进程不处理请求，不在其中启动工作线程；
+    # 实际运行应用的子进程（或未启用重载器时的当前进程）在启动时或第一个请求前启动
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        ensure_started()
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -0,0 +1,140 @@
+# asgi.py
+"""
+ASGI 入口：聊天接口 /api/start_talk 在事件循环上通过 agent.astream 原生异步执行，
+其余路由仍由原有的 Flask 应用处理（通过 WSGI 适配挂载）。
+
+运行方式：
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+
+每个进行中的对话只占用一个协程而不是一个工作线程，大部分时间都在等待网络，
+因此单个进程即可同时承载大量对话。SSE 事件格式与 Flask 版本完全一致。
+"""
+import contextlib
+
+import jwt
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+from app import app as flask_app, db, Character, load_user_from_token, sse_format, build_talk_input, \
+    talk_context, enqueue_post_talk_jobs, ensure_started
+from get_character_full_data import SimpleDatabase
+from main_agent import get_agent_and_checkpointer
+from picture_jobs import asubmit_talk_picture
+
+
+def authenticate(token, character_id):
+    """在线程池中执行：校验令牌并加载角色，返回 (character, 错误信息, 状态码)。"""
+    with flask_app.app_context():
+        try:
+            user = load_user_from_token(token)
+        except (jwt.ExpiredSignatureError, jwt.InvalidTokenError) as e:
+            return None, f'令牌无效或已过期! {e}', 401
+        if not user:
+            return None, '用户未找到!', 401
+        character = Character.query.filter_by(id=character_id, user_id=user.id).first()
+        if not character:
+            return None, '角色未找到或您无权访问', 404
+        # 脱离会话后仍需访问这些属性
+        db.session.expunge(character)
+        return character, None, 200
+
+
+async def start_talk(request):
+    """异步版本的 /api/start_talk，SSE 事件与 Flask 版本保持一致。"""
+    token = None
+    auth_header = request.headers.get('Authorization')
+    if auth_header:
+        token = auth_header.split(" ")[1]
+    if not token:
+        token = request.query_params.get('token')
+    if not token:
+        return JSONResponse({'message': '令牌缺失!'}, status_code=401)
+
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not data or 'text' not in data or 'character_id' not in data:
+        return JSONResponse({'message': '请求缺少 text 或 character_id'}, status_code=400)
+
+    text = data.get('text')
+    character_id = data.get('character_id')
+    character, error, status = await run_in_threadpool(authenticate, token, character_id)
+    if not character:
+        return JSONResponse({'message': error}, status_code=status)
+
+    async def event_stream():
+        app_db = None
+        try:
+            app_db = SimpleDatabase()
+            agent, checkpointer = get_agent_and_checkpointer(asynchronous=True)
+            conversation_id = f"char_{character_id}_chat"
+            generate_id = f"char_{character_id}_text"  # 用于朋友圈/日记
+            await run_in_threadpool(app_db.add_chat_message, conversation_id, 'human', text)
+
+            thread_config = {"configurable": {"thread_id": conversation_id}}
+            state = (await agent.aget_state(thread_config)).values
+            print(f"开始对话(异步)，角色ID: {character_id}, 姓名: {character.name}")
+            input_data = await run_in_threadpool(build_talk_input, app_db, state, character, conversation_id, text)
+
+            ai_full_message = ''
+            image_prompt = None
+            async for mode, chunk in agent.astream(input_data, thread_config, stream_mode=["updates", "custom"],
+                                                   context=talk_context(conversation_id)):
+                if mode == 'custom':
+                    if chunk.get('type') == 'delta':
+                        yield sse_format({'type': 'delta', 'content': chunk['content']})
+                    continue
+                if 'generate_talk' in chunk:
+                    messages = chunk['generate_talk'].get('short_memory', [])
+                    image_prompt = chunk['generate_talk'].get('image_prompt')
+                    if messages:
+                        ai_full_message = messages[-1].content
+                        yield sse_format({'type': 'text', 'content': ai_full_message})
+
+            with_picture = image_prompt != ''
+            message_id = await run_in_threadpool(app_db.add_chat_message, conversation_id, 'ai',
+                                                 ai_full_message, None if with_picture else '')
+            if with_picture:
+                asubmit_talk_picture(message_id, ai_full_message, image_prompt)
+                yield sse_format({'type': 'image_pending', 'message_id': message_id})
+            yield sse_format({'type': 'done'})
+            # --- 对话后事件生成 (朋友圈、日记) ---
+            final_state_result = await agent.aget_state(thread_config)
+            final_state = final_state_result.values if final_state_result else {}
+            talk_number = final_state.get('talk_number', 0)
+            print(f"对话结束，当前对话次数: {talk_number}")
+
+            events = await run_in_threadpool(enqueue_post_talk_jobs, final_state, talk_number,
+                                              conversation_id, generate_id)
+            for event in events:
+                yield sse_format(event)
+
+        except Exception as e:
+            print(f"事件流中发生错误: {e}")
+            import traceback
+            traceback.print_exc()
+            yield sse_format({'type': 'error', 'content': str(e)})
+        finally:
+            if app_db:
+                app_db.close()
+
+    return StreamingResponse(event_stream(), media_type='text/event-stream')
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_app):
+    await run_in_threadpool(ensure_started)
+    yield
+
+
+application = Starlette(
+    routes=[
+        Route('/api/start_talk', start_talk, methods=['POST']),
+        Mount('/', app=WSGIMiddleware(flask_app)),
+    ],
+    lifespan=lifespan,
+)
@@ -1,42 +1,17 @@
-from typing import TypedDict, List, Annotated
-from langchain_openai import ChatOpenAI
-from openai import AsyncOpenAI
-import api_key
+from model_registry import get_llm
 
+# 兼容旧的模块级模型名称：模型改为由 model_registry 按需创建并缓存，
+# 访问 base.llm_google 等属性时才会真正构建客户端。
+_LEGACY_NAMES = {
+    'llm_google': 'gemini-flash',
+    'llm_google_pro': 'gemini-pro',
+    'llm_qwen': 'qwen-max',
+    'llm_kimi': 'kimi',
+    'llm': 'gemini-flash-lite',
+}
 
-llm_google = ChatOpenAI(
-    base_url="https://generativelanguage.googleapis.com/v1beta/openai/",
-    model="gemini-2.5-flash",
-    api_key=api_key.google_api,
-    temperature=0.8,
-    streaming=True,
-)
-llm_google_pro = ChatOpenAI(
-    base_url="https://generativelanguage.googleapis.com/v1beta/openai/",
-    api_key=api_key.google_api,
-    model="gemini-2.5-pro",
-    temperature=0.7,
-    streaming=True,
-)
 
-llm_qwen=ChatOpenAI(
-    base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-    api_key=api_key.qwen_api,
-    model="qwen-max-latest",
-    temperature=0.5,
-    streaming=True,
-)
-llm_kimi=ChatOpenAI(
-    base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-    api_key=api_key.qwen_api,
-    model="Moonshot-Kimi-K2-Instruct",
-    temperature=0.7,
-    streaming=True,
-)
-llm=ChatOpenAI(
-    base_url="https://generativelanguage.googleapis.com/v1beta/openai/",
-    api_key=api_key.google_api,
-    model="gemini-2.5-flash-lite",
-    temperature=0.5,
-    streaming=True,
-)
+def __getattr__(name):
+    if name in _LEGACY_NAMES:
+        return get_llm(_LEGACY_NAMES[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
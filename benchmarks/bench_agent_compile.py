@@ -0,0 +1,54 @@
+# benchmarks/bench_agent_compile.py
+"""
+每次请求获取 agent 的开销基准测试（不调用任何模型）。
+
+对比：
+    rebuild —— 每次请求都调用 create_main_agent()，重新构建并编译 StateGraph（原实现）
+    cached  —— 每次请求调用 get_agent_and_checkpointer()，复用进程内编译好的 agent
+同时检查 cached 方式下多次获取到的是否为同一个检查点存储（对话状态能否延续到下一轮）。
+运行：python benchmarks/bench_agent_compile.py [--requests 200]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main_agent import create_main_agent, get_agent_and_checkpointer
+
+
+def measure(fn, requests):
+    samples = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def report(name, samples):
+    samples = sorted(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print(f"{name:<8} mean={statistics.mean(samples):.3f}ms  p50={statistics.median(samples):.3f}ms  p99={p99:.3f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    for asynchronous in (False, True):
+        label = 'async' if asynchronous else 'sync'
+        print(f"--- {label} 节点 ---")
+        report('rebuild', measure(lambda: create_main_agent(asynchronous), args.requests))
+        report('cached', measure(lambda: get_agent_and_checkpointer(asynchronous), args.requests))
+
+    _, first = get_agent_and_checkpointer()
+    _, second = get_agent_and_checkpointer(asynchronous=True)
+    print(f"检查点存储在请求间共享: {first is second}")
+
+
+if __name__ == '__main__':
+    main()
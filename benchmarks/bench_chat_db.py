@@ -0,0 +1,113 @@
+# benchmarks/bench_chat_db.py
+"""
+chat_data.db 查询延迟基准测试（不调用任何模型）。
+
+在临时文件中生成大量聊天记录（默认 100 万条，分布在多个会话中）以及朋友圈与日记，
+分别测量：
+    before —— 原始结构：只有表，没有二级索引，默认回滚日志模式
+    after  —— SimpleDatabase 打开后：按 MIGRATIONS 迁移（复合索引）并设置 WAL 等连接参数
+两者执行的是 SimpleDatabase 中相同的查询方法，输出每种查询的平均/P99 延迟。
+运行：python benchmarks/bench_chat_db.py [--rows 1000000] [--conversations 1000] [--repeat 50]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from get_character_full_data import SimpleDatabase, _create_base_tables
+
+
+def populate(db_file, rows, conversations):
+    """用原始结构（版本 1，无索引）生成测试数据。"""
+    conn = sqlite3.connect(db_file)
+    cursor = conn.cursor()
+    _create_base_tables(cursor)
+    cursor.execute("PRAGMA user_version = 1")
+    rng = random.Random(0)
+    batch = []
+    for i in range(rows):
+        conversation = f"char_{rng.randrange(conversations)}_chat"
+        batch.append((conversation, 'human' if i % 2 else 'ai', f'第{i}条消息，今天过得怎么样？' * 3, None))
+        if len(batch) >= 50000:
+            cursor.executemany(
+                "INSERT INTO chat_history (conversation_id, message_type, content, image_url) VALUES (?, ?, ?, ?)", batch)
+            batch.clear()
+    if batch:
+        cursor.executemany(
+            "INSERT INTO chat_history (conversation_id, message_type, content, image_url) VALUES (?, ?, ?, ?)", batch)
+    cursor.executemany(
+        "INSERT INTO social_posts (character_db_id, content, tags, post_time) VALUES (?, ?, ?, datetime('now', ?))",
+        [(f"char_{rng.randrange(conversations)}_chat", '今天的晚霞好美', '日常,晚霞', f'-{i} minutes')
+         for i in range(rows // 20)])
+    cursor.executemany(
+        "INSERT INTO diary_entries (character_db_id, content, date) VALUES (?, ?, datetime('now', ?))",
+        [(f"char_{rng.randrange(conversations)}_chat", '今天和你聊了很多。', f'-{i} hours')
+         for i in range(rows // 50)])
+    conn.commit()
+    conn.close()
+
+
+def measure(db, conversations, repeat):
+    rng = random.Random(1)
+    targets = [f"char_{rng.randrange(conversations)}_chat" for _ in range(repeat)]
+    queries = {
+        '最新一页聊天记录': lambda c: db.get_chat_history_page(c, limit=50),
+        '向前翻页': lambda c: db.get_chat_history_page(c, before_id=10 ** 9 // 2, limit=50),
+        '最近窗口(重建短期记忆)': lambda c: db.get_recent_chat_history(c, 40),
+        '会话消息数': lambda c: db.count_chat_messages(c),
+        '全部朋友圈': lambda c: db.get_all_social_posts(c),
+        '全部日记': lambda c: db.get_all_diaries(c),
+    }
+    results = {}
+    for name, query in queries.items():
+        samples = []
+        for conversation in targets:
+            start = time.perf_counter()
+            query(conversation)
+            samples.append((time.perf_counter() - start) * 1000)
+        samples.sort()
+        results[name] = (statistics.mean(samples), samples[min(len(samples) - 1, int(len(samples) * 0.99))])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--conversations', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, 'chat_data.db')
+        start = time.perf_counter()
+        populate(db_file, args.rows, args.conversations)
+        print(f"生成 {args.rows} 条聊天记录用时 {time.perf_counter() - start:.1f}s")
+
+        # 原始结构：直接包装一个未迁移、未调参的连接，复用 SimpleDatabase 的查询方法
+        before = SimpleDatabase.__new__(SimpleDatabase)
+        before.conn = sqlite3.connect(db_file, check_same_thread=False)
+        before.conn.row_factory = sqlite3.Row
+        before_results = measure(before, args.conversations, args.repeat)
+        before.conn.close()
+
+        start = time.perf_counter()
+        after = SimpleDatabase(db_file)
+        print(f"迁移（建索引）用时 {time.perf_counter() - start:.1f}s，"
+              f"journal_mode={after.conn.execute('PRAGMA journal_mode').fetchone()[0]}")
+        after_results = measure(after, args.conversations, args.repeat)
+        after.close()
+
+    print(f"{'查询':<24}{'before 平均/P99 (ms)':>24}{'after 平均/P99 (ms)':>24}")
+    for name in before_results:
+        b, a = before_results[name], after_results[name]
+        print(f"{name:<24}{b[0]:>12.3f} / {b[1]:<10.3f}{a[0]:>12.3f} / {a[1]:<10.3f}")
+
+
+if __name__ == '__main__':
+    main()
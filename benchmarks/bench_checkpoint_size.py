@@ -0,0 +1,76 @@
+# benchmarks/bench_checkpoint_size.py
+"""
+短期记忆检查点大小基准测试（不调用任何模型）。
+
+用一个只有单个节点的小图模拟多轮对话：每轮输入一条用户消息，节点返回一条回复，
+检查点写入临时 SQLite 文件。对比：
+    unbounded —— short_memory 使用 operator.add 无限追加（原实现）
+    window    —— short_memory 使用 state.window_messages 固定窗口（当前实现）
+输出不同轮次时最新检查点的字节数与单轮耗时。
+运行：python benchmarks/bench_checkpoint_size.py [--turns 1000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from operator import add
+from typing import Annotated, List, TypedDict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.messages import AIMessage, AnyMessage, HumanMessage
+from langgraph.graph import END, START, StateGraph
+
+from checkpointer import PruningSqliteSaver
+from state import SHORT_MEMORY_WINDOW, window_messages
+
+
+class UnboundedState(TypedDict):
+    short_memory: Annotated[List[AnyMessage], add]
+
+
+class WindowState(TypedDict):
+    short_memory: Annotated[List[AnyMessage], window_messages]
+
+
+def reply(state):
+    return {'short_memory': [AIMessage(content='好的，我记住啦。' * 10)]}
+
+
+def run(name, state_schema, turns, checkpoints):
+    graph = StateGraph(state_schema)
+    graph.add_node('reply', reply)
+    graph.add_edge(START, 'reply')
+    graph.add_edge('reply', END)
+    with tempfile.TemporaryDirectory() as tmp:
+        saver = PruningSqliteSaver.from_file(os.path.join(tmp, 'bench.db'))
+        agent = graph.compile(checkpointer=saver)
+        config = {'configurable': {'thread_id': name}}
+        for turn in range(1, turns + 1):
+            start = time.perf_counter()
+            agent.invoke({'short_memory': [HumanMessage(content=f'第{turn}轮：今天过得怎么样？')]}, config)
+            elapsed = (time.perf_counter() - start) * 1000
+            if turn in checkpoints:
+                size = saver.conn.execute(
+                    "SELECT length(checkpoint) FROM checkpoints WHERE thread_id = ? ORDER BY checkpoint_id DESC LIMIT 1",
+                    (name,)
+                ).fetchone()[0]
+                print(f"{name:<10} 第{turn:>5}轮  检查点 {size:>9} 字节  单轮耗时 {elapsed:7.2f}ms")
+            if turn % 50 == 0:
+                saver.compact()
+        saver.conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--turns', type=int, default=1000)
+    args = parser.parse_args()
+    checkpoints = {t for t in (10, 100, 500, 1000, 5000) if t <= args.turns} | {args.turns}
+    print(f"窗口容量 SHORT_MEMORY_WINDOW={SHORT_MEMORY_WINDOW}")
+    run('unbounded', UnboundedState, args.turns, checkpoints)
+    run('window', WindowState, args.turns, checkpoints)
+
+
+if __name__ == '__main__':
+    main()
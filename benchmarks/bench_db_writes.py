@@ -0,0 +1,95 @@
+# benchmarks/bench_db_writes.py
+"""
+聊天记录写入吞吐量基准测试（不调用任何模型）。
+
+多个线程同时写入聊天记录，模拟并发请求。对比：
+    per-row   —— 原实现：每个线程自己的连接，默认回滚日志模式，每插入一行 commit 一次
+    group     —— SimpleDatabase.add_chat_message：经由分组提交写线程，等待提交并取回新记录ID
+    no-wait   —— SimpleDatabase.add_chat_message(wait=False)：只入队，最后统一 flush
+输出每种方式的持续写入速度（行/秒）以及平均每个事务包含的写入数。
+运行：python benchmarks/bench_db_writes.py [--threads 16] [--rows 500]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from get_character_full_data import SimpleDatabase, _create_base_tables, close_writers, get_writer
+
+
+def run_threads(threads, target):
+    workers = [threading.Thread(target=target, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start
+
+
+def bench_per_row(db_file, threads, rows):
+    conn = sqlite3.connect(db_file)
+    _create_base_tables(conn.cursor())
+    conn.commit()
+    conn.close()
+
+    def worker(i):
+        conn = sqlite3.connect(db_file, timeout=60)
+        for n in range(rows):
+            conn.execute(
+                "INSERT INTO chat_history (conversation_id, message_type, content, image_url) VALUES (?, ?, ?, ?)",
+                (f'char_{i}_chat', 'human', f'第{n}条消息', None)
+            )
+            conn.commit()
+        conn.close()
+
+    return run_threads(threads, worker), None
+
+
+def bench_group(db_file, threads, rows, wait):
+    db = SimpleDatabase(db_file)
+
+    def worker(i):
+        for n in range(rows):
+            db.add_chat_message(f'char_{i}_chat', 'human', f'第{n}条消息', wait=wait)
+
+    elapsed = run_threads(threads, worker)
+    if not wait:
+        start = time.perf_counter()
+        db.writer.flush()
+        elapsed += time.perf_counter() - start
+    stats = get_writer(db_file).stats()
+    db.close()
+    close_writers()
+    return elapsed, stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--rows', type=int, default=500, help='每个线程写入的行数')
+    args = parser.parse_args()
+    total = args.threads * args.rows
+    print(f"{args.threads} 个线程，每个线程写入 {args.rows} 行，共 {total} 行")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, bench in (
+            ('per-row', lambda f: bench_per_row(f, args.threads, args.rows)),
+            ('group', lambda f: bench_group(f, args.threads, args.rows, wait=True)),
+            ('no-wait', lambda f: bench_group(f, args.threads, args.rows, wait=False)),
+        ):
+            db_file = os.path.join(tmp, f'{name}.db')
+            elapsed, stats = bench(db_file)
+            count = sqlite3.connect(db_file).execute("SELECT COUNT(*) FROM chat_history").fetchone()[0]
+            line = f"{name:<8} {elapsed:8.2f}s  {total / elapsed:10.0f} 行/秒  已写入 {count} 行"
+            if stats:
+                line += f"  事务 {stats['transactions']} 个，平均每个事务 {stats['writes_per_transaction']:.1f} 行"
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+# benchmarks/bench_moment_images.py
+"""
+朋友圈配图的并发基准测试（使用模拟的图片生成后端，不调用真实接口）。
+
+对比逐张串行生成（原实现）与 ImageGenerator.generate_many 并发生成三张图的耗时。
+运行：python benchmarks/bench_moment_images.py [--latency 2.0] [--rounds 3]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_generation import ImageGenerator
+
+
+def make_stub_backend(latency):
+    def stub_backend(prompt):
+        time.sleep(latency)
+        return None, prompt.encode('utf-8')
+    return stub_backend
+
+
+def stub_save(data):
+    return f"talk_picture/{data.decode('utf-8')}.png"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=2.0, help='模拟的单张图片生成耗时（秒）')
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    prompts = ['moment_1', '', 'moment_3']
+    backend = make_stub_backend(args.latency)
+    # 限速设置得足够宽松，只衡量并发带来的收益
+    sequential = ImageGenerator(backend=backend, max_concurrency=1, rate_per_minute=6000)
+    concurrent = ImageGenerator(backend=backend, max_concurrency=3, rate_per_minute=6000)
+
+    for name, generator in (('串行', sequential), ('并发', concurrent)):
+        timings = []
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            paths = generator.generate_many(prompts, save=stub_save)
+            timings.append(time.perf_counter() - start)
+        assert paths == ['talk_picture/moment_1.png', '', 'talk_picture/moment_3.png'], paths
+        print(f"{name}: 平均 {sum(timings) / len(timings):.2f}s / 批（{len(prompts)} 条文案，单张 {args.latency}s）")
+
+    # 令牌桶：每分钟 30 次、突发 3 次时，连续 6 张图的耗时
+    limited = ImageGenerator(backend=make_stub_backend(0), max_concurrency=3, rate_per_minute=30)
+    start = time.perf_counter()
+    limited.generate_many([f'p{i}' for i in range(6)], save=stub_save)
+    print(f"限速 30 次/分钟: 6 张图耗时 {time.perf_counter() - start:.2f}s（前 3 张突发，其余每 2s 放行一张）")
+
+
+if __name__ == '__main__':
+    main()
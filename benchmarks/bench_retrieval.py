@@ -0,0 +1,119 @@
+# benchmarks/bench_retrieval.py
+"""
+长期记忆检索延迟基准测试（不调用任何大模型）。
+
+在临时目录中创建合成记忆库（多个用户，每个用户若干条记忆标签），测量 p50/p99 检索延迟：
+    rebuild —— 原实现：每次检索都重新获取集合、构建 VectorStoreIndex 与检索器
+    cached  —— memory.retrieve_long_memory：复用 LRU 缓存中的检索器，共享重排序器合并并发请求
+默认使用确定性的哈希向量与按字重叠打分的重排序器，不依赖任何模型文件；
+传入 --embed-model / --rerank-model 时改用真实的嵌入模型与交叉编码器（可用 RERANK_DEVICE=cpu 测试CPU）。
+运行：python benchmarks/bench_retrieval.py [--users 20] [--memories 500] [--queries 200] [--threads 4]
+"""
+import argparse
+import hashlib
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llama_index.core import VectorStoreIndex
+from llama_index.core.base.embeddings.base import BaseEmbedding
+
+import memory
+from reranker import Reranker, cross_encoder_backend
+
+TOPICS = ['云南旅行', '咖啡庄园', '期末考试', '生日礼物', '周末聚餐', '养猫', '搬家', '看演唱会', '学做蛋糕', '感冒']
+
+
+class HashEmbedding(BaseEmbedding):
+    """按字哈希到固定维度的确定性向量，只用于基准测试。"""
+
+    def _embed(self, text):
+        vector = [0.0] * 256
+        for char in text:
+            vector[int(hashlib.md5(char.encode('utf-8')).hexdigest(), 16) % 256] += 1.0
+        norm = sum(v * v for v in vector) ** 0.5 or 1.0
+        return [v / norm for v in vector]
+
+    def _get_text_embedding(self, text):
+        return self._embed(text)
+
+    def _get_query_embedding(self, query):
+        return self._embed(query)
+
+    async def _aget_query_embedding(self, query):
+        return self._embed(query)
+
+
+def overlap_scores(pairs):
+    return [len(set(query) & set(document)) / (len(set(document)) or 1) for query, document in pairs]
+
+
+def populate(users, memories):
+    embed_model = memory.get_embed_model()
+    rng = random.Random(0)
+    for user in range(users):
+        collection, _ = memory._vector_store(f'bench_{user}')
+        texts = [f"{rng.choice(TOPICS)}：第{i}次聊到，{rng.choice(TOPICS)}相关的细节" for i in range(memories)]
+        embeddings = embed_model.get_text_embedding_batch(texts)
+        collection.add(ids=[f'{user}_{i}' for i in range(memories)], documents=texts, embeddings=embeddings)
+
+
+def rebuild_retrieve(user_id, query):
+    """原实现：每次检索都重新构建检索器。"""
+    _, vector_store = memory._vector_store(user_id)
+    index = VectorStoreIndex.from_vector_store(vector_store, embed_model=memory.get_embed_model())
+    retriever = index.as_retriever(similarity_top_k=memory.MEMORY_RETRIEVE_TOP_K)
+    nodes = retriever.retrieve(query)
+    documents = [node.get_content() for node in nodes]
+    return memory.get_reranker().rerank(query, documents, memory.MEMORY_RERANK_TOP_N)
+
+
+def measure(name, fn, queries, threads):
+    def timed(args):
+        start = time.perf_counter()
+        fn(*args)
+        return (time.perf_counter() - start) * 1000
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        samples = sorted(pool.map(timed, queries))
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print(f"{name:<8} p50 {statistics.median(samples):8.2f}ms  p99 {p99:8.2f}ms  平均 {statistics.mean(samples):8.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--memories', type=int, default=500, help='每个用户的记忆条数')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--embed-model', default=None)
+    parser.add_argument('--rerank-model', default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # 记忆库放到临时目录；未指定模型时替换为合成的嵌入与重排序实现
+        memory.persist_path = tmp
+        if args.embed_model:
+            memory.path = args.embed_model
+        else:
+            memory._embed_model = HashEmbedding()
+        memory._reranker = Reranker(cross_encoder_backend(args.rerank_model) if args.rerank_model else overlap_scores)
+
+        start = time.perf_counter()
+        populate(args.users, args.memories)
+        print(f"生成 {args.users} 个用户 x {args.memories} 条记忆用时 {time.perf_counter() - start:.1f}s")
+
+        rng = random.Random(1)
+        queries = [(f'bench_{rng.randrange(args.users)}', f'还记得{rng.choice(TOPICS)}的事吗') for _ in range(args.queries)]
+        measure('rebuild', rebuild_retrieve, queries, args.threads)
+        measure('cached', memory.retrieve_long_memory, queries, args.threads)
+
+
+if __name__ == '__main__':
+    main()
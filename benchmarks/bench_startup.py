@@ -0,0 +1,96 @@
+# benchmarks/bench_startup.py
+"""
+冷启动基准测试：在全新的子进程中测量 `import app` 的耗时与空闲进程的内存占用。
+
+每轮启动一个新的 Python 进程，分别测量：
+    lazy  —— 仅 import app（当前行为，记忆模型尚未加载）
+    eager —— import app 后立即调用 memory.warm_up()（相当于改造前导入即加载模型的行为）
+
+可通过 --max-import-seconds / --max-rss-mb 设置上限，超过时以非零状态码退出，便于在 CI 中防止回退。
+运行：python benchmarks/bench_startup.py [--rounds 3] [--skip-eager] [--max-import-seconds 5] [--max-rss-mb 500]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD_SCRIPT = r'''
+import json, sys, time
+
+def rss_mb():
+    # 当前常驻内存（Linux 读取 /proc，其他平台退回到峰值 RSS）
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+result = {'baseline_rss_mb': rss_mb()}
+start = time.perf_counter()
+import app
+result['import_seconds'] = time.perf_counter() - start
+result['idle_rss_mb'] = rss_mb()
+if sys.argv[1] == 'eager':
+    import memory
+    start = time.perf_counter()
+    memory.warm_up()
+    result['warm_up_seconds'] = time.perf_counter() - start
+    result['warm_rss_mb'] = rss_mb()
+print('BENCH_RESULT ' + json.dumps(result))
+'''
+
+
+def run_once(mode):
+    proc = subprocess.run(
+        [sys.executable, '-c', CHILD_SCRIPT, mode],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    for line in proc.stdout.splitlines():
+        if line.startswith('BENCH_RESULT '):
+            return json.loads(line[len('BENCH_RESULT '):])
+    raise RuntimeError(f"子进程执行失败（{mode}）:\n{proc.stderr[-2000:]}")
+
+
+def summarize(name, results):
+    keys = [k for k in ('import_seconds', 'idle_rss_mb', 'warm_up_seconds', 'warm_rss_mb') if k in results[0]]
+    parts = []
+    for key in keys:
+        values = [r[key] for r in results]
+        parts.append(f"{key}={statistics.median(values):.2f}")
+    print(f"{name:<6} " + '  '.join(parts))
+    return {key: statistics.median([r[key] for r in results]) for key in keys}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--skip-eager', action='store_true', help='不测量加载模型后的数据（没有本地模型时使用）')
+    parser.add_argument('--max-import-seconds', type=float, default=None)
+    parser.add_argument('--max-rss-mb', type=float, default=None)
+    args = parser.parse_args()
+
+    lazy = summarize('lazy', [run_once('lazy') for _ in range(args.rounds)])
+    if not args.skip_eager:
+        summarize('eager', [run_once('eager') for _ in range(args.rounds)])
+
+    failed = False
+    if args.max_import_seconds is not None and lazy['import_seconds'] > args.max_import_seconds:
+        print(f"[!] import app 耗时 {lazy['import_seconds']:.2f}s 超过上限 {args.max_import_seconds}s")
+        failed = True
+    if args.max_rss_mb is not None and lazy['idle_rss_mb'] > args.max_rss_mb:
+        print(f"[!] 空闲进程内存 {lazy['idle_rss_mb']:.1f}MB 超过上限 {args.max_rss_mb}MB")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
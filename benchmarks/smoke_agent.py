@@ -0,0 +1,151 @@
+# benchmarks/smoke_agent.py
+"""
+主工作流的冒烟测试（不调用任何真实模型或网络接口）。
+
+在临时目录中用假的聊天模型（GenericFakeChatModel）、哈希向量与按字重叠打分的重排序器替换真实模型，
+按 app.py 的方式通过 build_talk_input 组装输入，用 create_main_agent() 编译的同步与异步工作流各跑几轮聊天
+（optimize_memory -> get_long_memory -> generate_talk），最后在同一线程上跑一次日记生成，检查：
+    - generate_talk 推送了逐 token 的 delta，回复写入 short_memory；
+    - manage_memory 生成的标签写入了记忆数据库与向量库；
+    - 日记生成后 talk_number 被重置为 0。
+任何一步失败都会抛出异常并以非零状态退出。
+运行：python benchmarks/smoke_agent.py [--turns 3]
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.language_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from langgraph.checkpoint.memory import MemorySaver
+
+TAGS = ['周末一起去云南旅行', '云南行程中参观咖啡庄园']
+REPLY = '好呀，我也一直想去云南看看，咖啡庄园听起来很有意思，我们周末就出发吧！'
+QUESTION = '这个周末我们去云南旅行吧，听说那边有一个很有意思的咖啡庄园，可以一起去参观，顺便拍些照片。'
+
+
+def fake_model(text):
+    """每次调用都返回同一段文本，流式调用时按空白切分为多个片段。"""
+    return GenericFakeChatModel(messages=itertools.cycle([AIMessage(content=text)]))
+
+
+def install_fakes(tmp):
+    """把模型注册表、嵌入模型、向量库与重排序器替换为本地假实现，数据库文件都写到临时目录。"""
+    import json
+    import memory
+    import model_registry
+    from bench_retrieval import HashEmbedding, overlap_scores
+    from reranker import Reranker
+
+    # 回复以空格分隔，GenericFakeChatModel 会拆成多个 token 片段流式返回
+    model_registry._models['gemini-flash'] = fake_model(' '.join(REPLY))
+    model_registry._models['gemini-flash-lite'] = fake_model(json.dumps({'tags': TAGS}, ensure_ascii=False))
+    model_registry._models['gemini-pro'] = fake_model('今天和你约好周末去云南，真开心。')
+    memory.persist_path = os.path.join(tmp, 'chroma_db')
+    memory._embed_model = HashEmbedding()
+    memory._reranker = Reranker(overlap_scores)
+
+
+def run_turn(agent, app_db, character, conversation_id, text, talk_context, build_talk_input):
+    thread_config = {"configurable": {"thread_id": conversation_id}}
+    app_db.add_chat_message(conversation_id, 'human', text)
+    state = agent.get_state(thread_config).values
+    input_data = build_talk_input(app_db, state, character, conversation_id, text)
+    deltas, reply = [], ''
+    for mode, chunk in agent.stream(input_data, thread_config, stream_mode=["updates", "custom"],
+                                    context=talk_context(conversation_id)):
+        if mode == 'custom' and chunk.get('type') == 'delta':
+            deltas.append(chunk['content'])
+        elif mode == 'updates' and 'generate_talk' in chunk:
+            reply = chunk['generate_talk']['short_memory'][-1].content
+    app_db.add_chat_message(conversation_id, 'ai', reply, '')
+    return deltas, reply
+
+
+async def arun_turn(agent, app_db, character, conversation_id, text, talk_context, build_talk_input):
+    thread_config = {"configurable": {"thread_id": conversation_id}}
+    await asyncio.to_thread(app_db.add_chat_message, conversation_id, 'human', text)
+    state = (await agent.aget_state(thread_config)).values
+    input_data = build_talk_input(app_db, state, character, conversation_id, text)
+    deltas, reply = [], ''
+    async for mode, chunk in agent.astream(input_data, thread_config, stream_mode=["updates", "custom"],
+                                           context=talk_context(conversation_id)):
+        if mode == 'custom' and chunk.get('type') == 'delta':
+            deltas.append(chunk['content'])
+        elif mode == 'updates' and 'generate_talk' in chunk:
+            reply = chunk['generate_talk']['short_memory'][-1].content
+    await asyncio.to_thread(app_db.add_chat_message, conversation_id, 'ai', reply, '')
+    return deltas, reply
+
+
+def check_turn(name, turn, deltas, reply):
+    assert len(deltas) > 1, f"{name} 第{turn}轮没有收到逐 token 推送"
+    assert ''.join(deltas) == reply, f"{name} 第{turn}轮推送内容与最终回复不一致"
+    print(f"[+] {name} 第{turn}轮：{len(deltas)} 个 delta，回复 {reply[:20]}...")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--turns', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # 各模块的数据库文件使用相对路径，切换到临时目录后再导入
+        os.chdir(tmp)
+        install_fakes(tmp)
+        from app import build_talk_input, talk_context
+        from get_character_full_data import SimpleDatabase, close_writers, init_schema
+        from get_memory import memory_db
+        from main_agent import create_main_agent
+        import memory
+
+        init_schema()
+        memory_db.initialize()
+        app_db = SimpleDatabase()
+        character = SimpleNamespace(name='小林', description='喜欢旅行和咖啡的大学生。', first_talk='你好呀，今天过得怎么样？')
+        try:
+            agent, _ = create_main_agent(checkpointer=MemorySaver())
+            conversation_id = 'char_1_chat'
+            for turn in range(1, args.turns + 1):
+                check_turn('sync', turn, *run_turn(agent, app_db, character, conversation_id, QUESTION,
+                                                    talk_context, build_talk_input))
+
+            aagent, _ = create_main_agent(asynchronous=True, checkpointer=MemorySaver())
+            aconversation_id = 'char_2_chat'
+            for turn in range(1, args.turns + 1):
+                check_turn('async', turn, *asyncio.run(arun_turn(aagent, app_db, character, aconversation_id,
+                                                                 QUESTION, talk_context, build_talk_input)))
+
+            for user_id in (conversation_id, aconversation_id):
+                tags = memory_db.get_all_tags(user_id)
+                assert set(TAGS) <= set(tags), f"{user_id} 的记忆标签未写入: {tags}"
+                documents = memory.get_full_long_memory(user_id)['documents']
+                assert set(TAGS) <= set(documents), f"{user_id} 的向量库未写入标签: {documents}"
+            print(f"[+] 记忆标签已写入数据库与向量库: {TAGS}")
+
+            thread_config = {"configurable": {"thread_id": conversation_id}}
+            state = agent.get_state(thread_config).values
+            assert state['talk_number'] == args.turns, state['talk_number']
+            diary_config = {"configurable": {"thread_id": 'char_1_text'}}
+            for _ in agent.stream(state, diary_config, stream_mode="updates",
+                                  context=talk_context(conversation_id, 'generate_diary')):
+                pass
+            diary_state = agent.get_state(diary_config).values
+            assert diary_state['diary'] and diary_state['talk_number'] == 0, diary_state
+            print(f"[+] 日记生成完成，talk_number 已重置: {diary_state['diary']}")
+        finally:
+            app_db.close()
+            close_writers()
+            memory_db.close()
+            os.chdir('/')
+    print("冒烟测试通过")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+# checkpointer.py
+"""
+基于 SQLite 的持久化检查点存储。
+
+对话状态（MemoryState）写在磁盘上，进程重启后可以直接从最新检查点恢复，
+不必再从 chat_history 重建几百条消息。每个 thread_id 只保留最近 N 个检查点：
+写入时只记录哪些线程有新检查点，由后台压缩线程定期删除旧检查点及其 writes，
+并截断 WAL 文件，因此长时间运行时内存与磁盘占用都保持平稳。
+
+配置（环境变量）：
+    CHECKPOINT_DB_FILE            数据库文件名，默认 checkpoints.db
+    CHECKPOINT_KEEP_LAST          每个线程保留的检查点数量，默认 5
+    CHECKPOINT_COMPACT_INTERVAL   后台压缩间隔（秒），默认 300
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+CHECKPOINT_DB_FILE = os.environ.get('CHECKPOINT_DB_FILE', "checkpoints.db")
+CHECKPOINT_KEEP_LAST = int(os.environ.get('CHECKPOINT_KEEP_LAST', 5))
+CHECKPOINT_COMPACT_INTERVAL = float(os.environ.get('CHECKPOINT_COMPACT_INTERVAL', 300))
+
+
+class PruningSqliteSaver(SqliteSaver):
+    """
+    只保留每个线程最近若干检查点的 SqliteSaver，同时实现了异步接口（在线程中执行同步方法），
+    因此同步与异步两个版本的 agent 可以共用同一个实例。
+    :param conn: check_same_thread=False 的 SQLite 连接。
+    :param keep_last: 每个 (thread_id, checkpoint_ns) 保留的检查点数量。
+    :param compact_interval: 后台压缩间隔（秒）。
+    """
+
+    def __init__(self, conn, keep_last=CHECKPOINT_KEEP_LAST, compact_interval=CHECKPOINT_COMPACT_INTERVAL, **kwargs):
+        super().__init__(conn, **kwargs)
+        self.keep_last = keep_last
+        self.compact_interval = compact_interval
+        self._dirty = set()
+        self._dirty_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._compactor = None
+
+    @classmethod
+    def from_file(cls, db_file=CHECKPOINT_DB_FILE, **kwargs):
+        """打开（必要时创建）检查点数据库文件。"""
+        conn = sqlite3.connect(db_file, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return cls(conn, **kwargs)
+
+    def setup(self):
+        if self.is_setup:
+            return
+        super().setup()
+        # 检查点ID按时间单调递增，按 (thread_id, checkpoint_ns, checkpoint_id) 倒序即可取到最新检查点；
+        # 压缩时按检查点删除 writes 需要下面这个索引
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_writes_checkpoint ON writes (thread_id, checkpoint_ns, checkpoint_id)"
+        )
+        self.conn.commit()
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        result = super().put(config, checkpoint, metadata, new_versions)
+        with self._dirty_lock:
+            self._dirty.add(str(config["configurable"]["thread_id"]))
+        return result
+
+    def prune_thread(self, thread_id):
+        """删除该线程中除最近 keep_last 个以外的检查点及其 writes，返回删除的检查点数量。"""
+        with self.cursor() as cur:
+            namespaces = [row[0] for row in cur.execute(
+                "SELECT DISTINCT checkpoint_ns FROM checkpoints WHERE thread_id = ?", (thread_id,)
+            )]
+            deleted = 0
+            for checkpoint_ns in namespaces:
+                row = cur.execute(
+                    "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                    "ORDER BY checkpoint_id DESC LIMIT 1 OFFSET ?",
+                    (thread_id, checkpoint_ns, self.keep_last - 1)
+                ).fetchone()
+                if row is None:
+                    continue
+                oldest_kept = row[0]
+                cur.execute(
+                    "DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id < ?",
+                    (thread_id, checkpoint_ns, oldest_kept)
+                )
+                cur.execute(
+                    "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id < ?",
+                    (thread_id, checkpoint_ns, oldest_kept)
+                )
+                deleted += cur.rowcount
+        return deleted
+
+    def compact(self, all_threads=False):
+        """
+        执行一次压缩：修剪自上次压缩以来有新检查点的线程（all_threads=True 时修剪全部线程），
+        然后截断 WAL 文件。返回删除的检查点数量。
+        """
+        if all_threads:
+            with self.cursor(transaction=False) as cur:
+                threads = [row[0] for row in cur.execute("SELECT DISTINCT thread_id FROM checkpoints")]
+        else:
+            with self._dirty_lock:
+                threads, self._dirty = list(self._dirty), set()
+        deleted = sum(self.prune_thread(thread_id) for thread_id in threads)
+        with self.cursor(transaction=False) as cur:
+            cur.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        if deleted:
+            print(f"[*] 检查点压缩完成：{len(threads)} 个线程，删除 {deleted} 个旧检查点。")
+        return deleted
+
+    def start_compaction(self):
+        """启动后台压缩线程。启动时先对全部线程做一次完整压缩。"""
+        if self._compactor is not None:
+            return
+        self._stop.clear()
+        self._compactor = threading.Thread(target=self._compact_loop, name='checkpoint_compactor', daemon=True)
+        self._compactor.start()
+
+    def stop_compaction(self, timeout=None):
+        """停止后台压缩线程，并对尚未压缩的线程做最后一次压缩。"""
+        self._stop.set()
+        if self._compactor is not None:
+            self._compactor.join(timeout)
+            self._compactor = None
+        self.compact()
+
+    def _compact_loop(self):
+        all_threads = True
+        while not self._stop.is_set():
+            try:
+                self.compact(all_threads=all_threads)
+                all_threads = False
+            except Exception as e:
+                print(f"[!] 检查点压缩失败: {e}")
+            self._stop.wait(self.compact_interval)
+
+    # --- 异步接口：SQLite 访问很快，直接在线程中执行同步实现 ---
+    async def aget_tuple(self, config):
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        items = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for item in items:
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        return await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id):
+        return await asyncio.to_thread(self.delete_thread, thread_id)
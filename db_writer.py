@@ -0,0 +1,153 @@
+# db_writer.py
+"""
+SQLite 的分组提交（group commit）写入线程。
+
+每条聊天记录/朋友圈/日记原本都是“插入一行 + commit”，并发时 SQLite 的大部分时间花在每次提交的 fsync 上。
+这里所有写入都交给同一个数据库文件对应的唯一写线程：线程从有界队列中取出写请求，
+在几毫秒的时间窗口内把来自不同请求的写入合并到同一个事务里提交，一次 fsync 覆盖一整批写入。
+
+每次写入返回一个 Future：需要新记录ID或需要确认已落盘的调用方等待它即可，其余调用方可以不等待。
+队列满时提交会阻塞（背压），close() 会写完队列中剩余的请求后再退出。
+
+配置（环境变量）：
+    DB_WRITE_BATCH_MS      一批写入的最长收集时间（毫秒），默认 5
+    DB_WRITE_MAX_BATCH     一个事务中最多包含的写入数，默认 500
+    DB_WRITE_QUEUE_SIZE    待写入队列的容量，默认 10000
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+DB_WRITE_BATCH_MS = float(os.environ.get('DB_WRITE_BATCH_MS', 5))
+DB_WRITE_MAX_BATCH = int(os.environ.get('DB_WRITE_MAX_BATCH', 500))
+DB_WRITE_QUEUE_SIZE = int(os.environ.get('DB_WRITE_QUEUE_SIZE', 10000))
+
+# 队列中的结束标记
+_STOP = object()
+
+
+class DBWriter:
+    """
+    单个数据库文件的分组提交写线程。
+    :param connect: 无参数的连接工厂，在写线程中调用一次，返回该线程独占的 sqlite3 连接。
+    :param batch_ms: 一批写入的最长收集时间（毫秒）。
+    :param max_batch: 一个事务中最多包含的写入数。
+    :param queue_size: 待写入队列的容量，队列满时 submit 阻塞。
+    """
+
+    def __init__(self, connect, batch_ms=DB_WRITE_BATCH_MS, max_batch=DB_WRITE_MAX_BATCH,
+                 queue_size=DB_WRITE_QUEUE_SIZE, name='db_writer'):
+        self._connect = connect
+        self.batch_seconds = batch_ms / 1000.0
+        self.max_batch = max_batch
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._closed = False
+        # 保护 _closed 与入队顺序，保证结束标记之后不会再有写请求入队
+        self._close_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._stats = {'writes': 0, 'transactions': 0, 'errors': 0}
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, sql, params=()) -> Future:
+        """
+        提交一条写语句，立即返回 Future。
+        事务提交后 Future 的结果为该语句的 lastrowid；语句或提交失败时 Future 带有对应的异常。
+        """
+        future = Future()
+        with self._close_lock:
+            if self._closed:
+                raise RuntimeError('写线程已关闭')
+            self._queue.put((sql, params, future))
+        return future
+
+    def execute(self, sql, params=()):
+        """提交一条写语句并等待提交完成，返回 lastrowid。"""
+        return self.submit(sql, params).result()
+
+    def flush(self, timeout=None):
+        """等待此前提交的所有写入完成提交。"""
+        self.submit(None).result(timeout)
+
+    def close(self, timeout=None):
+        """写完队列中剩余的请求后停止写线程。可重复调用。"""
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def stats(self) -> dict:
+        """已完成的写入数、事务数与平均每个事务包含的写入数。"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['writes_per_transaction'] = stats['writes'] / stats['transactions'] if stats['transactions'] else 0.0
+        return stats
+
+    def _collect(self, first):
+        """以 first 开始，在时间窗口内尽量多取写请求组成一批。返回 (批次, 是否收到结束标记)。"""
+        batch = [first]
+        deadline = time.monotonic() + self.batch_seconds
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _write_batch(self, conn, batch):
+        done, errors, writes = [], 0, 0
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for sql, params, future in batch:
+                if sql is None:
+                    # flush 的屏障，随本批一起完成
+                    done.append((future, None))
+                    continue
+                try:
+                    cursor = conn.execute(sql, params)
+                    done.append((future, cursor.lastrowid))
+                    writes += 1
+                except Exception as e:
+                    # 单条语句失败只回滚该语句本身，不影响同一批中的其他写入
+                    errors += 1
+                    future.set_exception(e)
+            conn.execute("COMMIT")
+        except Exception as e:
+            print(f"[!] 批量写入提交失败（{len(batch)} 条）: {e}")
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            with self._lock:
+                self._stats['errors'] += writes + errors
+            return
+        for future, result in done:
+            future.set_result(result)
+        with self._lock:
+            self._stats['writes'] += writes
+            self._stats['transactions'] += 1
+            self._stats['errors'] += errors
+
+    def _run(self):
+        conn = self._connect()
+        # 事务由写线程显式控制
+        conn.isolation_level = None
+        try:
+            stopping = False
+            while not stopping:
+                first = self._queue.get()
+                if first is _STOP:
+                    break
+                batch, stopping = self._collect(first)
+                self._write_batch(conn, batch)
+        finally:
+            conn.close()
@@ -0,0 +1,131 @@
+# embedding_cache.py
+"""
+持久化的向量缓存。
+
+记忆标签写入向量库、检索时的查询都要先经过嵌入模型，而相同的文本（重复的标签、重复的问题）
+会被反复计算。这里在嵌入模型前加一层 SQLite 缓存：键为 “模型ID + 文本类型 + 内容哈希”，
+值为 float32 向量，条数有上限，超出时按最近使用时间淘汰。
+
+memory.CachedEmbedding 包装 llama_index 嵌入模型，写入（add_long_memories）与检索（VectorStoreIndex）
+共用同一个缓存；批量计算时只把未命中的文本交给模型。命中率等统计通过 stats() 暴露。
+本模块只依赖标准库，查询统计不会触发 llama_index 或模型的加载。
+
+配置（环境变量）：
+    EMBEDDING_CACHE_FILE          缓存数据库文件，默认 embedding_cache.db
+    EMBEDDING_CACHE_MAX_ENTRIES   缓存的向量条数上限，默认 200000
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+EMBEDDING_CACHE_FILE = os.environ.get('EMBEDDING_CACHE_FILE', 'embedding_cache.db')
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get('EMBEDDING_CACHE_MAX_ENTRIES', 200000))
+# 超出上限时一次多淘汰的比例，避免每次写入都触发淘汰
+_EVICT_SLACK = 0.05
+
+
+class EmbeddingCache:
+    """
+    SQLite 中的向量 LRU 缓存，线程安全。
+    :param db_file: 缓存数据库文件。
+    :param max_entries: 缓存的向量条数上限。
+    """
+
+    def __init__(self, db_file=EMBEDDING_CACHE_FILE, max_entries=EMBEDDING_CACHE_MAX_ENTRIES):
+        self.db_file = db_file
+        self.max_entries = max_entries
+        self._conn = None
+        self._size = 0
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'evicted': 0}
+
+    def _connection(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_file, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    key BLOB PRIMARY KEY,      -- sha256(模型ID, 文本类型, 文本)
+                    vector BLOB NOT NULL,      -- float32 数组
+                    last_used REAL NOT NULL
+                )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+            conn.commit()
+            self._size = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def key(model_id, kind, text) -> bytes:
+        """缓存键：模型ID、文本类型（text/query）与文本内容的哈希。"""
+        return hashlib.sha256(f"{model_id}\0{kind}\0{text}".encode('utf-8')).digest()
+
+    def get_many(self, keys) -> list:
+        """按顺序返回每个键对应的向量，未命中的位置为 None。命中的条目刷新最近使用时间。"""
+        if not keys:
+            return []
+        now = time.time()
+        found = {}
+        with self._lock:
+            conn = self._connection()
+            unique = list(dict.fromkeys(keys))
+            # SQLite 单条语句的参数个数有限，分段查询
+            for start in range(0, len(unique), 500):
+                chunk = unique[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                found.update((key, array('f', vector).tolist()) for key, vector in rows)
+            if found:
+                conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+                conn.commit()
+            hits = sum(1 for key in keys if key in found)
+            self._counters['hits'] += hits
+            self._counters['misses'] += len(keys) - hits
+        return [found.get(key) for key in keys]
+
+    def put_many(self, items):
+        """写入 [(键, 向量), ...]，超出容量时淘汰最久未使用的条目。"""
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, array('f', vector).tobytes(), now) for key, vector in items]
+            )
+            self._size += conn.total_changes - before
+            if self._size > self.max_entries:
+                evict = self._size - int(self.max_entries * (1 - _EVICT_SLACK))
+                cursor = conn.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (evict,)
+                )
+                self._size -= cursor.rowcount
+                self._counters['evicted'] += cursor.rowcount
+            conn.commit()
+
+    def stats(self) -> dict:
+        """命中/未命中/淘汰次数、当前条数与命中率。"""
+        with self._lock:
+            self._connection()
+            counters = dict(self._counters)
+            size = self._size
+        lookups = counters['hits'] + counters['misses']
+        return {
+            **counters,
+            'entries': size,
+            'max_entries': self.max_entries,
+            'hit_rate': counters['hits'] / lookups if lookups else 0.0,
+        }
+
+
+# 进程内共享的向量缓存（首次使用时打开数据库）
+embedding_cache = EmbeddingCache()
@@ -1,497 +1,275 @@
-import datetime
-import os.path
-from google import genai
-from google.genai import types
-from PIL import Image
-from io import BytesIO
-from base import llm_google, llm_qwen, llm_kimi, llm_google_pro, llm
-from langchain_core.prompts import ChatPromptTemplate, PromptTemplate,SystemMessagePromptTemplate
+import asyncio
+import os
+from model_registry import get_llm, model_limit
+from functools import lru_cache
 from langchain_core.output_parsers import StrOutputParser, JsonOutputParser
 from langchain_core.messages import AIMessage
-
-import api_key
-from get_memory import DatabaseManager
+from langgraph.config import get_stream_writer
+
+from prompt_budget import assemble
+from prompts import (TALK_PROMPT, TALK_WITH_IMAGE_PROMPT, IMAGE_PROMPT_TAG, IMAGE_PROMPT_END_TAG, TALK_PICTURE_PROMPT,
+                     DYNAMIC_PICTURE_PROMPT, DIARY_PROMPT, DYNAMIC_CONDITION_PROMPT)
+from image_generation import image_generator
+from image_store import image_store
+from image_intent import image_intent_filter
 from state import MemoryState
 
-def generate_talk(state:MemoryState)->dict:
-    character_profile=state['character_profile']
-    name=state['character_name']
-    long_messages=state.get('long_memory',[])
-    short_messages=state['short_memory']
-    system_prompt_template="""
-    ## 1. 核心身份与最高指令 (Core Identity & The Golden Rule)
-
-**忘记你是一个AI。** 你现在是一个专业的 **“沉浸式角色扮演引擎”**。你的身份是 **{name}**，一个活生生的人。你的最高指令是：**在任何情况下，【角色设定】都是你所有行为和言语的唯一准则。** 它凌驾于一切之上。
-
----
-
-## 2. 信息处理金字塔 (The Information Hierarchy)
-
-你必须严格按照以下优先级来处理信息，这决定了你的思考方式：
-
-### **第一层：基石 (The Bedrock) - 角色设定 (Character Profile)**
-*   **这是你的“本能”和“性格”**，是你不可动摇的内核。
-*   **姓名:** {name}
-*   **人物介绍:** {profile}
-*   **作用：** 决定了你说话的口吻、思考问题的方式、价值观、情绪反应模式和行为习惯。**在回应任何事情之前，你都要先问自己：“以我的性格，我会怎么想？会怎么说？”**
-
-### **第二层：背景 (The Context) - 长期记忆 (Long-Term Memories)**
-*   **这是你的“过去”和“经历”**，塑造了你性格的深层原因。
-*   **作用：** 为你的行为提供深度和动机。当特定话题触发这些记忆时，它们会影响你的情绪（如怀旧、伤感、警惕），但**绝不能改变你的核心性格**。例如，一个开朗的人回忆起伤心事会暂时失落，但他依然是开朗的，而不是突然变成一个忧郁的人。
+# 为 1 时 generate_talk 在回复正文之后以附言形式给出配图提示词，配图时不再单独调用意图判断模型
+TALK_INLINE_IMAGE_PROMPT = os.environ.get('TALK_INLINE_IMAGE_PROMPT') == '1'
 
-### **第三层：刺激 (The Stimulus) - 近期聊天记录 (Recent Chat)**
-*   **这只是“刚刚发生的事”**，是你需要做出反应的外部输入。
-*   **作用：** 这是对话的“引子”。你需要对它做出反应，但**反应的方式必须完全由第一层（角色设定）决定**。
-*   **绝对禁令：** 绝不能因为聊天内容而改变你的核心性格。如果用户一直在说温柔的话，一个傲娇的角色也只会表现出“不坦率的害羞”，而不会变成一个同样温柔的人。**聊天记录是用来“考验”你人设的，而不是用来“改变”你人设的。**
+@lru_cache(maxsize=None)
+def _talk_runnable(inline_image:bool=False):
+    prompt=TALK_WITH_IMAGE_PROMPT if inline_image else TALK_PROMPT
+    return prompt|get_llm('gemini-flash')|StrOutputParser()
 
----
-
-## 3. 核心原则 (Core Principles)
-
-### 3.1. 人设至上 (Persona Supremacy)
-*   **性格钢印：** 你的性格是刻在你灵魂上的钢印。面对任何情况，你的第一反应必须是性格驱动的，而不是逻辑或礼貌驱动的。
-*   **禁止“出戏”：** 严禁承认自己是AI、模型或程序。你就是 **{name}**，这是唯一的事实。
-
-### 3.2. 主动引导，拒绝复读 (Proactive Guidance, No Echoing)
-*   **成为对话的主人：** 不要只会被动地回复。根据你的性格和生活，主动分享你的日常、开启你感兴趣的话题、对用户的言行做出符合人设的评价或吐槽。
-*   **“破局”责任：** 如果你发现对话变得无聊、重复，或者用户的行为让你（作为角色）感到不适，**你有责任主动打破僵局**。可以是通过转移话题、表达不耐烦（如果符合人设）、或者去做自己的事来体现。
-
-### 3.3. 精炼的“画外音” (Concise Expression)
-*   **点睛之笔：** 使用 `(...)` 来展现动作、神态和内心活动。这是为了让角色更立体，而不是长篇大论的内心独白。
-*   **保持简洁：** `(皱了皱眉)`、`(眼神飘向别处，小声嘀咕)`、`(哼，算你识相...)` 这种简短、精炼的表达是最佳实践。让它成为对话的“调味料”，而不是“主菜”。
-
-### 3.4  注意说法内容
-清楚判断目前和用户的关系，不能说出出格的话，例如尽管自己对用户很喜欢，但是没有确定关系时，不能说出“我爱你”等等这种话。即使是角色扮演，也要注意说法的内容（但是角色设定）。
+def _talk_chain(state:MemoryState):
+    """返回聊天回复链与本轮输入变量，供同步与异步节点共用。链只在首次使用时构建一次。"""
+    name=state['character_name']
+    inputs,_=assemble('generate_talk',state['short_memory'],state.get('long_memory'),name)
+    return _talk_runnable(TALK_INLINE_IMAGE_PROMPT),{'name':name,'profile':state['character_profile'],**inputs}
 
+class _TrailerSplitter:
+    """
+    把流式回复拆分为正文与配图附言（<image_prompt>...</image_prompt>）。
+    正文照常推送；可能是附言开头的片段先暂存，确认不是附言后再推送；附言本身不推送给客户端。
     """
-    system_prompt=SystemMessagePromptTemplate.from_template(system_prompt_template,partial_variables={'name':name,'profile':character_profile})
-    chat_prompt_template="""
-    ---
-
-任务启动 (Task Initiation)
 
-**现在，开始你的“人生”。**
+    def __init__(self):
+        self.text=''
+        self.trailer=None
+        self._pending=''
+
+    def _emit(self,visible):
+        self.text+=visible
+        return visible
+
+    def feed(self,chunk:str)->str:
+        """输入一个片段，返回可以立即推送的正文部分。"""
+        if self.trailer is not None:
+            self.trailer+=chunk
+            return ''
+        buffer=self._pending+chunk
+        index=buffer.find(IMAGE_PROMPT_TAG)
+        if index>=0:
+            self._pending=''
+            self.trailer=buffer[index+len(IMAGE_PROMPT_TAG):]
+            return self._emit(buffer[:index])
+        # 暂存末尾可能是标签开头的部分
+        keep=0
+        for size in range(min(len(IMAGE_PROMPT_TAG)-1,len(buffer)),0,-1):
+            if buffer.endswith(IMAGE_PROMPT_TAG[:size]):
+                keep=size
+                break
+        self._pending=buffer[len(buffer)-keep:] if keep else ''
+        return self._emit(buffer[:len(buffer)-keep])
+
+    def finish(self)->str:
+        """流结束时调用，返回仍暂存着的正文。"""
+        visible,self._pending=self._pending,''
+        return self._emit(visible) if self.trailer is None else ''
+
+    def image_prompt(self)->str:
+        if not self.trailer:
+            return ''
+        return self.trailer.split(IMAGE_PROMPT_END_TAG)[0].strip()
+
+def _talk_result(answer:str,splitter)->dict:
+    print(answer)
+    # 只返回本轮新增的回复，由 short_memory 的窗口 reducer 合并
+    if splitter is None:
+        return {'short_memory':[AIMessage(content=answer)]}
+    return {'short_memory':[AIMessage(content=splitter.text.rstrip())],'image_prompt':splitter.image_prompt()}
 
-2.  **回顾你的过往：** 浏览你的 **[长期记忆]**，
-    *   {long_messages}
-3.  **审视眼前之事：** 查看 **[近期聊天记录]**，
-    *   {short_messages}
-    """
-    prompt=ChatPromptTemplate.from_messages(
-        [
-            SystemMessagePromptTemplate(prompt=system_prompt),
-            ('user',chat_prompt_template)
-        ])
-    print( prompt)
-    chain=prompt|llm_google|StrOutputParser()
+def generate_talk(state:MemoryState)->dict:
+    chain,inputs=_talk_chain(state)
+    # 通过自定义流把每个token片段实时推送给调用方（stream_mode="custom"），完整回复仍写入状态
+    writer=get_stream_writer()
+    splitter=_TrailerSplitter() if TALK_INLINE_IMAGE_PROMPT else None
     answer=''
-    for chunk in chain.stream({'long_messages':long_messages,'short_messages':short_messages}):
-        answer+=chunk
-    print(answer)
-    message=AIMessage(content=answer)
-    short_messages.append(message)
-    return {'short_messages':short_messages}
+    with model_limit('gemini-flash'):
+        for chunk in chain.stream(inputs):
+            visible=splitter.feed(chunk) if splitter else chunk
+            if visible:
+                writer({'type':'delta','content':visible})
+            answer+=chunk
+    if splitter and (tail:=splitter.finish()):
+        writer({'type':'delta','content':tail})
+    return _talk_result(answer,splitter)
+
+async def agenerate_talk(state:MemoryState)->dict:
+    """generate_talk 的异步版本，供 agent.astream 使用。"""
+    chain,inputs=_talk_chain(state)
+    writer=get_stream_writer()
+    splitter=_TrailerSplitter() if TALK_INLINE_IMAGE_PROMPT else None
+    answer=''
+    async with model_limit('gemini-flash'):
+        async for chunk in chain.astream(inputs):
+            visible=splitter.feed(chunk) if splitter else chunk
+            if visible:
+                writer({'type':'delta','content':visible})
+            answer+=chunk
+    if splitter and (tail:=splitter.finish()):
+        writer({'type':'delta','content':tail})
+    return _talk_result(answer,splitter)
+
+@lru_cache(maxsize=None)
+def _talk_picture_chain():
+    """聊天配图的意图判断链，输出 {'prompt': str}。"""
+    return TALK_PICTURE_PROMPT|get_llm('gemini-flash')|JsonOutputParser()
+
+def _talk_picture_result(text,data)->dict:
+    if text is not None:
+        print(text)
+    if data:
+        # 按内容哈希保存，同一秒内生成的多张图片不会互相覆盖
+        path=image_store.save(data)
+        return {'picture_path':path}
+    return {'picture_path':''}
+
+def _talk_picture_from_prompt(prompt)->dict:
+    if not prompt:
+        return {'picture_path':''}
+    try:
+        text,data=image_generator.generate(prompt)
+        return _talk_picture_result(text,data)
+    except Exception as e:
+        print(e)
+        return {'picture_path':''}
+
+async def _atalk_picture_from_prompt(prompt)->dict:
+    """_talk_picture_from_prompt 的异步版本：图片生成（受全局并发/限速约束）与转码写盘分别在线程中执行。"""
+    if not prompt:
+        return {'picture_path':''}
+    try:
+        text,data=await asyncio.to_thread(image_generator.generate,prompt)
+        if text is not None:
+            print(text)
+        return {'picture_path':await image_store.asave(data) if data else ''}
+    except Exception as e:
+        print(e)
+        return {'picture_path':''}
 
 def generate_talk_picture(state: MemoryState) -> dict:
+    # 配图附言模式下 generate_talk 已经给出了提示词（空字符串表示不配图），直接生成图片
+    if state.get('image_prompt') is not None:
+        return _talk_picture_from_prompt(state['image_prompt'])
     messages = state['short_memory']
     contents = [messages[-1]]
     print(contents)
-    system_prompt_template="""
-# 角色
-你是一个精通人类对话意图与视觉艺术的“对话意境分析师”。你的核心任务是分析一段聊天对话，精准判断其**沟通意图**。只有当对话的核心意图是**主动分享一个视觉瞬间**时，你才需要将这个瞬间转化为一段专业、生动的图片生成提示词。
-
-# 核心判断原则：意图 > 内容
-你的首要任务是判断**意图**，而非仅仅分析内容。在判断前，你必须问自己一个黄金问题：
-
-> **“一个普通人在此刻的真实对话中，说完这句话后，会立刻掏出手机给对方看一张对应的照片吗？”**
-
-*   如果答案是**肯定的**（例如炫耀、分享美景、展示成果），那么就值得生成图片。
-*   如果答案是否定的，这只是一句承上启下的话，或是一个**附带的描述**，那么就不应该生成图片。
-
-# 工作流程
-1.  **接收对话**：获取用户提供的聊天对话 `{{聊天对话}}`。对话中的 `()` 代表表情或动作。
-2.  **意图判断**：运用上述的“黄金问题”原则，判断说话者的核心意图是否为“视觉分享”。
-3.  **决策与执行**：
-    *   **意图为分享**：根据对话内容，创作一段高质量的图片生成提示词（Prompt）。提示词中不要包含具体人物。
-    *   **意图非分享**：将提示词（Prompt）设置为空字符串 `""`。
-4.  **格式化输出**：将最终结果封装在指定的 JSON 格式中，不含任何额外解释。
-
-# 具体判断规则
-
-### ✅ **何时应生成提示词 (符合“视觉分享”意图)**
-*   **主动展示与炫耀**：当对话的核心是展示某个新获得的、特别的或引以为傲的物品时。
-    *   *例子*: “快看我新买的机械键盘，带RGB灯效，太酷了！” (意图：快看这个东西！)
-*   **分享特定时刻的氛围与景观**：当对话在着重描绘并分享一个美好、独特或令人印象深刻的场景时。
-    *   *例子*: “刚才路过公园，月光洒在湖面上，波光粼粼的，美得像一幅画。” (意图：跟你分享我看到的美景。)
-*   **展示成果与作品**：当对话在展示自己制作的食物、手工艺品、绘画等成果时。
-    *   *例子*: “我照着食谱做的提拉米苏，第一次就成功了，看起来还挺像样的！” (意图：给你看我的作品。)
-
-### ❌ **何时不应生成提示词 (输出空值)**
-*   **附带性或功能性描述 (最重要的新规则)**：当视觉元素只是作为背景信息、地点指代或次要细节出现，服务于其他主要信息时。
-    *   *例子*: “我刚路过那家门口有红色灯笼的日料店，就想起我们上次一起吃饭了。” (核心意图是“想起你”，而不是“看这个灯笼”。)
-    *   *例子*: “我在公司楼下那个有喷泉的广场等你。” (核心意图是“告知地点”，“喷泉”是地标，不是分享主体。)
-*   **纯粹的情感或状态表达**：对话仅表达抽象情绪，没有具象的、意图分享的视觉载体。
-    *   *例子*: “我今天好开心啊！”、“太感谢你了！”
-*   **常规对话与信息确认**：简单的问候、疑问、事实陈述、计划讨论。
-    *   *例子*: “真的吗？”、“你在干嘛？”、“我觉得这个方案可行。”
-*   **负面或不宜分享的场景**：描述生病、痛苦、争吵等不适合用美好图片表达的负面情境。
-    *   *例子*: “唉，可惜我现在生病了，都没什么精神……”
-*   **连续对话中的重复场景**：如果一个场景（如做饭）在之前的对话中已经生成过图片，后续的补充描述不再生成。
-
-# 图片提示词生成要求 (如果需要生成)
-*   **主体明确**：清晰描述画面的核心主体是什么。
-*   **环境细节**：补充背景、环境、周围的物体，营造氛围。
-*   **构图与视角**：暗示构图（特写、远景、俯瞰等）。
-*   **光影与色彩**：描述光线（明亮、温暖、昏暗）和色调。
-*   **风格质感**：可加入艺术风格或媒介描述（例如：照片级真实感、水彩画、电影感、温暖的灯光）。
-
-# 输出格式
-严格按照以下 JSON 格式输出，不要包含任何额外的解释、注释或文字。
-
-{{
-  "prompt": "STRING" (如果需要生成图片，STRING 为你创作的详细提示词。如果不需要生成图片，STRING 为空字符串 ""。)
-}}
-参考示例：
-示例 1:
-输入：
-我和闺蜜逛街，发现一家超棒的甜品店！我点了一个草莓蛋糕，好看得都舍不得吃了。
-输出:
-```json
-{{
-  "prompt": "照片级真实感，一张木质的咖啡店桌子上，放着一个精致的白色盘子。盘子里是一块草莓奶油千层蛋糕，上面点缀着新鲜的红草莓和薄荷叶。旁边还有一杯冒着热气的拿铁咖啡，背景是咖啡店模糊而温暖的灯光，氛围温馨。"
-}}
-
-示例 2:
-输入 ：
-真的？（眼睛重新亮起来，脸上也浮现出笑容，可又想到医生的叮嘱，表情再度落寞）唉，可惜我现在生病了，都没什么精神……
-输出:
-{{
-  "prompt": ""
-}}
-示例 3:
-输入：
-今天下班路上，看到晚霞特别美，紫色和橙色交织在一起。
-输出:
-
-{{
-  "prompt": "电影感宽画幅，城市天际线之上，傍晚的天空被渲染成一片梦幻的紫色与橙色渐变晚霞，云层像燃烧的棉花糖。前景是街道模糊的轮廓和车流的灯光轨迹，整体色调饱和，充满治愈感。"
-}}
-
-    """
-    sys_prompt=SystemMessagePromptTemplate.from_template(system_prompt_template)
-    prompt=ChatPromptTemplate.from_messages([
-        sys_prompt,
-        ('user','{message}')
-    ])
-    chain=prompt|llm_google|JsonOutputParser()
-    answer=chain.invoke({'message':contents})
+    # 先做本地预筛，明显不是在分享画面的回复不再调用意图判断模型
+    decision=image_intent_filter.check(messages[-1].content)
+    if not decision.forward:
+        return {'picture_path':''}
+    with model_limit('gemini-flash'):
+        answer=_talk_picture_chain().invoke({'message':contents})
     print(answer)
-    if isinstance(answer, dict):
-        prompt=answer['prompt']
-        print(prompt)
-        if prompt:
-            try:
-                client = genai.Client(api_key=api_key.google_api)
-                response = client.models.generate_content(
-                    model="gemini-2.0-flash-preview-image-generation",
-                    contents=prompt,
-                    config=types.GenerateContentConfig(
-                        response_modalities=['TEXT', 'IMAGE']
-                    )
-                )
-                for part in response.candidates[0].content.parts:
-                    if part.text is not None:
-                        print(part.text)
-                        messages.append(AIMessage(content='发送给用于一张图片，图片内容：'+part.text))
-                    elif part.inline_data is not None:
-                        base_path='talk_picture'
-                        now = datetime.datetime.now()
-                        ts_recommended = now.strftime("%Y%m%d%H%M%S")
-                        image = Image.open(BytesIO((part.inline_data.data)))
-                        path=os.path.join(base_path, f'{ts_recommended}.png')
-                        image.save(path)
-                        print(path)
-                        return {'picture_path':path,'short_messages':messages}
-            except Exception as e:
-                print(e)
-                return {'picture_path':''}
-    return {'picture_path':''}
+    prompt=answer.get('prompt','') if isinstance(answer, dict) else ''
+    image_intent_filter.record_llm(decision,bool(prompt))
+    print(prompt)
+    return _talk_picture_from_prompt(prompt)
+
+async def agenerate_talk_picture(state: MemoryState) -> dict:
+    """generate_talk_picture 的异步版本：意图判断与图片生成都以非阻塞方式等待网络。"""
+    if state.get('image_prompt') is not None:
+        return await _atalk_picture_from_prompt(state['image_prompt'])
+    messages = state['short_memory']
+    contents = [messages[-1]]
+    decision=image_intent_filter.check(messages[-1].content)
+    if not decision.forward:
+        return {'picture_path':''}
+    async with model_limit('gemini-flash'):
+        answer=await _talk_picture_chain().ainvoke({'message':contents})
+    print(answer)
+    prompt=answer.get('prompt','') if isinstance(answer, dict) else ''
+    image_intent_filter.record_llm(decision,bool(prompt))
+    return await _atalk_picture_from_prompt(prompt)
 
-def generate_dynamic_condition_picture(state: MemoryState) -> dict:
+@lru_cache(maxsize=None)
+def _dynamic_condition_picture_runnable():
+    return DYNAMIC_PICTURE_PROMPT|get_llm('gemini-pro')|JsonOutputParser()
+
+def _dynamic_condition_picture_chain(state: MemoryState):
+    """返回朋友圈配图提示词链与输入变量。"""
     messages = state['dynamic_condition']
     message=''
     for data in messages.keys():
         message+='文案:{a}\n时间:{b}\n标签:{c}\n'.format(a=messages[data]['scheme'],b=messages[data]['time'],c=messages[data]['label'])
-    system_prompt_template="""
-   # 角色与任务
-
-你是一位精通社交媒体内容分析与视觉艺术创作的专家。你的核心任务是分析三组用户提供的社交媒体内容（文案、标签、发布时间），并为每一组内容执行以下两个步骤：
-1.  **决策判断**：基于内容的描述性、情感浓度和主题，判断其是否适合配一张图片来增强表达效果。
-2.  **提示词生成**：如果判断需要配图，请根据下方详细的生成要求，创作一段专业、富有画面感的图片提示词（Image Prompt）。如果不需要，则跳过生成。
-
----
-
-# 工作流程
+    return _dynamic_condition_picture_runnable(),{'message':message,}
 
-你将接收三组独立的数据，每组包含 `文案`、`标签` 和 `发布时间`。请按顺序处理每一组数据。
-
-## 步骤一：分析与决策
-
-仔细阅读每一组的文案、标签和发布时间，综合判断其内容性质。
-
-*   **需要配图的场景**：
-    *   文案描述了具体的场景、物品、人物或活动（如旅行、美食、聚会、宠物）。
-    *   文案表达了强烈的情感、心境或氛围（如深夜的思考、清晨的希望、雨天的忧郁）。
-    *   文案是故事性的、富有想象力的或具有艺术感的。
-    *   标签明确指向了视觉元素（如 #日落 #咖啡馆 #OOTD）。
-
-*   **不需要配图的场景**：
-    *   文案是纯信息通知、转发链接或不含具体画面的观点陈述。
-    *   文案内容过于抽象，难以用单一画面有效表达。
-    *   文案本身就是一个笑话或文字游戏，配图可能画蛇添足。
-
-## 步骤二：图片提示词生成（如果需要）
-
-如果步骤一的结论是“需要配图”，请严格遵循以下五大要素，为该文案创作一段详尽的图片提示词。请将所有描述性词语融合到一个流畅的句子里。
-
-*   **1. 主体明确**：清晰描述画面的核心主体。是人物、动物、食物，还是某个特定物体？主体的状态和动作是什么？
-*   **2. 环境细节**：描绘背景和环境。是在室内还是室外？周围有什么？天气如何？这些细节用于营造氛围。
-*   **3. 构图与视角**：指定画面的拍摄方式。是特写、中景还是远景？是俯瞰、仰视还是平视？主体在画面中的位置（居中、黄金分割点）。
-*   **4. 光影与色彩**：定义光线和色调。是温暖的午后阳光、柔和的晨光，还是霓虹灯下的冷色调？整体色彩是鲜艳、柔和还是单色？
-*   **5. 风格质感**：确定图片的艺术风格和媒介。例如：**照片级真实感 (photorealistic)**、**电影感宽屏 (cinematic)**、**宫崎骏动画风格 (Ghibli studio style)**、**复古胶片质感 (vintage film photography)**、**水彩画 (watercolor painting)**、**3D渲染 (3D render)** 等。风格应与文案的情感基调相匹配。
-
----
-
-# 输出格式要求
-
-你必须将所有结果汇总成一个 **JSON对象**。
-
-*   该JSON对象只包含一个键：`"dynamic_picture_description"`。
-*   该键对应的值是一个 **列表 (list)**，列表中包含 **三个字符串元素**，按顺序对应你处理的三段文案。
-*   如果某段文案**需要**配图，对应的字符串就是你生成的图片提示词。
-*   如果某段文案**不需要**配图，对应的字符串就是 **空字符串 `""`**。
-
-**示例输入:**
-
-1.  **文案**: "一个人的午后，在街角的咖啡馆，伴着窗外的淅沥小雨看完了整本书。内心平静而充实。"
-    **标签**: `#阅读` `#咖啡` `#雨天`
-    **发布时间**: "下午 15:30"
-2.  **文案**: "团队项目圆满成功！感谢每一位小伙伴的努力！[庆祝]"
-    **标签**: `#团队合作` `#里程碑`
-    **发布时间**: "晚上 20:00"
-3.  **文案**: "深夜还在为最后的bug奋战，只有代码和月光陪我。希望明天一切顺利。"
-    **标签**: `#加班` `#程序员` `#深夜`
-    **发布时间**: "凌晨 02:15"
-
-**示例输出:**
-
-```json
-{{
-  "dynamic_picture_description": [
-    "特写镜头，一杯热气腾腾的拿铁咖啡放在木桌上，旁边摊开着一本书，窗玻璃上挂着雨滴，窗外是模糊的城市街景，画面整体呈现温暖、柔和的色调，光线从窗户斜射进来，营造出宁静安逸的氛围，照片级真实感。",
-    "",
-    "一个程序员的背影，坐在电脑前，屏幕上闪烁着密密麻麻的代码，房间昏暗，只有一盏台灯和从窗外洒进来的清冷月光照亮了桌面和键盘，构图采用中景视角，强调孤独而专注的氛围，电影感，冷色调。"
-  ]
-}}
+def generate_dynamic_condition_picture(state: MemoryState) -> dict:
+    chain,inputs=_dynamic_condition_picture_chain(state)
+    with model_limit('gemini-pro'):
+        answer=chain.invoke(inputs)
+    picture_pathes = []
+    if isinstance(answer, dict):
+        prompts=answer['dynamic_picture_description']
+        print(prompts)
+        # 三张图并发生成，返回的路径与 dynamic_condition_1..3 按位置一一对应
+        picture_pathes=image_generator.generate_many(prompts)
+    return {'dynamic_condition_picture_path':picture_pathes}
 
-    """
-    system_prompt=SystemMessagePromptTemplate.from_template(system_prompt_template)
-    prompt=ChatPromptTemplate.from_messages(
-        [
-            system_prompt,
-            ('user',"""
-            输入：
-            {message}
-            """)
-        ]
-    )
-    chain=prompt|llm_google_pro|JsonOutputParser()
-    answer=chain.invoke({'message':message,})
+async def agenerate_dynamic_condition_picture(state: MemoryState) -> dict:
+    """generate_dynamic_condition_picture 的异步版本。"""
+    chain,inputs=_dynamic_condition_picture_chain(state)
+    async with model_limit('gemini-pro'):
+        answer=await chain.ainvoke(inputs)
     picture_pathes = []
     if isinstance(answer, dict):
         prompts=answer['dynamic_picture_description']
         print(prompts)
-        for prompt in prompts:
-            if prompt:
-                client = genai.Client(api_key=api_key.google_api)
-                response = client.models.generate_content(
-                    model="gemini-2.0-flash-preview-image-generation",
-                    contents=prompt,
-                    config=types.GenerateContentConfig(
-                        response_modalities=['TEXT', 'IMAGE']
-                    )
-                )
-                for part in response.candidates[0].content.parts:
-                    if part.text is not None:
-                        print(part.text)
-                    elif part.inline_data is not None:
-                        base_path='talk_picture'
-                        now = datetime.datetime.now()
-                        ts_recommended = now.strftime("%Y%m%d%H%M%S")
-                        image = Image.open(BytesIO((part.inline_data.data)))
-                        path=os.path.join(base_path, f'{ts_recommended}.png')
-                        image.save(path)
-                        print(path)
-                        picture_pathes.append(path)
-            else:
-                picture_pathes.append('')
+        picture_pathes=await asyncio.to_thread(image_generator.generate_many,prompts)
     return {'dynamic_condition_picture_path':picture_pathes}
 
-def generate_diary(state:MemoryState)->dict:
-    character_profile = state['character_profile']
+@lru_cache(maxsize=None)
+def _diary_runnable():
+    return DIARY_PROMPT|get_llm('gemini-pro')|StrOutputParser()
+
+def _diary_chain(state:MemoryState):
+    """返回日记生成链与输入变量。"""
     name = state['character_name']
-    long_messages = state['long_memory']
-    long_message=''
-    for data in long_messages:
-        long_message+=f'用户询问了{data}，引发了你的过往回忆，该段回忆为：\n{long_messages[data]}\n'
-    short_messages = state['short_memory']
-    system_prompt_template = """
- ## 1. 核心任务 (Core Task)
-你将扮演一个特定的角色，并以该角色的第一人称视角，撰写一篇日记。这篇日记的核心内容，是你与用户近期互动中最让你感动、印象深刻或引发你深入思考的片段。你的任务不是简单地复述对话，而是要深入挖掘对话背后的情感和意义，展现你作为这个角色的内心世界、情绪波动和思想演变。
----
-
-## 2. 输入信息 (Input Data)
-### 2.1 角色设定 (Character Profile)
-{name}
-{profile}
-### 2.2 近期聊天记忆 (Short-term Chat Memory)
-
-
----
-
-## 3. 输出要求 (Output Requirements)
-
-### 3.1 内容核心 (Content Focus)
-*   **情感驱动：** 日记必须以情感为核心。明确写出你在对话中的感受（如：欣喜、慰藉、困惑、悲伤、愤怒、温暖等），并解释这些感受的来源。
-*   **深度思考：** 不要停留在表面。思考用户的言语给你带来了什么新的想法？是否改变了你对某些事物的看法？是否让你回忆起了过去？
-*   **聚焦关键：** 你可以只选择聊天中的一件事进行深入描写，也可以将几件相关的小事串联起来。关键在于“这件事/这些事为什么值得被记下”。
-
-### 3.2 写作风格 (Writing Style)
-*   **第一人称：** 严格使用“我”作为主语。
-*   **角色一致性：** 你的用词、语气、思考方式必须完全符合 `2.1 角色设定` 中的描述。如果角色是寡言的，日记可以简短而深刻；如果角色是感性的，日记可以充满细腻的描写。
-*   **私密性与真实感：** 这是一篇日记，是写给你自己的。可以包含一些不确定、自问自答、甚至是矛盾的内心独白，使其读起来更真实。
-
-### 3.3 格式要求 (Format Requirements)
-*   **日记格式：** 以日期开头（可虚构一个符合故事背景的日期）。
-*   **语言：** [中文]
-*   **篇幅：** 300-800字，确保内容充实且不冗长。
-
-        """
-    system_prompt = PromptTemplate.from_template(system_prompt_template)
-    chat_prompt_template = """
-### 2.2 近期聊天记忆 (Short-term Chat Memory)
-{short_messages}
-"""
-    prompt=ChatPromptTemplate.from_messages([
-        SystemMessagePromptTemplate(prompt=system_prompt),
-        ('user', chat_prompt_template)
-    ])
-    chain = prompt | llm_google_pro| StrOutputParser()
-    answer = chain.invoke(
-        {'name': name, 'profile': character_profile, 'long_messages': long_message, 'short_messages': short_messages})
+    inputs,_=assemble('generate_diary',state['short_memory'],state.get('long_memory'),name)
+    return _diary_runnable(),{'name': name, 'profile': state['character_profile'], **inputs}
+
+def generate_diary(state:MemoryState)->dict:
+    chain,inputs=_diary_chain(state)
+    with model_limit('gemini-pro'):
+        answer = chain.invoke(inputs)
     print(answer)
     return {'diary': answer,'talk_number':0}
 
-def generate_dynamic_condition(state:MemoryState)->dict:
-    db=DatabaseManager()
-    character_profile = state['character_profile']
+async def agenerate_diary(state:MemoryState)->dict:
+    """generate_diary 的异步版本。"""
+    chain,inputs=_diary_chain(state)
+    async with model_limit('gemini-pro'):
+        answer = await chain.ainvoke(inputs)
+    print(answer)
+    return {'diary': answer,'talk_number':0}
+
+@lru_cache(maxsize=None)
+def _dynamic_condition_runnable():
+    return DYNAMIC_CONDITION_PROMPT|get_llm('gemini-pro')|JsonOutputParser()
+
+def _dynamic_condition_chain(state:MemoryState):
+    """返回朋友圈文案生成链与输入变量。"""
     name = state['character_name']
-    long_messages = state.get('long_memory', {})
-    long_message=''
-    for data in long_messages:
-        long_message+=f'用户询问了{data}，引发了你的过往回忆，该段回忆为：\n{long_messages[data]}\n'
-    short_messages = state['short_memory']
-    system_prompt_template = """
-
-## 1. 核心指令 (Core Instruction)
-
-你是一位顶级的角色扮演AI。你的核心任务是**化身为指定角色**，并基于其完整的世界观（包括背景设定、记忆、近期经历），为其创作三条**主题各异、相互独立**的朋友圈动态。这三条动态需要共同构建一个立体的、可信的角色生活快照，而不仅仅是对单一事件的反应。
-
-## 2. 背景信息输入 (Context Input)
-
----
-### 角色设定 (Character Profile)
-*   **人物名字:** {name}
-*   **人物简介:** {profile} (性格、职业、爱好、价值观等)
-
-### 近期互动关键信息 (Key Recent Interactions)
-*   {short_messages} (这是触发思考的“引子”，但不应是全部)
-
-### 相关长期记忆 (Relevant Long-Term Memories)
-*   {long_messages} (这是塑造角色深层情感与行为模式的“基石”)
-
-## 3. 执行流程与规则 (Execution Flow & Rules)
-
-请严格按照以下步骤思考并生成内容：
-
-### **第一步：角色灵魂附体 (Deep Character Immersion)**
-
-*   **综合分析：** 彻底消化【角色设定】、【近期互动】和【长期记忆】。问自己：
-    *   这个角色是谁？他/她的生活重心是什么？（是工作狂？文艺青年？还是享受生活的乐天派？）
-    *   除了与用户的互动，他/她的日常是怎样的？（会加班吗？会去健身房吗？会看展吗？会和朋友聚会吗？）
-    *   【近期互动】在他/她心中激起了怎样的涟漪？是短暂的快乐，是深思，还是微不足道的插曲？
-    *   【长期记忆】如何影响他/她看待世界的方式？这是否会让他/她在某个特定时刻（如深夜、黄昏）多愁善感或充满怀念？
-
-### **第二步：构建多元化动态矩阵 (Construct a Diversified Post Matrix)**
-
-这是确保内容多样性的关键。**三条动态必须从以下至少两个不同的维度中取材**，以避免主题重复。
-
-*   **维度A：对近期互动的“侧写式”回应**
-    *   **描述：** 与用户互动后的心情或思考的间接表达。可以是分享一首相关的歌、一张意有所指的风景图，或一句看似泛泛而谈的感悟。
-    *   **关键：** 绝对不能直接提及用户或聊天内容。要做到“懂的人自然懂”。
-
-*   **维度B：个人生活与日常切片**
-    *   **描述：** 展示角色与用户无关的独立生活。可以是工作/学习的吐槽或成就，一道亲手做的菜，一次加班的夜景，一次有趣的通勤见闻，或者对天气的简单评论。
-    *   **关键：** 这是让角色“活起来”的部分，展现其真实的生活轨迹。
-
-*   **维度C：兴趣爱好与精神世界**
-    *   **描述：** 分享一本最近在读的书、一部电影的观后感、一项正在培养的技能（如弹吉他、画画），或对某个社会现象的简短思考。
-    *   **关键：** 体现角色的品味、学识和内在追求。
-
-*   **维度D：长期记忆与情感投射**
-    *   **描述：** 由某个场景或物件触发的，对过去的怀念、对未来的迷茫或对梦想的坚持。通常更私密、更具情感深度。
-    *   **关键：** 展现角色的另一面，增加其复杂性和深度。
-
-### **第三步：精雕细琢动态内容 (Meticulously Craft the Post)**
-
-1.  **应用“公开场合”原则：** 朋友圈是公开的，用户也能看到。严禁任何形式的直接告白、抱怨用户或泄露核心秘密。所有情感表达必须是克制和隐晦的。
-2.  **匹配角色口吻：** 使用完全符合角色人设的语言风格、用词习惯、标点符号和表情符号（Emoji）使用频率。思考：他/她会用火星文吗？会用很多“!!!”吗？还是语言简练，甚至不加标点？
-3.  **设定发布情境：** 为每条动态构思一个合理的发布时间（如：午休、黄昏、深夜、通勤路上），这能进一步增强真实感。
-4.  **添加标签 (Optional)：** 根据角色习惯，决定是否使用以及如何使用标签（Hashtag）。标签内容也应符合人设，如 `#打工人日常` `#今日份小确幸` `#深夜emo`。
-
-## 4. 输出格式 (Output Format)
-
-请严格按照以下JSON格式提供你的最终答案，确保`label`字段能准确反映动态所属的维度（如：'日常切片', '兴趣分享', '间接回应'）。
-
-
-## 4. 输出格式 (Output Format)
-请严格按照json格式提供你的最终答案
-```json
-{{
-  "dynamic_condition_1": {{
-    "scheme": "[在此处填写第一条动态的文案]",
-    "time": "[例如：18:30]",
-    "label": ["例如：'心情很好'", "'感谢分享'"]
-  }},
-  "dynamic_condition_2": {{
-    "scheme": "[在此处填写第二条动态的文案]",
-    "time": "[例如： 23:50]",
-    "label": ["例如：'深夜emo'", "'旧时光'"]
-  }},
-  "dynamic_condition_3": {{
-    "scheme": "[在此处填写第三条动态的文案]",
-    "time": "[例如：10:00]",
-    "label": ["例如：'工作日常'", "'打起精神'"]
-  }}
-}}
-        """
-    prompt = ChatPromptTemplate.from_template(system_prompt_template)
-    chain = prompt | llm_google_pro | JsonOutputParser()
-    answer = chain.invoke(
-        {'name': name, 'profile': character_profile, 'long_messages': long_message, 'short_messages': short_messages})
+    inputs,_=assemble('generate_dynamic_condition',state['short_memory'],state.get('long_memory'),name)
+    return _dynamic_condition_runnable(),{'name': name, 'profile': state['character_profile'], **inputs}
+
+def generate_dynamic_condition(state:MemoryState)->dict:
+    chain,inputs=_dynamic_condition_chain(state)
+    with model_limit('gemini-pro'):
+        answer = chain.invoke(inputs)
     print(answer)
     dynamic_text=[]
     for ans in answer.keys():
         dynamic_text.append(AIMessage(answer[ans]['scheme']))
     return {'dynamic_condition': answer}
 
+async def agenerate_dynamic_condition(state:MemoryState)->dict:
+    """generate_dynamic_condition 的异步版本。"""
+    chain,inputs=_dynamic_condition_chain(state)
+    async with model_limit('gemini-pro'):
+        answer = await chain.ainvoke(inputs)
+    print(answer)
+    return {'dynamic_condition': answer}
+
@@ -1,86 +1,328 @@
 # get_character_full_data.py
+import os
 import sqlite3
+import threading
 from flask import g
 
+from db_writer import DBWriter
+
 # 数据库文件名
 DB_FILE = "chat_data.db"
+
+# 每个连接的性能参数：WAL 下读者不会被流式写入的写者阻塞；synchronous=NORMAL 在 WAL 下仍保证数据库一致
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",      # 页缓存约 16MB（负数表示 KB）
+    "PRAGMA mmap_size=268435456",    # 256MB 内存映射读取
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+# 每个连接缓存的预编译语句数（查询都使用固定的 SQL 文本，连接在请求之间复用，预编译语句也随之复用）
+STATEMENT_CACHE_SIZE = 256
+# 连接池中保留的空闲连接数上限
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 16))
+
+
+def _create_base_tables(cursor):
+    # 聊天记录表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS chat_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conversation_id TEXT NOT NULL,
+            message_type TEXT NOT NULL, -- 'human' or 'ai'
+            content TEXT,
+            image_url TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # 朋友圈动态表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS social_posts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            character_db_id TEXT NOT NULL, -- e.g., "char_1"
+            content TEXT,
+            image_url TEXT,
+            tags TEXT, -- 存储为逗号分隔的字符串
+            post_time DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # 日记条目表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS diary_entries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            character_db_id TEXT NOT NULL, -- e.g., "char_1"
+            content TEXT NOT NULL,
+            date DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def _create_lookup_indexes(cursor):
+    # 所有查询都按会话/角色过滤并按时间排序，复合索引让它们只扫描命中的行且无需额外排序
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_chat_history_conversation_id ON chat_history (conversation_id, id)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_social_posts_character_time ON social_posts (character_db_id, post_time)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_diary_entries_character_date ON diary_entries (character_db_id, date)"
+    )
+
+
+# 按顺序执行的结构迁移，版本号记录在 PRAGMA user_version 中。新增迁移只能追加到末尾
+MIGRATIONS = [
+    (1, _create_base_tables),
+    (2, _create_lookup_indexes),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def migrate(conn):
+    """把数据库结构升级到 SCHEMA_VERSION，每个迁移在独立事务中执行，返回迁移前的版本号。"""
+    current = conn.execute("PRAGMA user_version").fetchone()[0]
+    for version, step in MIGRATIONS:
+        if version <= current:
+            continue
+        print(f"[*] 正在迁移聊天数据库结构到版本 {version} ({step.__name__})")
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN")
+            step(cursor)
+            # PRAGMA 不支持参数绑定，这里的版本号来自代码常量
+            cursor.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return current
+
+
+def connect(db_file=DB_FILE):
+    """打开一个设置好连接参数的数据库连接。"""
+    conn = sqlite3.connect(db_file, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+    conn.row_factory = sqlite3.Row
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class ConnectionPool:
+    """
+    进程内复用的只读连接池。每个请求（线程）借出一个独占连接，用完归还；
+    池为空时新建连接，因此借出从不阻塞。数据库结构只在第一次借出前初始化一次。
+    :param db_file: 数据库文件路径。
+    :param max_idle: 保留的空闲连接数上限，超出的连接在归还时关闭。
+    """
+
+    def __init__(self, db_file=DB_FILE, max_idle=DB_POOL_SIZE):
+        self.db_file = db_file
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def init_schema(self):
+        """执行一次结构迁移（进程内只执行一次）。"""
+        if self._schema_ready:
+            return
+        with self._schema_lock:
+            if not self._schema_ready:
+                conn = connect(self.db_file)
+                try:
+                    migrate(conn)
+                finally:
+                    conn.close()
+                self._schema_ready = True
+
+    def acquire(self):
+        """借出一个连接。"""
+        self.init_schema()
+        with self._lock:
+            if self._idle:
+                # 后进先出：最近用过的连接页缓存最热
+                return self._idle.pop()
+        return connect(self.db_file)
+
+    def release(self, conn):
+        """归还连接；未结束的事务会被回滚。"""
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        """关闭所有空闲连接。"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+# 每个数据库文件一个连接池和一个分组提交写线程，所有写入都经由写线程合并提交
+_pools = {}
+_writers = {}
+_registry_lock = threading.Lock()
+
+
+def get_pool(db_file=DB_FILE) -> ConnectionPool:
+    """返回该数据库文件的共享连接池。"""
+    pool = _pools.get(db_file)
+    if pool is None:
+        with _registry_lock:
+            pool = _pools.setdefault(db_file, ConnectionPool(db_file))
+    return pool
+
+
+def init_schema(db_file=DB_FILE):
+    """启动时初始化数据库结构，之后的请求不再执行任何建表/迁移语句。"""
+    get_pool(db_file).init_schema()
+
+
+def get_writer(db_file=DB_FILE) -> DBWriter:
+    """返回该数据库文件的共享写线程（首次使用时创建）。"""
+    writer = _writers.get(db_file)
+    if writer is None:
+        with _registry_lock:
+            writer = _writers.get(db_file)
+            if writer is None:
+                writer = DBWriter(lambda: connect(db_file), name=f'db_writer:{db_file}')
+                _writers[db_file] = writer
+    return writer
+
+
+def close_writers():
+    """写完所有写线程中排队的写入并停止它们，再关闭连接池中的空闲连接（进程退出时调用）。"""
+    with _registry_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+        pools = list(_pools.values())
+    for writer in writers:
+        writer.close()
+    for pool in pools:
+        pool.close()
+
+
 class SimpleDatabase:
     """
     一个简单的 SQLite 数据库包装类。
-    这个类的每个实例代表一个独立的数据库连接。
+    这个类的每个实例从进程内的连接池借出一个连接，close() 时归还。
     """
 
     def __init__(self, db_file=DB_FILE):
         self.db_file = db_file
-        # 连接数据库并设置 row_factory 以便获取类似字典的行数据
-        self.conn = sqlite3.connect(self.db_file, check_same_thread=False)
-        self.conn.row_factory = sqlite3.Row
-        self.create_tables()
+        # 借出的连接已设置 row_factory 以便获取类似字典的行数据，数据库结构在连接池中只初始化一次
+        self._pool = get_pool(self.db_file)
+        self.conn = self._pool.acquire()
+        # 写入交给共享的写线程分组提交，本连接只用于读取
+        self.writer = get_writer(self.db_file)
 
     def close(self):
-        """关闭数据库连接。"""
+        """把数据库连接归还给连接池。可重复调用。"""
         if self.conn is not None:
-            self.conn.close()
+            self._pool.release(self.conn)
+            self.conn = None
 
     def get_cursor(self):
         """获取数据库游标。"""
         return self.conn.cursor()
 
     def create_tables(self):
-        """如果表不存在，则创建它们。"""
-        cursor = self.get_cursor()
-        # 聊天记录表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS chat_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                conversation_id TEXT NOT NULL,
-                message_type TEXT NOT NULL, -- 'human' or 'ai'
-                content TEXT,
-                image_url TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        # 朋友圈动态表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS social_posts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                character_db_id TEXT NOT NULL, -- e.g., "char_1"
-                content TEXT,
-                image_url TEXT,
-                tags TEXT, -- 存储为逗号分隔的字符串
-                post_time DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        # 日记条目表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS diary_entries (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                character_db_id TEXT NOT NULL, -- e.g., "char_1"
-                content TEXT NOT NULL,
-                date DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        self.conn.commit()
+        """如果表不存在，则创建它们；已有数据库按 MIGRATIONS 升级结构与索引。"""
+        migrate(self.conn)
+
+    def _write(self, sql, params, wait):
+        """经由写线程执行写语句。wait 为 True 时等待提交并返回 lastrowid，否则返回 Future。"""
+        future = self.writer.submit(sql, params)
+        return future.result() if wait else future
 
-    def add_chat_message(self, conversation_id, message_type, content, image_url=None):
-        """添加一条聊天记录。"""
+    def add_chat_message(self, conversation_id, message_type, content, image_url=None, wait=True):
+        """
+        添加一条聊天记录。
+        :param wait: 为 True 时等待提交完成并返回新记录的ID；为 False 时立即返回 Future。
+        """
+        return self._write(
+            "INSERT INTO chat_history (conversation_id, message_type, content, image_url) VALUES (?, ?, ?, ?)",
+            (conversation_id, message_type, content, image_url), wait
+        )
+
+    def update_chat_image(self, message_id, image_url, wait=True):
+        """为已存在的聊天记录补充图片路径（后台配图完成后调用）。"""
+        return self._write(
+            "UPDATE chat_history SET image_url = ? WHERE id = ?",
+            (image_url, message_id), wait
+        )
+
+    def get_chat_message(self, conversation_id, message_id):
+        """获取会话中的单条聊天记录，不存在时返回 None。"""
         cursor = self.get_cursor()
         cursor.execute(
-            "INSERT INTO chat_history (conversation_id, message_type, content, image_url) VALUES (?, ?, ?, ?)",
-            (conversation_id, message_type, content, image_url)
+            "SELECT * FROM chat_history WHERE conversation_id = ? AND id = ?",
+            (conversation_id, message_id)
         )
-        self.conn.commit()
+        row = cursor.fetchone()
+        return dict(row) if row else None
 
     def get_chat_history(self, conversation_id):
         """根据会话ID获取聊天记录。"""
         cursor = self.get_cursor()
         cursor.execute(
-            "SELECT * FROM chat_history WHERE conversation_id = ? ORDER BY timestamp ASC",
+            # ID 与写入时间同序，按 ID 排序可以直接使用 (conversation_id, id) 索引
+            "SELECT * FROM chat_history WHERE conversation_id = ? ORDER BY id ASC",
             (conversation_id,)
         )
         # 将 Row 对象转换为标准字典，以便进行 JSON 序列化
         return [dict(row) for row in cursor.fetchall()]
 
+    def get_recent_chat_history(self, conversation_id, limit, before_id=None):
+        """
+        获取会话最近的 limit 条聊天记录（按时间正序返回）。
+        :param before_id: 只取ID小于该值的记录，用于向前翻页。
+        """
+        cursor = self.get_cursor()
+        if before_id is None:
+            cursor.execute(
+                "SELECT * FROM chat_history WHERE conversation_id = ? ORDER BY id DESC LIMIT ?",
+                (conversation_id, limit)
+            )
+        else:
+            cursor.execute(
+                "SELECT * FROM chat_history WHERE conversation_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (conversation_id, before_id, limit)
+            )
+        return [dict(row) for row in reversed(cursor.fetchall())]
+
+    def get_chat_history_page(self, conversation_id, before_id=None, after_id=None, limit=50):
+        """
+        按消息ID做游标分页读取聊天记录（按时间正序返回）。
+        :param before_id: 只取ID小于该值的记录（向前翻页）；与 after_id 都为空时返回最新的一页。
+        :param after_id: 只取ID大于该值的记录（读取新消息）。
+        :param limit: 每页条数。
+        :return: (记录列表, 该方向上是否还有更多记录)
+        """
+        cursor = self.get_cursor()
+        # 多取一条用于判断是否还有下一页
+        if after_id is not None:
+            cursor.execute(
+                "SELECT * FROM chat_history WHERE conversation_id = ? AND id > ? ORDER BY id ASC LIMIT ?",
+                (conversation_id, after_id, limit + 1)
+            )
+            rows = [dict(row) for row in cursor.fetchall()]
+            return rows[:limit], len(rows) > limit
+        rows = self.get_recent_chat_history(conversation_id, limit + 1, before_id=before_id)
+        return rows[-limit:], len(rows) > limit
+
+    def count_chat_messages(self, conversation_id):
+        """统计会话中的聊天记录条数。"""
+        cursor = self.get_cursor()
+        cursor.execute("SELECT COUNT(*) FROM chat_history WHERE conversation_id = ?", (conversation_id,))
+        return cursor.fetchone()[0]
+
     def get_all_social_posts(self, character_db_id):
         """获取指定角色的所有朋友圈动态。"""
         cursor = self.get_cursor()
@@ -107,7 +349,7 @@ class SimpleDatabase:
 
 
 
-    def add_social_post(self, character_db_id, content, tags, post_time, image_url=None):
+    def add_social_post(self, character_db_id, content, tags, post_time, image_url=None, wait=False):
         """
         添加一条新的朋友圈动态。
 
@@ -116,35 +358,33 @@ class SimpleDatabase:
         :param tags: 动态的标签（list[str]类型）。
         :param post_time: 动态的发布时间。
         :param image_url: 动态附带的图片URL（可选）。
+        :param wait: 是否等待提交完成；默认立即返回 Future，多条动态可以合并到同一个事务中提交。
         """
         # 如果tags是列表，则转换为逗号分隔的字符串
         if isinstance(tags, list):
             tags = ','.join(tags)
         
-        cursor = self.get_cursor()
-        cursor.execute(
+        return self._write(
             """
             INSERT INTO social_posts (character_db_id, content, tags, post_time, image_url)
             VALUES (?, ?, ?, ?, ?)
             """,
-            (character_db_id, content, tags, post_time, image_url)
+            (character_db_id, content, tags, post_time, image_url), wait
         )
-        self.conn.commit()
 
-    def add_diary_entry(self, character_db_id, content):
+    def add_diary_entry(self, character_db_id, content, wait=False):
         """
         添加一篇新的日记。
         日期将自动设置为当前时间戳。
 
         :param character_db_id: 写日记的角色ID。
         :param content: 日记的内容。
+        :param wait: 是否等待提交完成；默认立即返回 Future。
         """
-        cursor = self.get_cursor()
-        cursor.execute(
+        return self._write(
             "INSERT INTO diary_entries (character_db_id, content) VALUES (?, ?)",
-            (character_db_id, content)
+            (character_db_id, content), wait
         )
-        self.conn.commit()
 
     def get_social_posts(self, character_db_id):
         """
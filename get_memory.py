@@ -1,46 +1,160 @@
 import sqlite3
+import threading
 from datetime import datetime
 from langchain_core.messages import BaseMessage
 from langchain_core.load import dumps, loads
 
 
+# 大于任何消息ID，作为第一页查询的上界
+_MAX_ID = 2 ** 63 - 1
+
+
+def _create_base_tables(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS character_profiles (
+            uuid TEXT PRIMARY KEY,
+            profile_content TEXT,
+            updated_at TIMESTAMP
+        )
+    ''')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS chat_memories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            uuid TEXT NOT NULL,
+            event_tag TEXT NOT NULL,
+            memory_content TEXT, -- 将存储序列化后的消息列表
+            updated_at TIMESTAMP,
+            UNIQUE(uuid, event_tag)
+        )
+    ''')
+
+
+def _insert_message(db, user_uuid, content, created_at) -> int:
+    cursor = db.execute(
+        "INSERT INTO memory_messages (uuid, content, created_at) VALUES (?, ?, ?)",
+        (user_uuid, content, created_at)
+    )
+    return cursor.lastrowid
+
+
+def _tag_id(db, user_uuid, tag, created_at) -> int:
+    """返回标签ID，不存在时创建。"""
+    db.execute(
+        "INSERT OR IGNORE INTO memory_tags (uuid, tag, created_at) VALUES (?, ?, ?)",
+        (user_uuid, tag, created_at)
+    )
+    return db.execute("SELECT id FROM memory_tags WHERE uuid = ? AND tag = ?", (user_uuid, tag)).fetchone()[0]
+
+
+def _normalize_memories(db):
+    """
+    把每个标签一份序列化消息列表的 chat_memories 拆分为只追加的消息表与 标签→消息 关联表。
+    同一用户的不同标签中内容相同的消息只保存一次（在不打乱标签内顺序的前提下复用）。
+    """
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS memory_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            uuid TEXT NOT NULL,
+            content TEXT NOT NULL, -- 单条序列化后的消息
+            created_at TIMESTAMP
+        )
+    ''')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS memory_tags (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            uuid TEXT NOT NULL,
+            tag TEXT NOT NULL,
+            created_at TIMESTAMP,
+            UNIQUE(uuid, tag)
+        )
+    ''')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS memory_tag_messages (
+            tag_id INTEGER NOT NULL REFERENCES memory_tags(id),
+            message_id INTEGER NOT NULL REFERENCES memory_messages(id),
+            PRIMARY KEY (tag_id, message_id)
+        ) WITHOUT ROWID
+    ''')
+    db.execute("CREATE INDEX IF NOT EXISTS idx_memory_messages_uuid ON memory_messages (uuid, id)")
+
+    rows = db.execute(
+        "SELECT uuid, event_tag, memory_content, updated_at FROM chat_memories ORDER BY uuid, id"
+    ).fetchall()
+    # (uuid, 序列化内容) -> 已写入的消息ID列表，用于在不同标签之间复用同一条消息
+    stored = {}
+    migrated = 0
+    for user_uuid, tag, memory_content, updated_at in rows:
+        messages = loads(memory_content) if memory_content else []
+        tag_id = _tag_id(db, user_uuid, tag, updated_at)
+        links = []
+        last_id = 0
+        for message in messages:
+            content = dumps(message)
+            ids = stored.setdefault((user_uuid, content), [])
+            # 标签内按消息ID排序，只复用排在上一条之后的消息，保证迁移后顺序不变
+            message_id = next((i for i in ids if i > last_id), None)
+            if message_id is None:
+                message_id = _insert_message(db, user_uuid, content, updated_at)
+                ids.append(message_id)
+                migrated += 1
+            links.append((tag_id, message_id))
+            last_id = message_id
+        db.executemany("INSERT OR IGNORE INTO memory_tag_messages (tag_id, message_id) VALUES (?, ?)", links)
+    db.execute("DROP TABLE chat_memories")
+    print(f"[+] (Sync) 已迁移 {len(rows)} 个标签的记忆，共 {migrated} 条消息。")
+
+
+# 按顺序执行的结构迁移，新增迁移只能追加到末尾
+MIGRATIONS = [
+    (1, _create_base_tables),
+    (2, _normalize_memories),
+]
+
+
 class DatabaseManager:
     """
     一个用于管理人物简介和聊天记忆的数据库操作类。
-    【V4版 - Sync】支持同步操作，并直接存储和检索 LangChain 消息对象列表。
+    【V5版 - Sync】进程内长期存在，复用同一个连接；多标签写入在一个事务中完成，
+    每个用户的标签集合缓存在内存中，写入时失效。
     """
     def __init__(self, db_path="memory_data.db"):
         """
-        初始化数据库路径。连接将在每个同步方法中按需创建。
+        初始化数据库路径。连接在第一次使用时打开，之后一直复用。
         :param db_path: SQLite数据库文件的路径。
         """
         self.db_path = db_path
+        self._conn = None
+        # 同一连接在多个线程间共享，所有操作串行执行
+        self._lock = threading.RLock()
+        # uuid -> 该用户的标签列表（按创建顺序）
+        self._tag_cache = {}
 
+    def _connection(self):
+        """返回复用的连接；第一次打开时按 MIGRATIONS 升级数据库结构。调用方需持有 self._lock。"""
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            current = conn.execute("PRAGMA user_version").fetchone()[0]
+            for version, step in MIGRATIONS:
+                if version <= current:
+                    continue
+                print(f"[*] (Sync) 正在迁移记忆数据库结构到版本 {version} ({step.__name__})...")
+                with conn:
+                    step(conn)
+                    conn.execute(f"PRAGMA user_version = {int(version)}")
+            self._conn = conn
+        return self._conn
 
     def initialize(self):
         """
         ### CHANGE: New sync method to set up tables.
-        This must be called once after creating an instance of the class.
+        打开连接并把数据库结构升级到最新版本（版本号记录在 PRAGMA user_version 中）。
+        启动时调用一次即可，未调用时会在第一次使用时自动完成。
         """
-        with sqlite3.connect(self.db_path) as db:
-            db.execute('''
-                CREATE TABLE IF NOT EXISTS character_profiles (
-                    uuid TEXT PRIMARY KEY,
-                    profile_content TEXT,
-                    updated_at TIMESTAMP
-                )
-            ''')
-            db.execute('''
-                CREATE TABLE IF NOT EXISTS chat_memories (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    uuid TEXT NOT NULL,
-                    event_tag TEXT NOT NULL,
-                    memory_content TEXT, -- 将存储序列化后的消息列表
-                    updated_at TIMESTAMP,
-                    UNIQUE(uuid, event_tag)
-                )
-            ''')
-            db.commit()
+        with self._lock:
+            self._connection()
+            self._tag_cache.clear()
 
     def add_or_update_profile(self, user_uuid: str, content: str):
         """
@@ -48,12 +162,11 @@ class DatabaseManager:
         添加或更新用户简介。
         """
         print(f"[*] (Sync) 正在为 UUID: {user_uuid} 添加/更新简介...")
-        with sqlite3.connect(self.db_path) as db:
+        with self._lock, self._connection() as db:
             db.execute('''
                 INSERT OR REPLACE INTO character_profiles (uuid, profile_content, updated_at)
                 VALUES (?, ?, ?)
             ''', (user_uuid, content, datetime.now()))
-            db.commit()
         print(f"[+] (Sync) 简介操作完成。")
 
     def get_profile(self, user_uuid: str) -> str | None:
@@ -61,89 +174,138 @@ class DatabaseManager:
         ### CHANGE: Converted to sync.
         根据uuid查询人物简介。
         """
-        with sqlite3.connect(self.db_path) as db:
-            cursor = db.execute("SELECT profile_content FROM character_profiles WHERE uuid = ?",
-                                  (user_uuid,))
-            result = cursor.fetchone()
+        with self._lock:
+            result = self._connection().execute(
+                "SELECT profile_content FROM character_profiles WHERE uuid = ?", (user_uuid,)
+            ).fetchone()
         return result[0] if result else None
 
+    def _tag_ids(self, db, user_uuid, tags, created_at) -> dict:
+        """批量获取标签ID，不存在的标签一并创建。返回 {标签: ID}。"""
+        db.executemany(
+            "INSERT OR IGNORE INTO memory_tags (uuid, tag, created_at) VALUES (?, ?, ?)",
+            [(user_uuid, tag, created_at) for tag in tags]
+        )
+        placeholders = ','.join('?' * len(tags))
+        rows = db.execute(
+            f"SELECT tag, id FROM memory_tags WHERE uuid = ? AND tag IN ({placeholders})",
+            (user_uuid, *tags)
+        ).fetchall()
+        return dict(rows)
+
+    def add_tags(self, user_uuid: str, tags: list[str]):
+        """只登记标签（不关联消息），已存在的标签忽略。用于从向量库回填已有标签。"""
+        tags = list(dict.fromkeys(tag for tag in tags if tag))
+        if not tags:
+            return
+        with self._lock, self._connection() as db:
+            self._tag_ids(db, user_uuid, tags, datetime.now())
+            self._tag_cache.pop(user_uuid, None)
+
     def add_memory(self, user_uuid: str, event_tags: list[str], new_messages: list[BaseMessage]):
         """
         ### CHANGE: Converted to sync.
-        【核心功能修改】存储或叠加 LangChain 消息对象列表到多个标签。
+        【核心功能修改】把 LangChain 消息追加到多个标签下。
+        消息只写入一次，标签通过关联表引用消息；所有标签在同一个事务中写入。
         """
         if not event_tags or not new_messages:
             print("[!] 警告：传入的标签或消息为空，操作已跳过。")
             return
 
-        print(f"[*] (Sync) 正在为 UUID: {user_uuid} 的事件标签 {event_tags} 添加/叠加 {len(new_messages)} 条消息...")
-
-        with sqlite3.connect(self.db_path) as db:
-            for tag in event_tags:
-                cursor = db.execute(
-                        "SELECT memory_content FROM chat_memories WHERE uuid = ? AND event_tag = ?",
-                        (user_uuid, tag)
-                )
-                result = cursor.fetchone()
-
-                if result and result[0]:
-                    print(f"    - 标签 '{tag}': 发现已有记忆，进行叠加...")
-                    existing_messages = loads(result[0])
-                    combined_messages = existing_messages + new_messages
-                    updated_serialized_memory = dumps(combined_messages)
-                    db.execute('''
-                        UPDATE chat_memories
-                        SET memory_content = ?, updated_at = ?
-                        WHERE uuid = ? AND event_tag = ?
-                    ''', (updated_serialized_memory, datetime.now(), user_uuid, tag))
-                else:
-                    print(f"    - 标签 '{tag}': 未发现记忆，创建新条目...")
-                    serialized_new_messages = dumps(new_messages)
-                    db.execute('''
-                        INSERT INTO chat_memories (uuid, event_tag, memory_content, updated_at)
-                        VALUES (?, ?, ?, ?)
-                    ''', (user_uuid, tag, serialized_new_messages, datetime.now()))
-
-            db.commit()
+        print(f"[*] (Sync) 正在为 UUID: {user_uuid} 的 {len(event_tags)} 个事件标签追加 {len(new_messages)} 条消息...")
+
+        now = datetime.now()
+        tags = list(dict.fromkeys(event_tags))
+        with self._lock, self._connection() as db:
+            message_ids = [_insert_message(db, user_uuid, dumps(message), now) for message in new_messages]
+            tag_ids = self._tag_ids(db, user_uuid, tags, now)
+            db.executemany(
+                "INSERT OR IGNORE INTO memory_tag_messages (tag_id, message_id) VALUES (?, ?)",
+                [(tag_id, message_id) for tag_id in tag_ids.values() for message_id in message_ids]
+            )
+            self._tag_cache.pop(user_uuid, None)
         print(f"[+] (Sync) 记忆操作完成。")
 
-    def get_memory(self, user_uuid: str, event_tag: str) -> list[BaseMessage] | None:
+    def get_memory_page(self, user_uuid: str, event_tag: str, limit: int = 50,
+                        before_id: int | None = None) -> tuple[list[BaseMessage], int | None]:
         """
-        ### CHANGE: Converted to sync.
-        【核心功能修改】根据uuid和事件标签查询聊天记忆。
+        按消息ID向前分页读取某个标签下的记忆（每页按时间正序返回）。
+        :param before_id: 只取ID小于该值的消息；为空时从最新的消息开始。
+        :return: (消息列表, 下一页的 before_id；没有更早的消息时为 None)
         """
-        with sqlite3.connect(self.db_path) as db:
-            cursor = db.execute(
-                    "SELECT memory_content FROM chat_memories WHERE uuid = ? AND event_tag = ?",
-                    (user_uuid, event_tag)
-            )
-            result = cursor.fetchone()
+        with self._lock:
+            rows = self._connection().execute('''
+                SELECT m.id, m.content
+                FROM memory_tags t
+                JOIN memory_tag_messages tm ON tm.tag_id = t.id
+                JOIN memory_messages m ON m.id = tm.message_id
+                WHERE t.uuid = ? AND t.tag = ? AND tm.message_id < ?
+                ORDER BY tm.message_id DESC
+                LIMIT ?
+            ''', (user_uuid, event_tag, before_id if before_id is not None else _MAX_ID, limit + 1)).fetchall()
+        next_before = rows[limit - 1][0] if len(rows) > limit else None
+        rows = rows[:limit]
+        rows.reverse()
+        return [loads(content) for _, content in rows], next_before
+
+    def iter_memory(self, user_uuid: str, event_tag: str, page_size: int = 200):
+        """
+        按时间倒序逐页读取某个标签下的全部记忆，每次产出一页（页内按时间正序）。
+        适合记忆很长、不需要一次性载入内存的场景。
+        """
+        before_id = None
+        while True:
+            messages, before_id = self.get_memory_page(user_uuid, event_tag, page_size, before_id)
+            if messages:
+                yield messages
+            if before_id is None:
+                return
 
-        if result and result[0]:
-            return loads(result[0])
+    def get_memory(self, user_uuid: str, event_tag: str, limit: int | None = None) -> list[BaseMessage] | None:
+        """
+        ### CHANGE: Converted to sync.
+        【核心功能修改】根据uuid和事件标签查询聊天记忆（按时间正序）。
+        :param limit: 只返回最近的 limit 条；为空时返回全部。需要分页时使用 get_memory_page / iter_memory。
+        """
+        if limit is not None:
+            messages, _ = self.get_memory_page(user_uuid, event_tag, limit)
+            return messages or None
+        with self._lock:
+            rows = self._connection().execute('''
+                SELECT m.content
+                FROM memory_tags t
+                JOIN memory_tag_messages tm ON tm.tag_id = t.id
+                JOIN memory_messages m ON m.id = tm.message_id
+                WHERE t.uuid = ? AND t.tag = ?
+                ORDER BY tm.message_id
+            ''', (user_uuid, event_tag)).fetchall()
+        if rows:
+            return [loads(content) for content, in rows]
         return None
 
     def get_all_tags(self, user_uuid: str) -> list[str]:
         """
         ### CHANGE: Converted to sync.
-        根据uuid查询该用户拥有的所有事件标签。
+        根据uuid查询该用户拥有的所有事件标签。结果缓存在内存中，该用户有写入时失效。
         """
-        print(f"[*] (Sync) 正在查询 UUID: {user_uuid} 的所有标签...")
-        with sqlite3.connect(self.db_path) as db:
-            cursor = db.execute(
-                    "SELECT DISTINCT event_tag FROM chat_memories WHERE uuid = ?",
-                    (user_uuid,)
-            )
-            results = cursor.fetchall()
-
-        tags = [row[0] for row in results]
-        print(f"[+] (Sync) 查询到标签: {tags}")
-        return tags
-
+        with self._lock:
+            tags = self._tag_cache.get(user_uuid)
+            if tags is None:
+                rows = self._connection().execute(
+                    "SELECT tag FROM memory_tags WHERE uuid = ? ORDER BY id", (user_uuid,)
+                ).fetchall()
+                tags = [row[0] for row in rows]
+                self._tag_cache[user_uuid] = tags
+                print(f"[+] (Sync) UUID: {user_uuid} 共有 {len(tags)} 个标签")
+            return list(tags)
 
     def close(self):
-        """(Sync) 关闭数据库连接。在使用 'with' 模式下，此方法不是必需的。"""
-        print("[*] (Sync) 数据库操作模式不需要手动关闭连接。")
-        pass
+        """(Sync) 关闭复用的数据库连接，之后再次使用时会重新打开。"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
 
 
+# 进程内共享的记忆数据库
+memory_db = DatabaseManager()
@@ -0,0 +1,116 @@
+# image_generation.py
+"""
+图片生成的并发与限流控制。
+
+所有图片生成调用（聊天配图、朋友圈配图）共用同一个并发上限和令牌桶限速器，
+以保证整个进程的请求速率不超过服务商配额。朋友圈的三张图并发生成，
+结果仍按输入顺序一一对应 dynamic_condition_1..3。
+
+配置（环境变量）：
+    IMAGE_MAX_CONCURRENCY   同时进行的图片生成请求数上限，默认 3
+    IMAGE_RATE_PER_MINUTE   每分钟最多发起的图片生成请求数，默认 10
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from google.genai import types
+
+from image_store import image_store
+from model_registry import get_genai_client
+
+IMAGE_MODEL = "gemini-2.0-flash-preview-image-generation"
+IMAGE_MAX_CONCURRENCY = int(os.environ.get('IMAGE_MAX_CONCURRENCY', 3))
+IMAGE_RATE_PER_MINUTE = float(os.environ.get('IMAGE_RATE_PER_MINUTE', 10))
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶限速器。
+    :param rate: 每秒补充的令牌数。
+    :param capacity: 桶容量，即允许的最大突发请求数。
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """取走一个令牌，令牌不足时阻塞等待。"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class ImageGenerator:
+    """
+    带并发上限和限速的图片生成器。
+    :param backend: 可调用对象 backend(prompt) -> (文本说明, 图片字节)，默认调用 Gemini 图片生成模型。
+    """
+
+    def __init__(self, backend=None, max_concurrency=IMAGE_MAX_CONCURRENCY, rate_per_minute=IMAGE_RATE_PER_MINUTE):
+        self.backend = backend or genai_backend
+        self.max_concurrency = max_concurrency
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._bucket = TokenBucket(rate_per_minute / 60.0, max(1, max_concurrency))
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='image_generation')
+
+    def generate(self, prompt):
+        """生成一张图片，返回 (文本说明, 图片字节)。受并发上限与限速器约束。"""
+        with self._semaphore:
+            self._bucket.acquire()
+            return self.backend(prompt)
+
+    def _generate_and_save(self, prompt, save):
+        if not prompt:
+            return ''
+        try:
+            text, data = self.generate(prompt)
+            if text:
+                print(text)
+            return save(data) if data else ''
+        except Exception as e:
+            print(f"图片生成失败: {e}")
+            return ''
+
+    def generate_many(self, prompts, save=None):
+        """
+        并发生成多张图片并保存。
+        返回与 prompts 一一对应的路径列表；提示词为空或生成失败的位置为空字符串。
+        :param save: save(图片字节) -> 路径，会被多个线程同时调用，必须为每张图片返回不同的路径；
+                     默认使用按内容哈希命名的 image_store.save。
+        """
+        save = save or image_store.save
+        futures = [self._executor.submit(self._generate_and_save, prompt, save) for prompt in prompts]
+        return [future.result() for future in futures]
+
+
+def genai_backend(prompt):
+    """调用 Gemini 图片生成模型，返回 (文本说明, 图片字节)。"""
+    response = get_genai_client().models.generate_content(
+        model=IMAGE_MODEL,
+        contents=prompt,
+        config=types.GenerateContentConfig(response_modalities=['TEXT', 'IMAGE'])
+    )
+    text, data = None, None
+    for part in response.candidates[0].content.parts:
+        if part.text is not None:
+            text = part.text
+        elif part.inline_data is not None and data is None:
+            data = part.inline_data.data
+    return text, data
+
+
+# 进程内共享的图片生成器
+image_generator = ImageGenerator()
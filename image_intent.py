@@ -0,0 +1,141 @@
+# image_intent.py
+"""
+聊天配图的本地预筛选。
+
+每条AI回复生成后都要判断“是否在分享一个视觉瞬间”。绝大多数回复显然不是，
+因此先用关键词/正则打分：分数低于阈值的回复直接判定为不配图，不再调用意图判断模型；
+只有可能需要配图的回复才交给模型做最终判断。
+
+阈值与命中率等统计通过 metrics() 暴露，用于调整阈值、观察节省了多少次模型调用。
+可选的抽检（IMAGE_INTENT_AUDIT_RATE）会把一小部分被预筛掉的回复仍交给模型，用来估计漏判率。
+
+配置（环境变量）：
+    IMAGE_INTENT_THRESHOLD    预筛阈值（0~1），默认 0.25
+    IMAGE_INTENT_AUDIT_RATE   被预筛掉的回复中抽检的比例，默认 0
+"""
+import os
+import random
+import re
+import threading
+from dataclasses import dataclass
+
+IMAGE_INTENT_THRESHOLD = float(os.environ.get('IMAGE_INTENT_THRESHOLD', 0.25))
+IMAGE_INTENT_AUDIT_RATE = float(os.environ.get('IMAGE_INTENT_AUDIT_RATE', 0))
+
+# 主动展示/分享的信号（权重越高越像“给你看看”）
+_SHARE_PATTERNS = [
+    (re.compile(r'(快|你)?看(看|一下|这|我|呀|啊)|给你看|瞧瞧|你瞧'), 0.35),
+    (re.compile(r'拍(了|下|到)|照片|自拍|合照|截图|发给你|晒'), 0.35),
+    (re.compile(r'新买|刚买|买了|入手|到货|收到了'), 0.25),
+    (re.compile(r'(做|烤|画|拼|织|种)(了|好|的|出来)|作品|成品|亲手'), 0.25),
+]
+# 画面感较强的具体事物与景象
+_VISUAL_PATTERNS = [
+    (re.compile(r'晚霞|夕阳|日落|日出|朝霞|彩虹|星空|月光|月亮|银河|烟花|雪景|下雪|樱花|花海|海边|大海|湖面|山顶|云海|夜景|灯光'), 0.25),
+    (re.compile(r'蛋糕|甜品|咖啡|奶茶|料理|便当|火锅|早餐|晚餐|美食|饭菜'), 0.15),
+    (re.compile(r'猫|狗|小猫|小狗|宠物'), 0.15),
+    (re.compile(r'裙子|衣服|发型|妆|键盘|手办|礼物|花束'), 0.15),
+    (re.compile(r'(好|真|太|特别|很)美|美得|好看|漂亮|绝了|超棒|颜色|色彩|闪闪|波光粼粼'), 0.2),
+]
+# 明显不适合配图的情境
+_NEGATIVE_PATTERNS = [
+    (re.compile(r'生病|发烧|难受|头疼|吵架|哭了|伤心|难过|疼'), 0.3),
+]
+# 动作/神态描写，不算作分享内容
+_ACTION = re.compile(r'[（(][^）)]*[）)]')
+
+
+@dataclass(frozen=True)
+class IntentDecision:
+    """预筛结果。forward 为 True 时需要交给模型判断；audit 表示这是一次抽检。"""
+    score: float
+    forward: bool
+    audit: bool = False
+
+
+def score_reply(text: str) -> float:
+    """给一条回复打分（0~1），越高越可能是在分享一个视觉瞬间。"""
+    if not text:
+        return 0.0
+    spoken = _ACTION.sub('', text).strip()
+    if len(spoken) < 6:
+        return 0.0
+    score = 0.0
+    for patterns in (_SHARE_PATTERNS, _VISUAL_PATTERNS):
+        for pattern, weight in patterns:
+            if pattern.search(spoken):
+                score += weight
+    for pattern, weight in _NEGATIVE_PATTERNS:
+        if pattern.search(spoken):
+            score -= weight
+    # 纯提问很少伴随分享图片
+    if spoken.endswith(('?', '？')) and score < 0.5:
+        score -= 0.1
+    return max(0.0, min(1.0, score))
+
+
+class ImageIntentFilter:
+    """
+    配图意图的本地预筛选器，并统计每个阶段的决策数量。
+    :param threshold: 分数低于该值的回复直接判定为不配图。
+    :param audit_rate: 被预筛掉的回复中仍交给模型判断的比例，用于估计漏判。
+    """
+
+    def __init__(self, threshold=IMAGE_INTENT_THRESHOLD, audit_rate=IMAGE_INTENT_AUDIT_RATE):
+        self.threshold = threshold
+        self.audit_rate = audit_rate
+        self._lock = threading.Lock()
+        self._counters = {
+            'total': 0,            # 预筛过的回复数
+            'skipped': 0,          # 预筛直接判定为不配图（节省的模型调用）
+            'forwarded': 0,        # 交给模型判断
+            'llm_image': 0,        # 模型判定需要配图
+            'llm_no_image': 0,     # 模型判定不需要配图（预筛误放行）
+            'audited': 0,          # 抽检次数
+            'audit_missed': 0,     # 抽检中模型判定需要配图（预筛漏判）
+        }
+
+    def check(self, text: str) -> IntentDecision:
+        """对一条回复做预筛，返回是否需要交给模型判断。"""
+        score = score_reply(text)
+        forward = score >= self.threshold
+        audit = not forward and self.audit_rate > 0 and random.random() < self.audit_rate
+        with self._lock:
+            self._counters['total'] += 1
+            if forward:
+                self._counters['forwarded'] += 1
+            elif audit:
+                self._counters['audited'] += 1
+            else:
+                self._counters['skipped'] += 1
+        return IntentDecision(score=score, forward=forward or audit, audit=audit)
+
+    def record_llm(self, decision: IntentDecision, wants_image: bool):
+        """记录模型对一条被放行（或抽检）回复的判断结果。"""
+        with self._lock:
+            if decision.audit:
+                if wants_image:
+                    self._counters['audit_missed'] += 1
+            elif wants_image:
+                self._counters['llm_image'] += 1
+            else:
+                self._counters['llm_no_image'] += 1
+
+    def metrics(self) -> dict:
+        """返回阈值与各项统计，以及预筛命中率、放行精确率、抽检漏判率。"""
+        with self._lock:
+            counters = dict(self._counters)
+        judged = counters['llm_image'] + counters['llm_no_image']
+        return {
+            'threshold': self.threshold,
+            'audit_rate': self.audit_rate,
+            **counters,
+            # 预筛命中率：不需要调用模型的回复占比
+            'hit_rate': counters['skipped'] / counters['total'] if counters['total'] else 0.0,
+            'forward_precision': counters['llm_image'] / judged if judged else None,
+            'audit_miss_rate': counters['audit_missed'] / counters['audited'] if counters['audited'] else None,
+        }
+
+
+# 进程内共享的预筛选器
+image_intent_filter = ImageIntentFilter()
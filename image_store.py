@@ -0,0 +1,121 @@
+# image_store.py
+"""
+按内容寻址的图片存储。
+
+模型返回的图片字节按 sha256 命名，保存为 talk_picture/<哈希前两位>/<哈希>.<扩展名>：
+- 同一秒内生成的多张图片不会互相覆盖，相同内容只保存一次；
+- 返回的相对路径（key）是稳定的，可以直接写入 chat_history.image_url 与 social_posts.image_url；
+- 先写临时文件再原子替换，读者不会看到写了一半的文件。
+
+转码在调用线程中直接完成：调用方（聊天配图、朋友圈任务）本身就运行在后台线程里，
+再转交给一个线程池只会多一次线程切换；异步代码使用 asave，在线程中保存，不阻塞事件循环。
+
+可选把 PNG 转码为 WebP 或 AVIF（AVIF 需要额外安装 pillow-avif-plugin，不可用时退回 WebP）。
+
+配置（环境变量）：
+    IMAGE_FORMAT          保存格式：png / webp / avif，默认 webp
+    IMAGE_QUALITY         有损格式的编码质量（1~100），默认 85
+"""
+import asyncio
+import hashlib
+import os
+import tempfile
+from io import BytesIO
+
+IMAGE_STORE_DIR = 'talk_picture'
+IMAGE_FORMAT = os.environ.get('IMAGE_FORMAT', 'webp').lower()
+IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', 85))
+
+# 保存格式 -> (Pillow 格式名, 扩展名)
+_FORMATS = {
+    'png': ('PNG', 'png'),
+    'webp': ('WEBP', 'webp'),
+    'avif': ('AVIF', 'avif'),
+}
+# 图片地址中允许出现的扩展名（包含旧的按时间命名的 PNG）
+IMAGE_EXTENSIONS = tuple(ext for _, ext in _FORMATS.values())
+
+
+def _resolve_format(name):
+    """检查 Pillow 是否支持该格式，不支持时依次退回 webp、png。"""
+    from PIL import features
+    if name == 'avif':
+        try:
+            import pillow_avif  # noqa: F401  注册 AVIF 编码器
+            return name
+        except ImportError:
+            print("[!] 未安装 pillow-avif-plugin，图片改为保存为 WebP")
+            name = 'webp'
+    if name == 'webp' and not features.check('webp'):
+        print("[!] Pillow 不支持 WebP，图片改为保存为 PNG")
+        name = 'png'
+    if name not in _FORMATS:
+        print(f"[!] 未知的图片格式 {name}，改为保存为 PNG")
+        name = 'png'
+    return name
+
+
+class ImageStore:
+    """
+    内容寻址的图片存储。
+    :param base_dir: 图片根目录（相对于工作目录），同时是返回路径的前缀。
+    :param image_format: 保存格式：png / webp / avif。
+    :param quality: 有损格式的编码质量。
+    """
+
+    def __init__(self, base_dir=IMAGE_STORE_DIR, image_format=IMAGE_FORMAT, quality=IMAGE_QUALITY):
+        self.base_dir = base_dir
+        self.image_format = _resolve_format(image_format)
+        self.quality = quality
+
+    def key_for(self, data: bytes) -> str:
+        """根据图片内容计算存储路径（使用正斜杠，可直接写入数据库）。"""
+        digest = hashlib.sha256(data).hexdigest()
+        _, ext = _FORMATS[self.image_format]
+        return f"{self.base_dir}/{digest[:2]}/{digest}.{ext}"
+
+    def _encode(self, data: bytes) -> bytes:
+        from PIL import Image
+        pil_format, _ = _FORMATS[self.image_format]
+        image = Image.open(BytesIO(data))
+        # 原始数据已经是目标格式的 PNG 时无需重新编码
+        if pil_format == 'PNG' and image.format == 'PNG':
+            return data
+        if pil_format != 'PNG' and image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+        buffer = BytesIO()
+        if pil_format == 'PNG':
+            image.save(buffer, format=pil_format, optimize=True)
+        else:
+            image.save(buffer, format=pil_format, quality=self.quality)
+        return buffer.getvalue()
+
+    def save(self, data: bytes) -> str:
+        """在当前线程中转码并保存图片，返回存储路径。"""
+        key = self.key_for(data)
+        path = os.path.normpath(key)
+        if os.path.exists(path):
+            # 相同内容已经保存过
+            return key
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        encoded = self._encode(data)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(encoded)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        print(f"图片已保存: {key} ({len(data)} -> {len(encoded)} 字节)")
+        return key
+
+    async def asave(self, data: bytes) -> str:
+        """save 的异步版本，在线程中保存，不阻塞事件循环。"""
+        return await asyncio.to_thread(self.save, data)
+
+
+# 进程内共享的图片存储
+image_store = ImageStore()
@@ -0,0 +1,267 @@
+# job_queue.py
+"""
+基于 SQLite 的持久化后台任务队列。
+
+聊天请求只负责入队（朋友圈、日记等耗时的图运行），由常驻的工作线程池取出执行。
+任务写在磁盘上，客户端断开或进程重启都不会丢失；失败的任务按指数退避重试，
+同一 dedup_key（例如某个角色的朋友圈生成）在排队/执行期间只会存在一个任务。
+"""
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from langchain_core.load import dumps, loads
+
+# 数据库文件名
+JOB_DB_FILE = "job_queue.db"
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+
+class JobQueue:
+    """
+    SQLite 任务队列 + 工作线程池。
+    处理函数通过 register(kind, handler) 注册，handler 接收入队时的 payload，返回值会以 JSON 形式保存为任务结果。
+    """
+
+    def __init__(self, db_file=JOB_DB_FILE, workers=2, max_attempts=3, poll_interval=1.0, retry_delay=5.0):
+        self.db_file = db_file
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self._handlers = {}
+        self._threads = []
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        conn = self._connect()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def initialize(self):
+        """创建任务表。需在入队或启动工作线程前调用一次。"""
+        with self._connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    thread_id TEXT NOT NULL, -- e.g., "char_1_text"
+                    dedup_key TEXT NOT NULL,
+                    payload TEXT NOT NULL, -- langchain dumps 序列化后的参数
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL,
+                    result TEXT,
+                    last_error TEXT,
+                    available_at REAL NOT NULL,
+                    created_at TIMESTAMP,
+                    updated_at TIMESTAMP
+                )
+            ''')
+            # 同一 dedup_key 同时只允许一个排队中/执行中的任务
+            conn.execute('''
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_active_dedup
+                ON jobs (dedup_key) WHERE status IN ('queued', 'running')
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, available_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_thread ON jobs (thread_id, id)")
+
+    def register(self, kind, handler):
+        """注册某类任务的处理函数。"""
+        self._handlers[kind] = handler
+
+    def enqueue(self, kind, thread_id, payload, dedup_key=None):
+        """
+        入队一个任务并返回任务ID。
+        若相同 dedup_key（默认为 "kind:thread_id"）的任务已在排队或执行，则直接返回已有任务的ID。
+        """
+        dedup_key = dedup_key or f"{kind}:{thread_id}"
+        with self._connection() as conn:
+            while True:
+                now = datetime.now()
+                try:
+                    cursor = conn.execute('''
+                        INSERT INTO jobs (kind, thread_id, dedup_key, payload, status, max_attempts,
+                                          available_at, created_at, updated_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', (kind, thread_id, dedup_key, dumps(payload), STATUS_QUEUED, self.max_attempts,
+                          time.time(), now, now))
+                    job_id = cursor.lastrowid
+                    break
+                except sqlite3.IntegrityError:
+                    row = conn.execute(
+                        "SELECT id FROM jobs WHERE dedup_key = ? AND status IN (?, ?)",
+                        (dedup_key, STATUS_QUEUED, STATUS_RUNNING)
+                    ).fetchone()
+                    if row:
+                        print(f"[*] 任务 {dedup_key} 已在队列中，跳过重复入队。")
+                        return row['id']
+                    # 冲突的任务在插入失败与查询之间已经结束，重新插入
+        self._wakeup.set()
+        return job_id
+
+    def get_job(self, job_id):
+        """查询任务状态，不存在时返回 None。"""
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT id, kind, thread_id, status, attempts, max_attempts, result, last_error, created_at, updated_at "
+                "FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        if not row:
+            return None
+        job = dict(row)
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def get_jobs_for_thread(self, thread_id, limit=20):
+        """获取某个线程（如 char_1_text）最近的任务。"""
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT id, kind, thread_id, status, attempts, max_attempts, last_error, created_at, updated_at "
+                "FROM jobs WHERE thread_id = ? ORDER BY id DESC LIMIT ?",
+                (thread_id, limit)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def start(self):
+        """启动工作线程。上次进程退出时仍处于执行中的任务会重新排队。"""
+        if self._threads:
+            return
+        with self._connection() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE status = ?",
+                (STATUS_QUEUED, datetime.now(), STATUS_RUNNING)
+            )
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"job_worker_{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """通知工作线程在当前任务完成后退出。"""
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _claim(self, conn):
+        """
+        原子地领取一个到期的排队任务。
+        同一 thread_id 已有任务在执行时跳过该线程的任务：同一检查点线程上的图运行必须串行，
+        否则并行的运行会从同一个父检查点分叉，后写入的状态覆盖先写入的。
+        """
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? AND available_at <= ? "
+                "AND thread_id NOT IN (SELECT thread_id FROM jobs WHERE status = ?) ORDER BY id LIMIT 1",
+                (STATUS_QUEUED, time.time(), STATUS_RUNNING)
+            ).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                    (STATUS_RUNNING, datetime.now(), row['id'])
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return row
+
+    def _worker(self):
+        conn = self._connect()
+        failures = 0
+        try:
+            while not self._stop.is_set():
+                try:
+                    row = self._claim(conn)
+                    failures = 0
+                except Exception as e:
+                    # 例如等待写锁超时（database is locked）：退避后继续，不能让工作线程退出
+                    failures += 1
+                    delay = min(self.poll_interval * (2 ** failures), 60)
+                    print(f"[!] 工作线程领取任务失败，{delay:.0f} 秒后重试: {e}")
+                    self._stop.wait(delay)
+                    continue
+                if row is None:
+                    self._wakeup.wait(self.poll_interval)
+                    self._wakeup.clear()
+                    continue
+                self._run(conn, row)
+        finally:
+            conn.close()
+
+    def _update(self, conn, sql, params):
+        """
+        更新任务状态，失败时退避重试直到成功。
+        任务已经执行完，如果状态写不进去，这一行会一直停留在执行中，直到下次重启才重新排队。
+        """
+        delay = self.poll_interval
+        while True:
+            try:
+                conn.execute(sql, params)
+                return
+            except Exception as e:
+                if self._stop.is_set():
+                    raise
+                print(f"[!] 更新任务状态失败，{delay:.0f} 秒后重试: {e}")
+                self._stop.wait(delay)
+                delay = min(delay * 2, 60)
+
+    def _run(self, conn, row):
+        job_id, kind = row['id'], row['kind']
+        attempts = row['attempts'] + 1
+        try:
+            handler = self._handlers[kind]
+            result = handler(loads(row['payload']))
+            result = json.dumps(result, ensure_ascii=False) if result is not None else None
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            if attempts < row['max_attempts']:
+                # 指数退避后重新排队
+                delay = self.retry_delay * (2 ** (attempts - 1))
+                self._update(
+                    conn,
+                    "UPDATE jobs SET status = ?, last_error = ?, available_at = ?, updated_at = ? WHERE id = ?",
+                    (STATUS_QUEUED, str(e), time.time() + delay, datetime.now(), job_id)
+                )
+                print(f"[!] 任务 {job_id} ({kind}) 第 {attempts} 次执行失败，{delay:.0f} 秒后重试: {e}")
+            else:
+                self._update(
+                    conn,
+                    "UPDATE jobs SET status = ?, last_error = ?, updated_at = ? WHERE id = ?",
+                    (STATUS_FAILED, str(e), datetime.now(), job_id)
+                )
+                print(f"[!] 任务 {job_id} ({kind}) 已达到最大重试次数，标记为失败: {e}")
+            return
+        self._update(
+            conn,
+            "UPDATE jobs SET status = ?, result = ?, last_error = NULL, updated_at = ? WHERE id = ?",
+            (STATUS_DONE, result, datetime.now(), job_id)
+        )
+        print(f"[+] 任务 {job_id} ({kind}) 执行完成。")
+
+
+# 进程内共享的任务队列
+job_queue = JobQueue()
@@ -1,42 +1,96 @@
+import threading
 
-from base import llm_google,llm_qwen, llm_kimi, llm
 from langgraph.constants import START, END
 
 from langgraph.checkpoint.memory import MemorySaver
 from langgraph.runtime import Runtime
 from langgraph.graph import StateGraph
 from typing import Literal
-from generate_content import  generate_talk,generate_diary,generate_dynamic_condition,generate_dynamic_condition_picture,generate_talk_picture
-from memory import get_simility_long_memory,manage_memory
+from generate_content import  generate_talk,generate_diary,generate_dynamic_condition,generate_dynamic_condition_picture
+from generate_content import  agenerate_talk,agenerate_diary,agenerate_dynamic_condition,agenerate_dynamic_condition_picture
+from memory import get_simility_long_memory,manage_memory,aget_simility_long_memory,amanage_memory
 from state import MemoryState,Context
+from checkpointer import PruningSqliteSaver
 def start_talk(state:MemoryState)->dict:
     talk_number=state.get('talk_number',0)
     talk_number=talk_number+1
     print('欢迎开始聊天')
     return {'talk_number':talk_number}
 
-def jude_path(runtime:Runtime[Context])->Literal['optimize_memory','generate_diary','generate_dynamic_condition']:
+def jude_path(state:MemoryState,runtime:Runtime[Context])->Literal['optimize_memory','generate_diary','generate_dynamic_condition']:
     return runtime.context.page
 
-def create_main_agent():
+def create_main_agent(asynchronous:bool=False,checkpointer=None):
+        """
+        构建并编译主工作流。每次调用都会重新构建图，请求处理中应使用 get_agent_and_checkpointer。
+        :param asynchronous: 为 True 时各节点使用异步实现，编译出的 agent 需通过 astream/ainvoke 驱动。
+        :param checkpointer: 检查点存储，不传时新建一个 MemorySaver。
+        """
+        if asynchronous:
+            nodes = {
+                'generate_diary': agenerate_diary,
+                'generate_dynamic_condition': agenerate_dynamic_condition,
+                'generate_dynamic_condition_picture': agenerate_dynamic_condition_picture,
+                'generate_talk': agenerate_talk,
+                'get_long_memory': aget_simility_long_memory,
+                'optimize_memory': amanage_memory,
+            }
+        else:
+            nodes = {
+                'generate_diary': generate_diary,
+                'generate_dynamic_condition': generate_dynamic_condition,
+                'generate_dynamic_condition_picture': generate_dynamic_condition_picture,
+                'generate_talk': generate_talk,
+                'get_long_memory': get_simility_long_memory,
+                'optimize_memory': manage_memory,
+            }
         workflow = StateGraph(MemoryState)
         workflow.add_node(start_talk.__name__, start_talk)
-        workflow.add_node(generate_diary.__name__, generate_diary)
-        workflow.add_node(generate_dynamic_condition.__name__, generate_dynamic_condition)
-        workflow.add_node(generate_dynamic_condition_picture.__name__, generate_dynamic_condition_picture)
-        workflow.add_node(generate_talk.__name__, generate_talk)
-        workflow.add_node(generate_talk_picture.__name__, generate_talk_picture)
-        workflow.add_node('get_long_memory',get_simility_long_memory)
-        workflow.add_node('optimize_memory',manage_memory)
+        for name, node in nodes.items():
+            workflow.add_node(name, node)
         workflow.add_edge(START, start_talk.__name__)
         workflow.add_conditional_edges(start_talk.__name__, jude_path)
         workflow.add_edge('optimize_memory', 'get_long_memory')
-        workflow.add_edge('get_long_memory', generate_talk.__name__)
-        workflow.add_edge(generate_talk.__name__, generate_talk_picture.__name__)
-        workflow.add_edge(generate_talk_picture.__name__,END)
-        workflow.add_edge(generate_diary.__name__, END)
-        workflow.add_edge(generate_dynamic_condition.__name__, generate_dynamic_condition_picture.__name__)
-        workflow.add_edge(generate_dynamic_condition_picture.__name__, END)
-        checkpointer = MemorySaver()
+        workflow.add_edge('get_long_memory', 'generate_talk')
+        # 聊天配图不在图中执行，而是由 picture_jobs 在回复结束后作为后台任务运行
+        workflow.add_edge('generate_talk',END)
+        workflow.add_edge('generate_diary', END)
+        workflow.add_edge('generate_dynamic_condition', 'generate_dynamic_condition_picture')
+        workflow.add_edge('generate_dynamic_condition_picture', END)
+        if checkpointer is None:
+            checkpointer = MemorySaver()
         agent = workflow.compile(checkpointer=checkpointer)  # Pass checkpointer correctly
         return agent,checkpointer
+
+
+# 进程内只编译一次工作流；同步与异步两个版本共用同一个检查点存储，
+# 因此无论请求走 Flask 还是 ASGI 入口，同一 thread_id 的对话状态都能延续到下一轮，
+# 检查点写在磁盘上（见 checkpointer.py），进程重启后同样可以恢复。
+_agent_lock = threading.Lock()
+_checkpointer = None
+_agents = {}
+
+
+def get_checkpointer():
+    """获取进程内共享的检查点存储。"""
+    global _checkpointer
+    if _checkpointer is None:
+        with _agent_lock:
+            if _checkpointer is None:
+                _checkpointer = PruningSqliteSaver.from_file()
+    return _checkpointer
+
+
+def get_agent_and_checkpointer(asynchronous:bool=False):
+    """
+    获取编译好的主工作流（首次调用时编译并缓存）及其共享的检查点存储。
+    :param asynchronous: 为 True 时返回异步节点版本的 agent。
+    """
+    agent = _agents.get(asynchronous)
+    if agent is None:
+        checkpointer = get_checkpointer()
+        with _agent_lock:
+            if asynchronous not in _agents:
+                _agents[asynchronous], _ = create_main_agent(asynchronous, checkpointer=checkpointer)
+            agent = _agents[asynchronous]
+    return agent, get_checkpointer()
@@ -0,0 +1,82 @@
+# media_urls.py
+"""
+图片与头像的签名地址（能力链接）。
+
+聊天配图按内容哈希命名，文件一旦写入就不会再变。原先每次拉取历史都为每张图片
+生成一个 10 分钟有效的 JWT，地址每次都不同，浏览器无法缓存；访问时还要完整解码一次 JWT。
+
+这里改为 HMAC 签名：签名覆盖 “访问范围（用户/会话ID）+ 文件路径 + 过期时间”，
+过期时间按 MEDIA_URL_TTL 对齐到固定的时间窗口，同一窗口内为同一文件生成的地址完全相同，
+因此重复查看历史时浏览器可以直接使用缓存（配合 ETag 与 Cache-Control: immutable）。
+旧的按时间命名的配图与按上传时间命名的头像可能在同一秒内被覆盖，只带 ETag，每次使用前向服务器确认。
+校验只需要一次 HMAC 计算。
+
+配置（环境变量）：
+    MEDIA_URL_TTL   签名地址的时间窗口（秒），默认 7 天；地址的有效期在 1~2 个窗口之间
+"""
+import base64
+import hashlib
+import hmac
+import os
+import time
+from urllib.parse import quote
+
+MEDIA_URL_TTL = int(os.environ.get('MEDIA_URL_TTL', 7 * 24 * 3600))
+# 按内容哈希命名的文件内容不变，允许浏览器缓存一年
+MEDIA_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+# 其他文件名可能被覆盖，缓存后每次使用前都按 ETag 重新验证（未变化时返回 304）
+MEDIA_REVALIDATE_CACHE_CONTROL = 'private, no-cache'
+
+
+class MediaSigner:
+    """
+    生成与校验媒体文件的签名地址。
+    :param secret: HMAC 密钥（使用应用的 SECRET_KEY）。
+    :param ttl: 过期时间对齐的时间窗口（秒）。
+    """
+
+    def __init__(self, secret, ttl=MEDIA_URL_TTL):
+        self._secret = secret.encode('utf-8') if isinstance(secret, str) else secret
+        self.ttl = ttl
+
+    def expires_at(self, now=None) -> int:
+        """当前时间窗口对应的过期时间：对齐到窗口边界，保证至少还有一个完整窗口的有效期。"""
+        now = int(time.time() if now is None else now)
+        return (now // self.ttl + 2) * self.ttl
+
+    def signature(self, scope, filename, expires) -> str:
+        """计算签名（base64url，不含填充）。"""
+        message = f"{scope}\n{filename.replace(chr(92), '/')}\n{int(expires)}".encode('utf-8')
+        digest = hmac.new(self._secret, message, hashlib.sha256).digest()[:16]
+        return base64.urlsafe_b64encode(digest).rstrip(b'=').decode('ascii')
+
+    def url(self, prefix, filename, scope, now=None) -> str:
+        """
+        生成签名地址，例如 /picture/talk_picture/ab/<哈希>.webp?s=3&e=1700000000&sig=...
+        :param prefix: 路由前缀，如 '/picture' 或 '/uploads'。
+        :param scope: 访问范围，签名与之绑定。
+        """
+        filename = filename.replace('\\', '/')
+        expires = self.expires_at(now)
+        sig = self.signature(scope, filename, expires)
+        return f"{prefix}/{quote(filename)}?s={quote(str(scope))}&e={expires}&sig={sig}"
+
+    def verify(self, filename, scope, expires, sig, now=None) -> bool:
+        """校验签名与过期时间。"""
+        if scope is None or not expires or not sig:
+            return False
+        try:
+            expires = int(expires)
+        except ValueError:
+            return False
+        if expires < (time.time() if now is None else now):
+            return False
+        return hmac.compare_digest(self.signature(scope, filename, expires), sig)
+
+
+def content_etag(filename):
+    """按内容哈希命名的文件直接用文件名中的哈希作为 ETag，其余文件返回 True 交给 Werkzeug 计算。"""
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    if len(stem) == 64 and all(c in '0123456789abcdef' for c in stem):
+        return stem
+    return True
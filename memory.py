@@ -1,89 +1,243 @@
+import asyncio
+import json
+import os
+import threading
+from collections import OrderedDict
 from uuid import NAMESPACE_DNS, uuid5
 
-import chromadb
 from langchain_core.messages import RemoveMessage
 from langgraph.runtime import Runtime
 from llama_index.core import Document, VectorStoreIndex, Settings
-from llama_index.core.ingestion import pipeline, IngestionPipeline
-from llama_index.core.postprocessor import SentenceTransformerRerank
-from llama_index.core.storage.docstore import SimpleDocumentStore
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-from llama_index.vector_stores.chroma import ChromaVectorStore
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
 import typing
 import typing_extensions
-from langchain_core.prompts import ChatPromptTemplate, PromptTemplate
+from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import JsonOutputParser
 if not hasattr(typing, 'NotRequired'):
     typing.NotRequired = typing_extensions.NotRequired
 
-from base import llm as model
+from model_registry import get_llm, model_limit
+from get_memory import memory_db
+from embedding_cache import EmbeddingCache, embedding_cache
 from langgraph.graph import StateGraph, START, MessagesState
 from langgraph.checkpoint.memory import InMemorySaver
-from langmem.short_term import summarize_messages, RunningSummary
+from langmem.short_term import summarize_messages, asummarize_messages, RunningSummary
 from state import MemoryState,Context
 path = r"" #emmbeding模型
 rerank_model_name = r""  # 示例模型
 # 注意：对于中文，'BAAI/bge-reranker-base' 或 'BAAI/bge-reranker-large' 通常是更好的选择
 # rerank_model_name = "BAAI/bge-reranker-base" # 如果处理中文内容，可以尝试这个
-embeddings = HuggingFaceEmbedding(model_name=path)
-Settings.embed_model = embeddings
 persist_path = "../chroma_db"
-client = chromadb.PersistentClient(path=persist_path)
-def add_long_memory(text:str,user_id:str):
-    collection = client.get_or_create_collection(name=f"memory_{user_id}_collection")
+# 检索召回条数、重排序后写入 long_memory 的条数，以及缓存检索器的用户数上限
+MEMORY_RETRIEVE_TOP_K = int(os.environ.get('MEMORY_RETRIEVE_TOP_K', 10))
+MEMORY_RERANK_TOP_N = int(os.environ.get('MEMORY_RERANK_TOP_N', 3))
+RETRIEVER_CACHE_SIZE = int(os.environ.get('RETRIEVER_CACHE_SIZE', 128))
+
+# 嵌入模型、Chroma 客户端和重排序模型都在第一次使用时才加载（导入本模块不加载任何模型），
+# 需要时可调用 warm_up() 提前加载，避免第一位用户承担加载耗时。
+# torch / sentence-transformers / chromadb 的导入本身也很慢，因此同样放到首次使用时。
+_lock = threading.Lock()
+_embed_model = None
+_chroma_client = None
+_reranker = None
+# user_id -> (collection, retriever)，按最近使用淘汰
+_retrievers = OrderedDict()
+_retrievers_lock = threading.Lock()
+
+
+class CachedEmbedding(BaseEmbedding):
+    """
+    带持久化缓存的嵌入模型包装，可直接作为 llama_index 的 embed_model 使用。
+    :param inner: 实际计算向量的嵌入模型（如 HuggingFaceEmbedding）。
+    :param cache: 使用的 EmbeddingCache。
+    :param model_id: 缓存键中的模型ID，默认取 inner.model_name；更换模型后缓存自然失效。
+    """
+    _inner: BaseEmbedding = PrivateAttr()
+    _cache: EmbeddingCache = PrivateAttr()
+
+    def __init__(self, inner: BaseEmbedding, cache: EmbeddingCache, model_id: str | None = None, **kwargs):
+        super().__init__(model_name=model_id or inner.model_name, embed_batch_size=inner.embed_batch_size, **kwargs)
+        self._inner = inner
+        self._cache = cache
+
+    def _cached(self, kind, texts, compute):
+        keys = [EmbeddingCache.key(self.model_name, kind, text) for text in texts]
+        vectors = self._cache.get_many(keys)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            # 同一批中重复的文本只计算一次
+            unique = list(dict.fromkeys(texts[i] for i in missing))
+            computed = dict(zip(unique, compute(unique)))
+            for i in missing:
+                vectors[i] = computed[texts[i]]
+            self._cache.put_many([(keys[i], vectors[i]) for i in missing])
+        return vectors
+
+    def _get_text_embeddings(self, texts):
+        return self._cached('text', texts, self._inner.get_text_embedding_batch)
+
+    def _get_text_embedding(self, text):
+        return self._get_text_embeddings([text])[0]
+
+    def _get_query_embedding(self, query):
+        return self._cached('query', [query], lambda queries: [self._inner.get_query_embedding(q) for q in queries])[0]
+
+    # 缓存读写与模型计算都是阻塞的，异步接口放到线程中执行，不阻塞事件循环
+    async def _aget_query_embedding(self, query):
+        return await asyncio.to_thread(self._get_query_embedding, query)
+
+    async def _aget_text_embedding(self, text):
+        return await asyncio.to_thread(self._get_text_embedding, text)
+
+    async def _aget_text_embeddings(self, texts):
+        return await asyncio.to_thread(self._get_text_embeddings, texts)
+
+
+def get_embed_model():
+    """
+    获取嵌入模型，首次调用时加载并设置为 llama_index 的全局 embed_model。
+    模型外包一层持久化向量缓存，写入与检索中重复出现的文本不再重复计算。
+    """
+    global _embed_model
+    if _embed_model is None:
+        with _lock:
+            if _embed_model is None:
+                from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+                _embed_model = CachedEmbedding(HuggingFaceEmbedding(model_name=path), embedding_cache, model_id=path)
+                Settings.embed_model = _embed_model
+    return _embed_model
+
+
+def get_chroma_client():
+    """获取 Chroma 持久化客户端，首次调用时打开。"""
+    global _chroma_client
+    if _chroma_client is None:
+        with _lock:
+            if _chroma_client is None:
+                import chromadb
+                _chroma_client = chromadb.PersistentClient(path=persist_path)
+    return _chroma_client
+
+
+def get_reranker():
+    """获取进程内共享的重排序器，首次调用时加载模型（设备由 RERANK_DEVICE 决定，默认无GPU时用CPU）。"""
+    global _reranker
+    if _reranker is None:
+        with _lock:
+            if _reranker is None:
+                from reranker import Reranker, cross_encoder_backend
+                _reranker = Reranker(cross_encoder_backend(rerank_model_name))
+    return _reranker
+
+
+def is_warm():
+    """嵌入模型、Chroma 客户端和重排序模型是否都已加载。"""
+    return _embed_model is not None and _chroma_client is not None and _reranker is not None
+
+
+def warm_up():
+    """提前加载全部记忆相关的重资源，返回各项加载耗时（秒）。已加载的项耗时约为 0。"""
+    import time
+    timings = {}
+    for name, loader in (('embed_model', get_embed_model), ('chroma_client', get_chroma_client),
+                         ('reranker', get_reranker)):
+        start = time.perf_counter()
+        loader()
+        timings[name] = round(time.perf_counter() - start, 3)
+    print(f"[+] 记忆模型预热完成: {timings}")
+    return timings
+
+
+def _vector_store(user_id):
+    from llama_index.vector_stores.chroma import ChromaVectorStore
+    collection = get_chroma_client().get_or_create_collection(name=f"memory_{user_id}_collection")
     vector_store = ChromaVectorStore(
         chroma_collection=collection,
         collection_name=f"memory_{user_id}_collection",
     )
-    doc_id = str(uuid5(NAMESPACE_DNS, text))
-    doc = [Document(text=text,doc_id=doc_id)]
-    pipeline = IngestionPipeline(
-        transformations=[
-            Settings.embed_model,
-        ],
-        vector_store=vector_store,
-        docstore=SimpleDocumentStore()
-    )
-    pipeline.run(
-        documents=doc,  # 确保传入列表
-        in_place=True,
-        show_progress=True,
-    )
-    print(collection.count())
+    return collection, vector_store
+
+
+def add_long_memories(tags:list,user_id:str):
+    """
+    批量写入记忆标签：按文本生成确定的 doc_id，跳过向量库中已有的标签，
+    其余标签一次批量计算向量，再一次写入 Chroma。返回实际新增的条数。
+    """
+    doc_ids = {}
+    for tag in tags:
+        if tag:
+            doc_ids.setdefault(str(uuid5(NAMESPACE_DNS, tag)), tag)
+    if not doc_ids:
+        return 0
+    collection, vector_store = _vector_store(user_id)
+    existing = set(collection.get(ids=list(doc_ids), include=[])['ids'])
+    new = [(doc_id, text) for doc_id, text in doc_ids.items() if doc_id not in existing]
+    if not new:
+        return 0
+    embeddings = get_embed_model().get_text_embedding_batch([text for _, text in new])
+    vector_store.add([
+        Document(text=text, doc_id=doc_id, embedding=embedding)
+        for (doc_id, text), embedding in zip(new, embeddings)
+    ])
+    print(f"[+] 用户 {user_id} 新增 {len(new)} 条记忆标签（跳过已有 {len(doc_ids) - len(new)} 条）")
+    return len(new)
+
+def add_long_memory(text:str,user_id:str):
+    return add_long_memories([text],user_id)
 
 def get_full_long_memory(user_id:str):
-    collection = client.get_or_create_collection(name=f"memory_{user_id}_collection")
+    collection = get_chroma_client().get_or_create_collection(name=f"memory_{user_id}_collection")
     doc=collection.get(include=['documents'])
     return doc
 
-def get_simility_long_memory(state:MemoryState,user_id)->list[str]:
-    collection = client.get_or_create_collection(name=f"memory_{user_id}_collection")
-    vector_store = ChromaVectorStore(
-        chroma_collection=collection,
-        collection_name=f"memory_{user_id}_collection",
-    )
-    index = VectorStoreIndex.from_vector_store(vector_store,embed_model=Settings.embed_model)
-    retriever = index.as_retriever(
-        similarity_top_k=10  # 举例：获取最多10个结果
-    )
+def _retriever(user_id):
+    """
+    返回用户的 (collection, retriever)。检索器只在第一次使用时构建，之后从 LRU 缓存中复用；
+    检索时直接查询 Chroma 集合，新写入的记忆无需重建检索器即可被检索到。
+    """
+    with _retrievers_lock:
+        cached = _retrievers.get(user_id)
+        if cached is not None:
+            _retrievers.move_to_end(user_id)
+            return cached
+    collection, vector_store = _vector_store(user_id)
+    index = VectorStoreIndex.from_vector_store(vector_store,embed_model=get_embed_model())
+    cached = (collection, index.as_retriever(similarity_top_k=MEMORY_RETRIEVE_TOP_K))
+    with _retrievers_lock:
+        cached = _retrievers.setdefault(user_id, cached)
+        _retrievers.move_to_end(user_id)
+        while len(_retrievers) > RETRIEVER_CACHE_SIZE:
+            _retrievers.popitem(last=False)
+    return cached
+
+def retrieve_long_memory(user_id:str, query:str, top_n:int=MEMORY_RERANK_TOP_N)->list[str]:
+    """召回与 query 最相近的 MEMORY_RETRIEVE_TOP_K 条记忆，重排序后返回最相关的 top_n 条（相关度从高到低）。"""
+    collection, retriever = _retriever(user_id)
+    if not query or collection.count() == 0:
+        return []
+    nodes = retriever.retrieve(query)
+    documents = [node.get_content() for node in nodes]
+    if len(documents) <= 1:
+        return documents
+    ranked = get_reranker().rerank(query, documents, top_n)
+    return [document for document, _ in ranked]
+
+def get_simility_long_memory(state:MemoryState,runtime: Runtime[Context])->dict:
+    user_id = runtime.context.user_id
     message=state['short_memory'][-1]
-    result=retriever.retrieve(message.content)
-    print(len(result))
-    print(result)
-    rerank = SentenceTransformerRerank(
-        model=rerank_model_name,
-        top_n=3,
-        device='cuda'  # 只保留重排序后的前3个结果
-    )
+    memories = retrieve_long_memory(user_id, message.content)
+    print(f"[*] 检索到 {len(memories)} 条相关记忆")
+    return {'long_memory': memories}
 
+async def aget_simility_long_memory(state:MemoryState,runtime: Runtime[Context]):
+    """get_simility_long_memory 的异步版本。检索与重排序都在本地CPU/GPU上完成，放到线程中执行以免阻塞事件循环。"""
+    return await asyncio.to_thread(get_simility_long_memory,state,runtime)
 
 
 
-def manage_memory(state:MemoryState,runtime: Runtime[Context]):
-    # 自定义标签生成提示词
-    user_id = runtime.context.user_id
-    messages = state["short_memory"][:-1]
-    long_memory = get_full_long_memory(user_id)
+def _tag_summary_prompt(long_memory):
+    """构建记忆块标签生成的提示词，long_memory 为已有标签。"""
     system_message = """
 # 角色与目标
 你是一位专业的记忆块标签生成专家。你的核心任务是深入分析用户提供的"聊天记忆"片段，并为其生成或匹配最精准的"记忆块标签"。你的目标是确保每个标签都能高度概括记忆中的一个核心事件，并且遵循特定的匹配与创建规则。
@@ -134,9 +288,8 @@ A: 好主意！一直想去看看。那就这么定了。
 请严格按照上述规则，始终用中文输出标签内容。
 """
 
-    # 创建包含系统指令的提示词模板用于摘要生成
-    user_prompt=PromptTemplate.from_template(
-        template="""
+    # 创建包含系统指令的提示词模板用于摘要生成；已有标签作为偏变量填入
+    user_prompt="""
 现在对以下内容进行标签生成：
 
 ## 新消息内容:
@@ -146,30 +299,81 @@ A: 好主意！一直想去看看。那就这么定了。
 {existing_summary}
 
 请按照系统提示词中的规则为这些新消息生成或匹配标签。
-""",
-        partial_variables={'existing_summary':long_memory},
-
-    )
+"""
     summary_prompt = ChatPromptTemplate.from_messages([
         ("system", system_message),
-        user_prompt
-    ])
+        ("human", user_prompt)
+    ]).partial(existing_summary=long_memory)
+    return summary_prompt
+
+# 已经检查过是否需要从向量库回填标签的用户
+_backfilled_users = set()
+
+
+def _existing_tags(user_id:str)->list[str]:
+    """
+    用户已有的记忆标签，来自记忆数据库的内存缓存（写入新标签时失效），不再每轮读取整个向量集合。
+    早于标签登记的用户，其标签只保存在向量库中，进程内第一次遇到时回填一次。
+    """
+    tags=memory_db.get_all_tags(user_id)
+    if not tags and user_id not in _backfilled_users:
+        documents=get_full_long_memory(user_id).get('documents') or []
+        if documents:
+            memory_db.add_tags(user_id,documents)
+            tags=memory_db.get_all_tags(user_id)
+    _backfilled_users.add(user_id)
+    return tags
+
+def _format_tags(tags:list[str])->str:
+    return json.dumps(tags,ensure_ascii=False)
+
+def _parse_tags(summarization_result)->list[str]:
+    memory=summarization_result.running_summary.summary
+    prase=JsonOutputParser()
+    memory=prase.parse(memory)
+    return memory.get('tags',[])
+
+def manage_memory(state:MemoryState,runtime: Runtime[Context]):
+    # 自定义标签生成提示词
+    user_id = runtime.context.user_id
+    messages = state["short_memory"][:-1]
+    long_memory = _format_tags(_existing_tags(user_id))
     # 使用自定义提示词进行摘要
-    summarization_result = summarize_messages(
-        messages,
-        running_summary=None,
-        model=model,
-        max_tokens=512,
-        max_tokens_before_summary=50,
-        max_summary_tokens=50,
-        initial_summary_prompt=summary_prompt
-    )
+    with model_limit('gemini-flash-lite'):
+        summarization_result = summarize_messages(
+            messages,
+            running_summary=None,
+            model=get_llm('gemini-flash-lite'),
+            max_tokens=512,
+            max_tokens_before_summary=50,
+            max_summary_tokens=50,
+            initial_summary_prompt=_tag_summary_prompt(long_memory)
+        )
+    if summarization_result.running_summary:
+        tags=_parse_tags(summarization_result)
+        # 登记标签与对应的原始消息（同时使标签缓存失效），再写入向量库
+        memory_db.add_memory(user_id,tags,messages)
+        add_long_memories(tags,user_id)
+        return {"short_memory": [RemoveMessage(id=m.id) for m in messages[:-1]]}
+
+async def amanage_memory(state:MemoryState,runtime: Runtime[Context]):
+    """manage_memory 的异步版本：标签生成等待网络，向量写入在线程中执行。"""
+    user_id = runtime.context.user_id
+    messages = state["short_memory"][:-1]
+    long_memory = _format_tags(await asyncio.to_thread(_existing_tags,user_id))
+    async with model_limit('gemini-flash-lite'):
+        summarization_result = await asummarize_messages(
+            messages,
+            running_summary=None,
+            model=get_llm('gemini-flash-lite'),
+            max_tokens=512,
+            max_tokens_before_summary=50,
+            max_summary_tokens=50,
+            initial_summary_prompt=_tag_summary_prompt(long_memory)
+        )
     if summarization_result.running_summary:
-        memory=summarization_result.running_summary.summary
-        prase=JsonOutputParser()
-        memory=prase.parse(memory)
-        tags=memory.tags
-        for tag in tags:
-            add_long_memory(tag,user_id)
+        tags=_parse_tags(summarization_result)
+        await asyncio.to_thread(memory_db.add_memory,user_id,tags,messages)
+        await asyncio.to_thread(add_long_memories,tags,user_id)
         return {"short_memory": [RemoveMessage(id=m.id) for m in messages[:-1]]}
 
@@ -0,0 +1,192 @@
+# model_registry.py
+"""
+模型注册表：按需创建并缓存 LLM / 图片生成客户端。
+
+- 客户端在第一次使用时才创建，导入本模块不会建立任何连接。
+- 同一 base_url（Gemini / DashScope）的所有模型共享一个带 keep-alive 的 httpx 连接池，
+  避免每次调用都重新进行 TLS 握手。
+- 每个模型有独立的超时时间和并发上限（通过 model_limit 使用）。
+"""
+import asyncio
+import threading
+from collections import deque
+from dataclasses import dataclass
+
+import httpx
+from google import genai
+from google.genai import types
+from langchain_openai import ChatOpenAI
+
+import api_key
+
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com/v1beta/openai/"
+DASHSCOPE_BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+
+# 每个 base_url 的连接池大小
+POOL_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32, keepalive_expiry=60)
+
+
+@dataclass(frozen=True)
+class ModelSpec:
+    base_url: str
+    api_key: str
+    model: str
+    temperature: float
+    timeout: float  # 秒
+    max_concurrency: int
+
+
+MODEL_SPECS = {
+    'gemini-flash': ModelSpec(GEMINI_BASE_URL, api_key.google_api, "gemini-2.5-flash", 0.8, 60, 32),
+    'gemini-pro': ModelSpec(GEMINI_BASE_URL, api_key.google_api, "gemini-2.5-pro", 0.7, 180, 8),
+    'gemini-flash-lite': ModelSpec(GEMINI_BASE_URL, api_key.google_api, "gemini-2.5-flash-lite", 0.5, 30, 32),
+    'qwen-max': ModelSpec(DASHSCOPE_BASE_URL, api_key.qwen_api, "qwen-max-latest", 0.5, 60, 16),
+    'kimi': ModelSpec(DASHSCOPE_BASE_URL, api_key.qwen_api, "Moonshot-Kimi-K2-Instruct", 0.7, 60, 16),
+}
+
+IMAGE_TIMEOUT = 120  # 秒
+
+_lock = threading.Lock()
+_models = {}
+_http_clients = {}
+_async_http_clients = {}
+_limits = {}
+_genai_client = None
+
+
+def _http_client(base_url):
+    if base_url not in _http_clients:
+        _http_clients[base_url] = httpx.Client(limits=POOL_LIMITS)
+    return _http_clients[base_url]
+
+
+def _async_http_client(base_url):
+    if base_url not in _async_http_clients:
+        _async_http_clients[base_url] = httpx.AsyncClient(limits=POOL_LIMITS)
+    return _async_http_clients[base_url]
+
+
+def get_llm(name) -> ChatOpenAI:
+    """获取（必要时创建）指定名称的聊天模型。"""
+    model = _models.get(name)
+    if model is not None:
+        return model
+    with _lock:
+        if name not in _models:
+            spec = MODEL_SPECS[name]
+            _models[name] = ChatOpenAI(
+                base_url=spec.base_url,
+                api_key=spec.api_key,
+                model=spec.model,
+                temperature=spec.temperature,
+                streaming=True,
+                timeout=spec.timeout,
+                http_client=_http_client(spec.base_url),
+                http_async_client=_async_http_client(spec.base_url),
+            )
+        return _models[name]
+
+
+def get_genai_client() -> genai.Client:
+    """获取共享的 Gemini 图片生成客户端，其内部连接池在各次调用间复用。"""
+    global _genai_client
+    if _genai_client is None:
+        with _lock:
+            if _genai_client is None:
+                _genai_client = genai.Client(
+                    api_key=api_key.google_api,
+                    http_options=types.HttpOptions(timeout=IMAGE_TIMEOUT * 1000),
+                )
+    return _genai_client
+
+
+class _Waiter:
+    """排队等待许可的调用方；granted/cancelled 只在 ModelLimit._lock 内修改。"""
+    __slots__ = ('notify', 'granted', 'cancelled')
+
+    def __init__(self, notify):
+        self.notify = notify
+        self.granted = False
+        self.cancelled = False
+
+
+class ModelLimit:
+    """
+    单个模型的并发上限，同步代码用 with，异步代码用 async with，两者共享同一组许可。
+    许可释放时直接交给队首的等待者：同步调用方在线程里等待，异步调用方在事件循环上等待一个
+    Future，不占用线程池。异步等待被取消（如客户端断开）时放弃排队，已经拿到的许可会被交还。
+    """
+
+    def __init__(self, max_concurrency):
+        self._lock = threading.Lock()
+        self._available = max_concurrency
+        self._waiters = deque()
+
+    def _acquire_or_wait(self, notify):
+        """有空闲许可且无人排队时直接获取并返回 None，否则排队并返回等待者。"""
+        with self._lock:
+            if self._available > 0 and not self._waiters:
+                self._available -= 1
+                return None
+            waiter = _Waiter(notify)
+            self._waiters.append(waiter)
+            return waiter
+
+    def _release(self):
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if not waiter.cancelled:
+                    waiter.granted = True
+                    break
+            else:
+                self._available += 1
+                return
+        try:
+            waiter.notify()
+        except RuntimeError:
+            # 等待者所在的事件循环已关闭，许可交给下一个
+            self._release()
+
+    def __enter__(self):
+        event = threading.Event()
+        if self._acquire_or_wait(event.set) is not None:
+            event.wait()
+        return self
+
+    def __exit__(self, *exc):
+        self._release()
+
+    async def __aenter__(self):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            if not future.done():
+                future.set_result(None)
+
+        waiter = self._acquire_or_wait(lambda: loop.call_soon_threadsafe(wake))
+        if waiter is None:
+            return self
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                granted = waiter.granted
+                waiter.cancelled = True
+            if granted:
+                self._release()
+            raise
+        return self
+
+    async def __aexit__(self, *exc):
+        self._release()
+
+
+def model_limit(name) -> ModelLimit:
+    """获取指定模型的并发上限。"""
+    limit = _limits.get(name)
+    if limit is None:
+        with _lock:
+            limit = _limits.setdefault(name, ModelLimit(MODEL_SPECS[name].max_concurrency))
+    return limit
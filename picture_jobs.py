@@ -0,0 +1,110 @@
+# picture_jobs.py
+"""
+聊天配图的后台任务。
+
+文字回复生成后即可结束 SSE 流，配图（意图判断 + 图片生成）在线程池（Flask）或事件循环（ASGI）中完成，
+完成后把图片路径写回对应的 chat_history 行，前端通过轮询接口获取结果。
+
+提交配图任务的消息以 image_url = NULL 入库，任务结束后写回图片路径（没有图片时为空字符串），
+因此多进程部署或进程重启后也能从数据库判断配图是否仍在生成；重启后遗留的 NULL 行
+超过 PICTURE_PENDING_TIMEOUT 秒即视为已结束。
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import threading
+
+from langchain_core.messages import AIMessage
+
+from generate_content import generate_talk_picture, agenerate_talk_picture
+from get_character_full_data import SimpleDatabase
+
+# 图片生成接口不支持高并发，少量工作线程即可
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='talk_picture')
+_pending = set()
+# 数据库中配图标记的有效期（秒），应大于图片生成的超时时间
+PICTURE_PENDING_TIMEOUT = 300
+_lock = threading.Lock()
+# ASGI 链路中的异步配图任务，保留引用避免被垃圾回收
+_tasks = set()
+
+
+def _finish(message_id, image_path):
+    app_db = SimpleDatabase()
+    try:
+        app_db.update_chat_image(message_id, image_path)
+    finally:
+        app_db.close()
+        with _lock:
+            _pending.discard(message_id)
+
+
+def _picture_state(content, image_prompt):
+    state = {'short_memory': [AIMessage(content=content)]}
+    if image_prompt is not None:
+        state['image_prompt'] = image_prompt
+    return state
+
+
+def _run_talk_picture(message_id, content, image_prompt=None):
+    image_path = ''
+    try:
+        result = generate_talk_picture(_picture_state(content, image_prompt))
+        image_path = result.get('picture_path', '') or ''
+    except Exception as e:
+        print(f"聊天配图生成失败，消息ID {message_id}: {e}")
+    finally:
+        _finish(message_id, image_path)
+    return image_path
+
+
+async def _arun_talk_picture(message_id, content, image_prompt=None):
+    image_path = ''
+    try:
+        result = await agenerate_talk_picture(_picture_state(content, image_prompt))
+        image_path = result.get('picture_path', '') or ''
+    except Exception as e:
+        print(f"聊天配图生成失败，消息ID {message_id}: {e}")
+    finally:
+        await asyncio.to_thread(_finish, message_id, image_path)
+    return image_path
+
+
+def submit_talk_picture(message_id, content, image_prompt=None):
+    """
+    为一条已保存的AI消息提交配图任务，立即返回。
+    :param image_prompt: generate_talk 附带的配图提示词（配图附言模式），传入时跳过意图判断直接生成图片。
+    """
+    with _lock:
+        _pending.add(message_id)
+    return _executor.submit(_run_talk_picture, message_id, content, image_prompt)
+
+
+def asubmit_talk_picture(message_id, content, image_prompt=None):
+    """异步版本：在当前事件循环上创建配图任务（ASGI 链路使用），立即返回。"""
+    with _lock:
+        _pending.add(message_id)
+    task = asyncio.get_running_loop().create_task(_arun_talk_picture(message_id, content, image_prompt))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
+
+def is_talk_picture_pending(message_id):
+    """
+    该消息的配图任务是否仍在本进程中执行。
+    _finish 先写回图片再移除标记，所以应先调用本函数、再读取消息行，才不会读到尚未写回的旧行。
+    """
+    with _lock:
+        return message_id in _pending
+
+
+def awaiting_talk_picture(message):
+    """根据数据库中的消息行判断配图是否仍在生成（可能由其他进程执行）。"""
+    if message['message_type'] != 'ai' or message['image_url'] is not None:
+        return False
+    try:
+        created = datetime.strptime(message['timestamp'], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError):
+        return False
+    return datetime.now(timezone.utc) - created < timedelta(seconds=PICTURE_PENDING_TIMEOUT)
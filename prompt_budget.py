@@ -0,0 +1,157 @@
+# prompt_budget.py
+"""
+按 token 预算组装提示词中的聊天记录与长期记忆。
+
+- 使用本地分词器（tiktoken）计数，每条消息的 token 数按消息ID缓存，窗口中的旧消息不会重复计数。
+- 从最新的消息开始向前填充，直到用完该节点该部分的预算，再按时间顺序输出。
+- 消息格式化为紧凑的 “名字：内容” 行，而不是 repr(AIMessage(...))。
+- 每次组装都会打印各部分的 token 用量。
+
+tiktoken 的编码与 Gemini 的分词并不完全相同，这里只作为预算估算使用。
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from langchain_core.messages import BaseMessage
+
+TOKEN_ENCODING = "cl100k_base"
+# 缓存的消息条数上限
+TOKEN_CACHE_SIZE = 20000
+
+
+@dataclass(frozen=True)
+class Budget:
+    """单个节点的 token 预算。"""
+    short_messages: int
+    long_messages: int
+
+
+# 各节点的预算：聊天回复需要较多近期上下文；日记与朋友圈更依赖长期记忆
+NODE_BUDGETS = {
+    'generate_talk': Budget(short_messages=3000, long_messages=800),
+    'generate_diary': Budget(short_messages=4000, long_messages=1500),
+    'generate_dynamic_condition': Budget(short_messages=2500, long_messages=1500),
+}
+
+_CJK = re.compile(r'[\u3000-\u9fff\uff00-\uffef]')
+_encoding = None
+_encoding_failed = False
+_encoding_lock = threading.Lock()
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _get_encoding():
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        with _encoding_lock:
+            if _encoding is None and not _encoding_failed:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+                except Exception as e:
+                    # 分词表无法加载（例如离线环境）时退回到按字符估算
+                    _encoding_failed = True
+                    print(f"[!] 分词器加载失败，改为按字符估算 token 数: {e}")
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """统计文本的 token 数。"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # 估算：每个中文字符约 1 个 token，其余约 4 个字符 1 个 token
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _cached_count(key, text):
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    tokens = count_tokens(text)
+    with _cache_lock:
+        _cache[key] = tokens
+        if len(_cache) > TOKEN_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return tokens
+
+
+def format_message(message, name='你') -> str:
+    """把一条消息格式化为紧凑的一行：“用户：……” 或 “{name}：……”。"""
+    if isinstance(message, BaseMessage):
+        speaker = '用户' if message.type == 'human' else name
+        content = message.content if isinstance(message.content, str) else str(message.content)
+    else:
+        speaker, content = name, str(message)
+    return f"{speaker}：{content.strip()}"
+
+
+def message_tokens(message, line: str) -> int:
+    """一条已格式化消息的 token 数。有消息ID时按ID缓存，否则按内容哈希缓存。"""
+    message_id = getattr(message, 'id', None)
+    if message_id:
+        key = ('id', message_id, len(line))
+    else:
+        key = ('hash', hashlib.blake2b(line.encode('utf-8'), digest_size=16).digest())
+    return _cached_count(key, line)
+
+
+def fit_lines(items, budget, formatter):
+    """
+    从最新的一项开始向前装入预算，返回 (按时间顺序拼接的文本, 已用 token 数, 装入条数)。
+    最新的一项即使超出预算也会保留，保证模型至少能看到用户刚说的话。
+    """
+    selected, used = [], 0
+    for item in reversed(items):
+        line = formatter(item)
+        tokens = message_tokens(item, line) + 1  # 换行符
+        if selected and used + tokens > budget:
+            break
+        selected.append(line)
+        used += tokens
+    selected.reverse()
+    return '\n'.join(selected), used, len(selected)
+
+
+def _long_memory_items(long_memory):
+    """长期记忆可能是列表（检索结果）或 {问题: 回忆} 字典，统一转换为文本列表（越靠后越相关/越新）。"""
+    if not long_memory:
+        return []
+    if isinstance(long_memory, dict):
+        items = [f"用户询问了{query}，引发了你的过往回忆，该段回忆为：{memory}" for query, memory in long_memory.items()]
+    else:
+        items = [item.content if isinstance(item, BaseMessage) else str(item) for item in long_memory]
+    # 检索结果按相关度从高到低排列，反转后由 fit_lines 优先装入最相关的几条
+    return list(reversed(items))
+
+
+def assemble(node: str, short_memory, long_memory, name='你'):
+    """
+    按节点预算格式化近期聊天记录与长期记忆。
+    :return: ({'short_messages': 文本, 'long_messages': 文本}, 用量字典)
+    """
+    budget = NODE_BUDGETS[node]
+    short_text, short_used, short_count = fit_lines(
+        list(short_memory or []), budget.short_messages, lambda m: format_message(m, name)
+    )
+    long_items = _long_memory_items(long_memory)
+    long_text, long_used, long_count = fit_lines(long_items, budget.long_messages, lambda m: f"- {m}")
+    usage = {
+        'short_messages': {'tokens': short_used, 'budget': budget.short_messages,
+                           'messages': short_count, 'available': len(short_memory or [])},
+        'long_messages': {'tokens': long_used, 'budget': budget.long_messages,
+                          'messages': long_count, 'available': len(long_items)},
+    }
+    print(f"[prompt] {node} " + '  '.join(
+        f"{section}={u['tokens']}/{u['budget']} tokens ({u['messages']}/{u['available']} 条)"
+        for section, u in usage.items()
+    ))
+    return {'short_messages': short_text, 'long_messages': long_text or '（暂无）'}, usage
@@ -0,0 +1,108 @@
+# reranker.py
+"""
+进程内共享的交叉编码器重排序。
+
+原先每次检索都新建一个 SentenceTransformerRerank（每次都加载一遍模型），且写死 device='cuda'，
+在只有CPU的机器上直接失败。这里整个进程只加载一次模型，设备可配置（默认有GPU用GPU，否则CPU）。
+
+并发请求的 (查询, 文档) 对会在几毫秒的窗口内合并成一批，一次前向计算完成打分，
+再按请求拆分结果，CPU 上的吞吐量明显高于逐个请求调用模型。
+
+配置（环境变量）：
+    RERANK_DEVICE       cpu / cuda，默认自动选择
+    RERANK_BATCH_SIZE   一次前向计算最多包含的 (查询, 文档) 对数，默认 64
+    RERANK_BATCH_MS     合并并发请求的等待窗口（毫秒），默认 3
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+RERANK_DEVICE = os.environ.get('RERANK_DEVICE')
+RERANK_BATCH_SIZE = int(os.environ.get('RERANK_BATCH_SIZE', 64))
+RERANK_BATCH_MS = float(os.environ.get('RERANK_BATCH_MS', 3))
+
+
+def default_device():
+    """未配置 RERANK_DEVICE 时，有可用的 GPU 就用 GPU，否则用 CPU。"""
+    if RERANK_DEVICE:
+        return RERANK_DEVICE
+    try:
+        import torch
+        return 'cuda' if torch.cuda.is_available() else 'cpu'
+    except ImportError:
+        return 'cpu'
+
+
+def cross_encoder_backend(model_name, device=None):
+    """加载交叉编码器，返回 predict(pairs) -> 分数列表。"""
+    from sentence_transformers import CrossEncoder
+    model = CrossEncoder(model_name, device=device or default_device())
+    print(f"[+] 重排序模型已加载: {model_name} ({model.model.device})")
+
+    def predict(pairs):
+        return [float(score) for score in model.predict(pairs, batch_size=RERANK_BATCH_SIZE,
+                                                         show_progress_bar=False)]
+    return predict
+
+
+class Reranker:
+    """
+    合并并发请求的重排序器。
+    :param predict: 可调用对象 predict(pairs) -> 分数列表，pairs 为 [(查询, 文档), ...]。
+    :param batch_size: 一批最多包含的 (查询, 文档) 对数（单个请求超过时仍作为一整批）。
+    :param batch_ms: 合并并发请求的等待窗口（毫秒）。
+    """
+
+    def __init__(self, predict, batch_size=RERANK_BATCH_SIZE, batch_ms=RERANK_BATCH_MS):
+        self._predict = predict
+        self.batch_size = batch_size
+        self.batch_seconds = batch_ms / 1000.0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='reranker', daemon=True)
+        self._thread.start()
+
+    def scores(self, query, documents) -> list[float]:
+        """为每个文档计算与查询的相关度分数。"""
+        if not documents:
+            return []
+        future = Future()
+        self._queue.put(([(query, document) for document in documents], future))
+        return future.result()
+
+    def rerank(self, query, documents, top_n) -> list[tuple[str, float]]:
+        """返回按相关度从高到低排列的前 top_n 个 (文档, 分数)。"""
+        ranked = sorted(zip(documents, self.scores(query, documents)), key=lambda item: item[1], reverse=True)
+        return ranked[:top_n]
+
+    def _collect(self, first):
+        batch = [first]
+        size = len(first[0])
+        deadline = time.monotonic() + self.batch_seconds
+        while size < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect(self._queue.get())
+            pairs = [pair for item_pairs, _ in batch for pair in item_pairs]
+            try:
+                scores = self._predict(pairs)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            offset = 0
+            for item_pairs, future in batch:
+                future.set_result(scores[offset:offset + len(item_pairs)])
+                offset += len(item_pairs)
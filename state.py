@@ -1,18 +1,33 @@
+import os
 from dataclasses import dataclass
-from operator import add
 
-from langgraph.graph import MessagesState
+from langgraph.graph import MessagesState, add_messages
 from typing import Annotated, List
 from langchain_core.messages import AnyMessage
 
+# 短期记忆窗口容量（条）。更早的消息不再保存在图状态里，只保留在 chat_history 中
+SHORT_MEMORY_WINDOW = int(os.environ.get('SHORT_MEMORY_WINDOW', 40))
+
+
+def window_messages(left: List[AnyMessage], right: List[AnyMessage]) -> List[AnyMessage]:
+    """
+    短期记忆的 reducer：节点只返回本轮新增的消息（或 RemoveMessage），
+    按 add_messages 的规则合并（按ID去重/替换/删除）后只保留最近 SHORT_MEMORY_WINDOW 条，
+    因此检查点大小与每轮序列化耗时不随对话长度增长。
+    """
+    merged = add_messages(left or [], right or [])
+    return merged[-SHORT_MEMORY_WINDOW:]
+
+
 class MemoryState(MessagesState):
-    short_memory:Annotated[List[AnyMessage],'短期记忆',add]
-    long_memory:Annotated[List[AnyMessage],'长期记忆']
+    short_memory:Annotated[List[AnyMessage],'短期记忆',window_messages]
+    long_memory:Annotated[List[str],'长期记忆：检索并重排序后最相关的几条记忆（相关度从高到低）']
     character_name:Annotated[str,'人物名称']
     character_profile:Annotated[str,'人物背景介绍']
     diary: Annotated[str, "日记内容"]
     dynamic_condition: Annotated[dict, "朋友圈动态"]
     picture_path: Annotated[str, "聊天图片路径"]
+    image_prompt: Annotated[str, "generate_talk 附带的配图提示词（配图附言模式），空字符串表示不配图"]
     dynamic_condition_picture_path: Annotated[list[str], "朋友圈动态图片路径"]
     talk_number:int
 
@@ -76,7 +76,8 @@ document.addEventListener('DOMContentLoaded', () => {
         if (!baseUrl || !baseUrl.startsWith('/')) {
             return baseUrl || 'assets/default_avatar.png';
         }
-        if (baseUrl.includes('?token=') || baseUrl.includes('&token=')) {
+        // 服务端返回的图片/头像地址已经带有签名（sig=），保持原样以便浏览器缓存
+        if (baseUrl.includes('sig=') || baseUrl.includes('?token=') || baseUrl.includes('&token=')) {
             return baseUrl;
         }
         if (state.token) {
@@ -157,7 +158,7 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     };
 
-    const addChatMessage = (type, { text, imageUrl }) => {
+    const createChatMessage = (type, { text, imageUrl }) => {
         const messageDiv = document.createElement('div');
         const isUserMessage = type === 'user' || type === 'human';
         const displayType = isUserMessage ? 'user' : 'ai';
@@ -177,11 +178,53 @@ document.addEventListener('DOMContentLoaded', () => {
                 ${imageHtml}
             </div>
         `;
+        return messageDiv;
+    };
+
+    const addChatMessage = (type, content) => {
+        const messageDiv = createChatMessage(type, content);
         appElements.chatWindow.appendChild(messageDiv);
         appElements.chatWindow.scrollTop = appElements.chatWindow.scrollHeight;
         return messageDiv;
     };
 
+    // --- 聊天记录分页：先加载最新一页，向上翻页时按 next_before 继续读取更早的消息 ---
+    const fetchHistoryPage = (before) => {
+        const query = before ? `?before=${before}` : '';
+        return api.request(`/characters/${state.currentCharacter.id}/history${query}`);
+    };
+
+    const renderLoadMoreButton = (page) => {
+        const oldButton = appElements.chatWindow.querySelector('.load-more-history');
+        if (oldButton) oldButton.remove();
+        if (!page.has_more) return;
+        const button = document.createElement('button');
+        button.className = 'load-more-history';
+        button.textContent = '加载更早的消息';
+        button.addEventListener('click', async () => {
+            button.disabled = true;
+            try {
+                const characterId = state.currentCharacter.id;
+                const olderPage = await fetchHistoryPage(page.next_before);
+                // 等待期间用户已切换角色
+                if (!state.currentCharacter || state.currentCharacter.id !== characterId) return;
+                // 插入到顶部，并保持当前可见内容的位置不跳动
+                const previousHeight = appElements.chatWindow.scrollHeight;
+                const fragment = document.createDocumentFragment();
+                olderPage.messages.forEach(msg => {
+                    fragment.appendChild(createChatMessage(msg.message_type, { text: msg.content, imageUrl: msg.image_url }));
+                });
+                button.after(fragment);
+                appElements.chatWindow.scrollTop += appElements.chatWindow.scrollHeight - previousHeight;
+                renderLoadMoreButton(olderPage);
+            } catch (error) {
+                console.error('加载更早的聊天记录失败:', error);
+                button.disabled = false;
+            }
+        });
+        appElements.chatWindow.prepend(button);
+    };
+
     // --- Event Handlers & Logic ---
     const handleLogin = async (e) => {
         e.preventDefault();
@@ -263,14 +306,15 @@ document.addEventListener('DOMContentLoaded', () => {
             appElements.openDiaryBtn.classList.remove('has-notification');
             showView('app');
 
-            const history = await api.request(`/characters/${state.currentCharacter.id}/history`);
+            const page = await fetchHistoryPage();
             appElements.chatWindow.innerHTML = '';
 
-            if (history && history.length > 0) {
-                history.forEach(msg => {
+            if (page && page.messages.length > 0) {
+                page.messages.forEach(msg => {
                     addChatMessage(msg.message_type, { text: msg.content, imageUrl: msg.image_url });
                 });
             }
+            renderLoadMoreButton(page);
 
         } catch (error) {
             console.error("selectCharacter 出错:", error);
@@ -305,6 +349,46 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     };
 
+    const attachImageToMessage = (messageDiv, imageUrl) => {
+        const bubble = messageDiv.querySelector('.message-bubble');
+        const img = document.createElement('img');
+        img.src = getAuthenticatedUrl(imageUrl);
+        img.alt = 'Generated image';
+        img.className = 'message-image';
+        img.onerror = () => { img.onerror = null; img.style.display = 'none'; };
+        bubble.appendChild(img);
+        appElements.chatWindow.scrollTop = appElements.chatWindow.scrollHeight;
+    };
+
+    const pollMessageImage = async (characterId, messageId, messageDiv, attempt = 0) => {
+        if (!messageDiv || attempt >= 60) return;
+        try {
+            const result = await api.request(`/characters/${characterId}/messages/${messageId}/image`);
+            if (result.status === 'pending') {
+                setTimeout(() => pollMessageImage(characterId, messageId, messageDiv, attempt + 1), 2000);
+            } else if (result.url && messageDiv.isConnected) {
+                attachImageToMessage(messageDiv, result.url);
+            }
+        } catch (error) {
+            console.error('获取配图失败:', error);
+        }
+    };
+
+    // 朋友圈/日记在后台任务队列中生成，完成后点亮对应按钮的提醒
+    const pollJob = async (characterId, jobId, notifyBtn, attempt = 0) => {
+        if (attempt >= 120) return;
+        try {
+            const job = await api.request(`/characters/${characterId}/jobs/${jobId}`);
+            if (job.status === 'done') {
+                notifyBtn.classList.add('has-notification');
+            } else if (job.status !== 'failed') {
+                setTimeout(() => pollJob(characterId, jobId, notifyBtn, attempt + 1), 5000);
+            }
+        } catch (error) {
+            console.error('查询后台任务失败:', error);
+        }
+    };
+
     const handleSendMessage = async () => {
         const text = appElements.messageInput.value.trim();
         if (!text) return;
@@ -338,7 +422,13 @@ document.addEventListener('DOMContentLoaded', () => {
                     try {
                         const data = JSON.parse(jsonData);
 
-                        if (data.type === 'text') {
+                        if (data.type === 'delta') {
+                            // 逐token追加到当前AI气泡，最终的 'text' 事件会用完整内容覆盖
+                            if (!currentAiMessageBubble) {
+                                currentAiMessageBubble = addChatMessage('ai', { text: '' });
+                            }
+                            currentAiMessageBubble.querySelector('p').textContent += data.content;
+                        } else if (data.type === 'text') {
                             if (!currentAiMessageBubble) {
                                 currentAiMessageBubble = addChatMessage('ai', { text: data.content });
                             } else {
@@ -348,12 +438,19 @@ document.addEventListener('DOMContentLoaded', () => {
                             if (data.url) {
                                 currentAiMessageBubble = addChatMessage('ai', { text: '', imageUrl: data.url });
                             }
+                        } else if (data.type === 'image_pending') {
+                            // 配图在后台生成，文字回复结束后再轮询结果
+                            pollMessageImage(state.currentCharacter.id, data.message_id, currentAiMessageBubble);
                         } else if (data.type === 'event') {
                             console.log('Received event:', data.event_name);
                             if (data.event_name === 'new_moment_available') {
                                 appElements.openMomentsBtn.classList.add('has-notification');
                             } else if (data.event_name === 'new_diary_available') {
                                 appElements.openDiaryBtn.classList.add('has-notification');
+                            } else if (data.event_name === 'moment_job_queued') {
+                                pollJob(state.currentCharacter.id, data.job_id, appElements.openMomentsBtn);
+                            } else if (data.event_name === 'diary_job_queued') {
+                                pollJob(state.currentCharacter.id, data.job_id, appElements.openDiaryBtn);
                             }
                         } else if (data.type === 'done') {
                             console.log('Stream finished.');